@@ -13,6 +13,11 @@ def orm(db, mocker):
     mocker.patch('gips.data.core.orm.use_orm', return_value=True)
     yield db
 
+@pytest.fixture(autouse=True)
+def no_query_cache(mocker):
+    """Keep tests isolated from the persistent cache of query results."""
+    mocker.patch('gips.data.core.QueryCache.enabled', False)
+
 @pytest.fixture
 def mpo(mocker):
     """Just to save typing."""
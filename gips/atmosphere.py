@@ -40,6 +40,12 @@ import tarfile
 import re
 import glob
 import copy
+import json
+import sqlite3
+import contextlib
+import math
+import itertools
+import multiprocessing
 
 import numpy
 import netCDF4
@@ -96,12 +102,265 @@ def atmospheric_model(doy, lat):
     return model
 
 
+def earth_sun_factor(doy):
+    """Return 6S' earth-sun distance factor for solar irradiance on the given day."""
+    return 1.0 / (1 - 0.01673 * math.cos(0.0172 * (doy - 4))) ** 2
+
+
+def configure_sixs(s, aod):
+    """Configure the given SixS object's aerosols and surface.
+
+    Common to SIXS and SixsLut.
+    """
+    # Aerosols
+    # TODO - dynamically adjust AeroProfile?
+    s.aero_profile = AeroProfile.PredefinedType(AeroProfile.Continental)
+
+    # sixs throws IEEE_UNDERFLOW_FLAG IEEE_DENORMAL for small aod.
+    # and if using a predefined AeroProfile, visible or aot550 must be
+    # specified.   Small here was determined emprically on my laptop, and
+    # visible = 1000 km is essentially setting the visibility to infinite.
+    if aod < 0.0103:
+        s.visible = 1000
+    else:
+        s.aot550 = aod
+
+    # Other settings
+    s.ground_reflectance = GroundReflectance.HomogeneousLambertian(GroundReflectance.GreenVegetation)
+    s.atmos_corr = AtmosCorr.AtmosCorrLambertianFromRadiance(1.0)
+
+
+def _run_lut_point(args):
+    """Run 6S for one point of a SixsLut's grid; for multiprocessing."""
+    wavelengths, sensor, model, solar_z, view_z, raz, aod = args
+    s = SixS()
+    s.geometry = Geometry.User()
+    s.geometry.solar_z, s.geometry.solar_a = solar_z, 0
+    s.geometry.view_z, s.geometry.view_a = view_z, raz
+    s.geometry.month, s.geometry.day = SixsLut.ref_month, SixsLut.ref_day
+    s.altitudes = Altitudes()
+    s.altitudes.set_target_sea_level()
+    s.altitudes.set_sensor_satellite_level()
+    s.atmos_profile = model
+    configure_sixs(s, aod)
+    return SIXS.run_sixs(s, wavelengths, sensor)
+
+
+def sensor_wavelengths(sensor_md):
+    """Return (low, high) wavelengths of a sensor's non-thermal bands.
+
+    sensor_md is an entry from a driver's Asset._sensors.
+    """
+    if 'bandbounds' in sensor_md:
+        bounds = sensor_md['bandbounds']
+    else:
+        bounds = [(loc - width / 2.0, loc + width / 2.0) for (loc, width)
+                  in zip(sensor_md['bandlocs'], sensor_md['bandwidths'])]
+    return [b for (c, b) in zip(sensor_md['colors'], bounds) if c[0:4] != 'LWIR']
+
+
+class SixsLut(object):
+    """Lookup table of 6S results, for interpolating instead of running 6S.
+
+    Results are stored for each band's wavelengths, on a grid of solar
+    zenith, view zenith, relative azimuth (all in degrees), AOD, and
+    atmospheric model; see default_grid.  They're computed for the
+    reference date, when the earth-sun distance is about 1 AU, and
+    scaled by earth_sun_factor for lookups.  Models are matched exactly,
+    and the other inputs interpolated linearly.  6S is run for the
+    sensor, which matters for those SIXS.run_sixs has spectral response
+    functions for; lookups for such sensors only use LUTs built for them.
+    """
+    default_grid = {
+        'solar_z': [0, 10, 20, 30, 40, 50, 60, 70, 80],
+        'view_z': [0, 5, 10, 15],
+        'raz': [0, 45, 90, 135, 180],
+        'aod': [0.0, 0.05, 0.1, 0.2, 0.4, 0.8],
+        'model': [1, 2, 3, 4, 5],
+    }
+    axes = ('solar_z', 'view_z', 'raz', 'aod') # interpolated dimensions
+    ref_month, ref_day, ref_doy = 4, 5, 95
+    _loaded = {} # LUTs loaded so far in this process, by path
+
+    def __init__(self, wavelengths, grid, coefs, sensor=None):
+        """coefs' dimensions are band, model, then axes, then (T, Lu, Ld)."""
+        self.wavelengths = [tuple(round(w, 4) for w in wv) for wv in wavelengths]
+        self.grid = grid
+        self.coefs = coefs
+        self.sensor = sensor
+        self._interpolators = {}
+
+    @classmethod
+    def build(cls, wavelengths, grid=None, nprocs=1, sensor=None):
+        """Run 6S for each band at each point of the grid; returns a SixsLut.
+
+        grid entries override default_grid's.
+        """
+        grid = dict(cls.default_grid, **(grid or {}))
+        dims = [grid['model']] + [grid[a] for a in cls.axes]
+        points = [(wavelengths, sensor) + p for p in itertools.product(*dims)]
+        verbose_out('Running 6S at {} points'.format(len(points)), 2)
+        with contextlib.closing(multiprocessing.Pool(nprocs)) as pool:
+            results = pool.map(_run_lut_point, points)
+        # point-major to band-major
+        coefs = numpy.array(results).reshape(
+            [len(d) for d in dims] + [len(wavelengths), 3])
+        return cls(wavelengths, grid, numpy.moveaxis(coefs, -2, 0), sensor)
+
+    @classmethod
+    def load(cls, path):
+        """Return the LUT saved at the path, loading it only once per process."""
+        if path not in cls._loaded:
+            with numpy.load(path) as npz:
+                grid = {k: npz[k].tolist() for k in cls.default_grid}
+                # LUTs saved before sensors were recorded were all run without SRFs
+                sensor = str(npz['sensor']) if 'sensor' in npz.files else ''
+                cls._loaded[path] = cls(npz['wavelengths'].tolist(), grid, npz['coefs'],
+                                        sensor or None)
+        return cls._loaded[path]
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            numpy.savez(f, wavelengths=numpy.array(self.wavelengths), coefs=self.coefs,
+                        sensor=numpy.array(self.sensor or ''), **self.grid)
+
+    def lookup(self, wavelengths, atmos_model, solar_z, view_z, raz, aod, doy, sensor=None):
+        """Return [(T, Lu, Ld), ...] per band, as SIXS.run_sixs does.
+
+        Returns None if any band or input is outside of the LUT, or if
+        6S would be run differently for the sensor than it was for the LUT.
+        """
+        srf = lambda name: name if name in SIXS.srf_runners else None
+        if srf(sensor) != srf(self.sensor):
+            return None
+        point = [solar_z, view_z, raz, aod]
+        if atmos_model not in self.grid['model'] or not all(
+                self.grid[a][0] <= v <= self.grid[a][-1]
+                for (a, v) in zip(self.axes, point)):
+            return None
+        try:
+            bands = [self.wavelengths.index(tuple(round(w, 4) for w in wv))
+                     for wv in wavelengths]
+        except ValueError:
+            return None
+        model = self.grid['model'].index(atmos_model)
+        factor = earth_sun_factor(doy) / earth_sun_factor(self.ref_doy)
+        coefs = []
+        for b in bands:
+            t, Lu, Ld = self._interpolator(b, model)([point])[0]
+            coefs.append((float(t), float(Lu) * factor, float(Ld) * factor))
+        return coefs
+
+    def validate(self, n, nprocs=1, seed=0):
+        """Compare lookups at n random inputs against running 6S directly.
+
+        Returns the maximum relative errors found for T, Lu, and Ld.
+        """
+        rng = numpy.random.RandomState(seed)
+        points = [[int(rng.choice(self.grid['model']))]
+                  + [rng.uniform(self.grid[a][0], self.grid[a][-1]) for a in self.axes]
+                  for _ in range(n)]
+        with contextlib.closing(multiprocessing.Pool(nprocs)) as pool:
+            direct = numpy.array(pool.map(
+                _run_lut_point, [tuple([self.wavelengths, self.sensor] + p) for p in points]))
+        looked_up = numpy.array([self.lookup(self.wavelengths, *p, doy=self.ref_doy,
+                                             sensor=self.sensor) for p in points])
+        errors = abs(looked_up - direct) / numpy.maximum(abs(direct), 1e-9)
+        return errors.reshape(-1, 3).max(axis=0)
+
+    def _interpolator(self, band, model):
+        if (band, model) not in self._interpolators:
+            from scipy.interpolate import RegularGridInterpolator
+            self._interpolators[(band, model)] = RegularGridInterpolator(
+                [self.grid[a] for a in self.axes], self.coefs[band, model])
+        return self._interpolators[(band, model)]
+
+
+class SixsCache(object):
+    """Persistent cache of 6S results, shared between scenes.
+
+    Configured by the SIXS_CACHE setting, a dict with 'path', the sqlite
+    file in which to keep results, and optionally 'steps', a dict of
+    tolerances overriding default_steps.  Inputs are rounded to multiples
+    of their steps to make the lookup key, so scenes with similar
+    location, geometry, date, and AOD share results.
+    """
+    default_steps = {
+        'lat': 0.5, 'lon': 0.5,          # degrees
+        'solar_z': 1.0, 'solar_a': 2.0,  # degrees
+        'view_z': 1.0, 'view_a': 5.0,    # degrees
+        'doy': 8,                        # days; for earth-sun distance
+        'aod': 0.01,
+    }
+    # process-wide statistics for verbose output
+    hits = 0
+    misses = 0
+
+    def __init__(self, path, steps=None):
+        self.path = path
+        self.steps = dict(self.default_steps, **(steps or {}))
+
+    @classmethod
+    def from_settings(cls):
+        """Return a SixsCache per the SIXS_CACHE setting, or None if unset."""
+        config = getattr(utils.settings(), 'SIXS_CACHE', None)
+        if not config:
+            return None
+        return cls(config['path'], config.get('steps'))
+
+    def key(self, sensor, wavelengths, atmos_model, **inputs):
+        """Return a lookup key for the given 6S inputs.
+
+        inputs must be named as in `steps`.
+        """
+        quantized = {k: int(round(v / self.steps[k])) for (k, v) in inputs.items()}
+        return json.dumps([sensor, [[round(w, 4) for w in wv] for wv in wavelengths],
+                           atmos_model, sorted(quantized.items())])
+
+    def _execute(self, sql, params=()):
+        with contextlib.closing(sqlite3.connect(self.path, timeout=30)) as conn:
+            with conn: # commits on success
+                conn.execute('CREATE TABLE IF NOT EXISTS sixs'
+                             ' (key TEXT PRIMARY KEY, results TEXT)')
+                return conn.execute(sql, params).fetchall()
+
+    def get(self, key):
+        """Return the saved [(T, Lu, Ld), ...] for the key, else None."""
+        rows = self._execute('SELECT results FROM sixs WHERE key=?', (key,))
+        if rows:
+            SixsCache.hits += 1
+            return json.loads(rows[0][0])
+        SixsCache.misses += 1
+        return None
+
+    def put(self, key, results):
+        """Save 6S results, as [(T, Lu, Ld), ...], under the key."""
+        self._execute('INSERT OR REPLACE INTO sixs VALUES (?, ?)',
+                      (key, json.dumps(results)))
+
+    def stats(self):
+        return '{} hits, {} misses'.format(self.hits, self.misses)
+
+
 class SIXS():
     """ Class for running 6S atmospheric model """
     # TODO - genericize to move away from landsat specific
 
-    def __init__(self, bandnums, wavelengths, geometry, date_time, sensor=None):
-        """ Run SixS atmospheric model using Py6S """
+    # sensors run with 6S's spectral response functions, by SixSHelpers.Wavelengths'
+    # functions; other sensors' bands are run as plain wavelength ranges
+    srf_runners = {
+        'LT5': 'run_landsat_tm',
+        'LT7': 'run_landsat_etm',
+        # LC8 doesn't seem to work
+        #'LC8': 'run_landsat_oli'
+    }
+
+    def __init__(self, bandnums, wavelengths, geometry, date_time, sensor=None, lut=None):
+        """ Run SixS atmospheric model using Py6S
+
+        If `lut` is the path to a SixsLut, results are interpolated from
+        it instead when possible.
+        """
         start = datetime.datetime.now()
         verbose_out('Running atmospheric model (6S)', 2)
 
@@ -116,41 +375,56 @@ class SIXS():
 
         doy = (date_time - datetime.datetime(date_time.year, 1, 1)).days + 1
         # Atmospheric profile
-        s.atmos_profile = atmospheric_model(doy, geometry['lat'])
-
-        # Aerosols
-        # TODO - dynamically adjust AeroProfile?
-        s.aero_profile = AeroProfile.PredefinedType(AeroProfile.Continental)
+        atmos_model = atmospheric_model(doy, geometry['lat'])
+        s.atmos_profile = atmos_model
 
         self.aod = aodData.get_aod(
             geometry['lat'], geometry['lon'], date_time.date()
         )
+        configure_sixs(s, self.aod[1])
+
+        g = s.geometry
+        coefs = None
+        if lut is not None:
+            raz = abs((g.solar_a - g.view_a + 180) % 360 - 180)
+            coefs = SixsLut.load(lut).lookup(wavelengths, atmos_model, g.solar_z,
+                                             g.view_z, raz, self.aod[1], doy, sensor)
+            verbose_out('6S LUT ' + ('lacks the inputs; running 6S' if coefs is None
+                                     else 'used'), 3)
+
+        cache = SixsCache.from_settings()
+        if coefs is None and cache is not None:
+            cache_key = cache.key(sensor, wavelengths, atmos_model,
+                                  lat=geometry['lat'], lon=geometry['lon'],
+                                  solar_z=g.solar_z, solar_a=g.solar_a,
+                                  view_z=g.view_z, view_a=g.view_a,
+                                  doy=doy, aod=self.aod[1])
+            coefs = cache.get(cache_key)
+            verbose_out('6S cache {} ({})'.format(
+                'miss' if coefs is None else 'hit', cache.stats()), 3)
+
+        if coefs is None:
+            coefs = self.run_sixs(s, wavelengths, sensor)
+            if cache is not None:
+                cache.put(cache_key, coefs)
 
-        # sixs throws IEEE_UNDERFLOW_FLAG IEEE_DENORMAL for small aod.
-        # and if using a predefined AeroProfile, visible or aot550 must be
-        # specified.   Small here was determined emprically on my laptop, and
-        # visible = 1000 km is essentially setting the visibility to infinite.
-        if self.aod[1] < 0.0103:
-            s.visible = 1000
-        else:
-            s.aot550 = self.aod[1]
+        self.results = {}
+        verbose_out("{:>6} {:>8}{:>8}{:>8}".format('Band', 'T', 'Lu', 'Ld'), 4)
+        for b, (t, Lu, Ld) in enumerate(coefs):
+            self.results[bandnums[b]] = [t, Lu, Ld]
+            verbose_out("{:>6}: {:>8.3f}{:>8.2f}{:>8.2f}".format(bandnums[b], t, Lu, Ld), 4)
 
-        # Other settings
-        s.ground_reflectance = GroundReflectance.HomogeneousLambertian(GroundReflectance.GreenVegetation)
-        s.atmos_corr = AtmosCorr.AtmosCorrLambertianFromRadiance(1.0)
+        verbose_out('Ran atmospheric model in %s' % str(datetime.datetime.now() - start), 2)
 
+    @staticmethod
+    def run_sixs(s, wavelengths, sensor):
+        """Run the configured SixS object; return [(T, Lu, Ld), ...] per band."""
         # Used for testing
-        funcs = {
-            'LT5': SixSHelpers.Wavelengths.run_landsat_tm,
-            'LT7': SixSHelpers.Wavelengths.run_landsat_etm,
-            # LC8 doesn't seem to work
-            #'LC8': SixSHelpers.Wavelengths.run_landsat_oli
-        }
-        if sensor in funcs.keys():
+        if sensor in SIXS.srf_runners:
             saved_stdout = sys.stdout
             try:
                 sys.stdout = open(os.devnull, 'w')
-                wvlens, outputs = funcs[sensor](s)
+                wvlens, outputs = getattr(SixSHelpers.Wavelengths, SIXS.srf_runners[sensor])(s)
             finally:
                 sys.stdout = saved_stdout
         else:
@@ -161,16 +435,13 @@ class SIXS():
                 s.run()
                 outputs.append(s.outputs)
 
-        self.results = {}
-        verbose_out("{:>6} {:>8}{:>8}{:>8}".format('Band', 'T', 'Lu', 'Ld'), 4)
-        for b, out in enumerate(outputs):
+        coefs = []
+        for out in outputs:
             t = out.trans['global_gas'].upward
             Lu = out.atmospheric_intrinsic_radiance
             Ld = (out.direct_solar_irradiance + out.diffuse_solar_irradiance + out.environmental_irradiance) / numpy.pi
-            self.results[bandnums[b]] = [t, Lu, Ld]
-            verbose_out("{:>6}: {:>8.3f}{:>8.2f}{:>8.2f}".format(bandnums[b], t, Lu, Ld), 4)
-
-        verbose_out('Ran atmospheric model in %s' % str(datetime.datetime.now() - start), 2)
+            coefs.append((t, Lu, Ld))
+        return coefs
 
 
 class MODTRAN():
@@ -121,20 +121,23 @@ class SpatialExtent(object):
                 # TODO [:-4] is a poor assumption:
                 vectorfile = os.path.join(os.path.dirname(rastermask),
                                           os.path.basename(rastermask)[:-4] + '.shp')
-                features = open_vector(utils.vectorize(rastermask, vectorfile), where='DN=1')
-                for f in features:
-                    extents.append(cls(dataclass, feature=f, rastermask=rastermask,
-                                        tiles=tiles, pcov=pcov, ptile=ptile))
+                features = list(open_vector(utils.vectorize(rastermask, vectorfile), where='DN=1'))
             else:
-                features = open_vector(site, key, where)
-                for f in features:
-                    extents.append(cls(dataclass, feature=f, rastermask=None,
-                                       tiles=tiles, pcov=pcov, ptile=ptile))
+                features = list(open_vector(site, key, where))
+            # find every feature's tiles in one pass over the tile index
+            coverages = dataclass.Asset.Repository.vectors2tiles(features, pcov, ptile, tiles)
+            for f, coverage in zip(features, coverages):
+                extents.append(cls(dataclass, feature=f, rastermask=rastermask,
+                                   tiles=tiles, coverage=coverage))
         return extents
 
     def __init__(self, dataclass, tiles, pcov=None, ptile=None,
-                 feature=None, rastermask=None):
-        """ Create spatial extent with a GeoFeature instance or list of tiles """
+                 feature=None, rastermask=None, coverage=None):
+        """ Create spatial extent with a GeoFeature instance or list of tiles
+
+        coverage, if given, is the feature's vector2tiles result, which is
+        then not recomputed.
+        """
         self.repo = dataclass.Asset.Repository
 
         # TODO - try and close this and only open on demand (make site property)
@@ -142,7 +145,9 @@ class SpatialExtent(object):
         self.rastermask = rastermask
 
         if feature is not None:
-            tiles = self.repo.vector2tiles(feature, pcov, ptile, tiles)
+            if coverage is None:
+                coverage = self.repo.vector2tiles(feature, pcov, ptile, tiles)
+            tiles = coverage
             self.feature = (feature.filename(), feature.layer_name(), feature.fid())
             self.sitename = feature.basename()
         else:
@@ -203,10 +208,32 @@ class TemporalExtent(object):
 
     def prune_dates(self, dates):
         """ Prune down given list of dates to those that meet temporal extent """
-        dates = list(set(dates))
-        datecheck = lambda d: self.datebounds[0] <= d <= self.datebounds[1]
-        daycheck = lambda d: self.daybounds[0] <= int(d.strftime('%j')) <= self.daybounds[1]
-        return sorted([d for d in dates if datecheck(d) and daycheck(d)])
+        return sorted([d for d in set(dates) if self.includes(d)])
+
+    def includes(self, date):
+        """ Whether the date is within both the date bounds and the day-of-year bounds """
+        return (self.datebounds[0] <= date <= self.datebounds[1]
+                and self.daybounds[0] <= date.timetuple().tm_yday <= self.daybounds[1])
+
+    def date_ranges(self):
+        """ Return (first, last) date pairs covering exactly the dates in the extent
+
+        A single range unless the day-of-year bounds exclude some days, in which case
+        there's one range per year.
+        """
+        (first, last) = self.datebounds
+        if self.daybounds[0] <= 1 and self.daybounds[1] >= 366:
+            return [(first, last)]
+        ranges = []
+        for year in range(first.year, last.year + 1):
+            jan1 = datetime.date(year, 1, 1)
+            start = jan1 + datetime.timedelta(days=self.daybounds[0] - 1)
+            end = min(jan1 + datetime.timedelta(days=self.daybounds[1] - 1),
+                      datetime.date(year, 12, 31))
+            (start, end) = (max(start, first), min(end, last))
+            if start <= end:
+                ranges.append((start, end))
+        return ranges
 
     @classmethod
     def _parse_date(cls, dstring, last=False):
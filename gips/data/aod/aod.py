@@ -75,6 +75,10 @@ class aodRepository(Repository):
         """ There are no tiles -- so use the "one tile" style """
         return {cls._the_tile: (1, 1)}
 
+    @classmethod
+    def vectors2tiles(cls, vectors, *args, **kwargs):
+        return [cls.vector2tiles(v) for v in vectors]
+
 
 class aodAsset(Asset):
     Repository = aodRepository
@@ -304,6 +308,43 @@ class aodData(Data):
             raise Exception('No filenames provided')
         return imgout
 
+    # AOD rasters are global 1-degree grids, so whole arrays are cheap to keep
+    # in memory; callers slice them instead of re-reading files for each scene.
+    @classmethod
+    @lru_cache(maxsize=32) # a month or so of dates
+    def _aod_array(cls, date, fetch):
+        """Return the date's AOD as a read-only array with NaN for nodata."""
+        # this is just for fetching the data
+        inv = cls.inventory(dates=date.strftime('%Y-%j'), fetch=fetch, products=['aod'])
+        img = inv[date].tiles[cls.Asset.Repository._the_tile].open('aod')
+        vals = img[0].read()
+        # TODO - do this automagically in swig wrapper
+        vals = numpy.where(vals == img[0].nodata(), numpy.nan, vals)
+        vals.flags.writeable = False
+        return vals
+
+    @classmethod
+    @lru_cache(maxsize=32) # lta.tif plus recent ltad files
+    def _composite_arrays(cls, filename, mtime, nodata):
+        """Return a mean/var file's bands as read-only arrays with NaN for nodata.
+
+        mtime is part of the cache key so rewritten composites are re-read.
+        """
+        img = gippy.GeoImage(filename)
+        arrays = []
+        for band in (img[0], img[1]):
+            vals = band.read()
+            vals = numpy.where(vals == nodata, numpy.nan, vals)
+            vals.flags.writeable = False
+            arrays.append(vals)
+        return tuple(arrays)
+
+    @classmethod
+    def clear_caches(cls):
+        """Forget AOD arrays read so far; needed if assets are replaced."""
+        cls._aod_array.cache_clear()
+        cls._composite_arrays.cache_clear()
+
     @classmethod
     def _read_point(cls, filename, roi, nodata):
         """ Read single point from mean/var file and return if valid, or mean/var of 3x3 neighborhood """
@@ -313,11 +354,10 @@ class aodData(Data):
         if not os.path.exists(filename):
             return (numpy.nan, numpy.nan)
         with utils.error_handler('Unable to read point from {}'.format(filename), continuable=True):
-            img = gippy.GeoImage(filename)
-            vals = img[0].read()[x0:x1,y0:y1].squeeze()
-            variances = img[1].read()[x0:x1,y0:y1]
-            vals[numpy.where(vals == nodata)] = numpy.nan
-            variances[numpy.where(variances == nodata)] = numpy.nan
+            means, variances = cls._composite_arrays(
+                filename, os.path.getmtime(filename), nodata)
+            vals = means[x0:x1,y0:y1].squeeze()
+            variances = variances[x0:x1,y0:y1]
             val = numpy.nan
             var = numpy.nan
             if ~numpy.isnan(vals[1, 1]):
@@ -328,7 +368,6 @@ class aodData(Data):
                 var = variances[1, 1]
             elif numpy.any(~numpy.isnan(variances)):
                 var = numpy.mean(variances[~numpy.isnan(variances)])
-            img = None
             return (val, var)
         return (numpy.nan, numpy.nan)
 
@@ -351,15 +390,8 @@ class aodData(Data):
         aod = numpy.nan
 
         with utils.error_handler('Unable to load aod values', continuable=True):
-
-            # this is just for fetching the data
-            inv = cls.inventory(dates=date.strftime('%Y-%j'), fetch=fetch, products=['aod'])
-            img = inv[date].tiles[cls.Asset.Repository._the_tile].open('aod')
-            vals = img[0].read()[x0:x1,y0:y1]
-            # TODO - do this automagically in swig wrapper
-            vals[numpy.where(vals == img[0].nodata())] = numpy.nan
+            vals = cls._aod_array(date, fetch)[x0:x1,y0:y1]
             aod = vals[1, 1]
-            img = None
             source = 'MODIS (MOD08_D3)'
              # if invalid center but valid vals exist in 3x3
             if numpy.isnan(aod) and numpy.any(~numpy.isnan(vals)):
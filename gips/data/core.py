@@ -23,8 +23,9 @@
 
 import os
 import sys
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import glob
+import fnmatch
 import re
 from itertools import groupby
 import tarfile
@@ -34,10 +35,21 @@ import traceback
 import ftplib
 import shutil
 import subprocess
-import urllib
-from http.cookiejar import CookieJar
+import urllib.parse
 import argparse
 import importlib
+import threading
+import concurrent.futures
+import sqlite3
+import pickle
+import inspect
+import contextlib
+import time
+import csv
+import gzip
+import io
+import itertools
+import email.utils
 
 # from functools import lru_cache <-- python 3.2+ can do this instead
 from backports.functools_lru_cache import lru_cache
@@ -119,8 +131,8 @@ class GoogleStorageMixin(object):
         params = {'prefix': prefix}
         if delimiter is not None:
             params['delimiter'] = delimiter
-        r = requests.get(cls._gs_query_url_base.format(cls.gs_bucket_name),
-                         params=params)
+        r = utils.http_session().get(
+            cls._gs_query_url_base.format(cls.gs_bucket_name), params=params)
         r.raise_for_status()
         return r.json()
 
@@ -142,12 +154,12 @@ class GoogleStorageMixin(object):
                           giveup=_gs_stop_trying)
     def gs_backoff_downloader(cls, src, dst, chunk_size=512 * 1024):
         '''Download following the exponential backoff protocol.'''
-        r = requests.get(src, stream=True)# NOTE the stream=True
-        r.raise_for_status()
-        with open(dst, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=chunk_size):
-                if chunk: # filter out keep-alive new chunks
-                    f.write(chunk)
+        with utils.http_session().get(src, stream=True) as r:# NOTE the stream=True
+            r.raise_for_status()
+            with open(dst, 'wb') as f:
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    if chunk: # filter out keep-alive new chunks
+                        f.write(chunk)
 
     @classmethod
     @backoff.on_exception(backoff.expo,
@@ -157,7 +169,7 @@ class GoogleStorageMixin(object):
     def gs_backoff_get(cls, src, stream=False):
         '''This follows backoff proto until handed func exit.  Still could
         encounter HTTP503s then.'''
-        r = requests.get(src, stream=stream)# NOTE the stream=True
+        r = utils.http_session().get(src, stream=stream)# NOTE the stream=True
         r.raise_for_status()
         return r
 
@@ -224,7 +236,15 @@ class Repository(object):
     # valid sub directories in repo
     _subdirs = ['tiles', 'stage', 'quarantine', 'composites']
 
-    default_settings = {}
+    # defaults for all drivers; drivers set their own in default_settings too
+    default_settings = {
+        'fetch-workers': 1, # number of concurrent asset queries & downloads
+        'query-cache-ttl': 30, # days to keep query results; 0 to disable
+        'persist-dir-index': False, # save directory listings between runs; see DirectoryIndex
+        'acquisition-calendar': True, # fetch only on plausible dates; see Asset.acquisition_calendar
+        'catalog': True, # look up scenes in the local SceneCatalog if it's been loaded
+        'output-profile': None, # write products & mosaics per utils.output_profile, eg 'cog'
+    }
 
     @classmethod
     def in_stage(cls, base_fn):
@@ -267,12 +287,11 @@ class Repository(object):
         """ Get list of dates available in repository for a tile """
         if orm.use_orm():
             return dbinv.list_dates(cls.name.lower(), tile)
-        tdir = cls.data_path(tile=tile)
-        if os.path.exists(tdir):
-            return sorted([datetime.strptime(os.path.basename(d), cls._datedir).date()
-                           for d in os.listdir(tdir)])
-        else:
+        listing = DirectoryIndex.get(cls).listing(cls.data_path(tile=tile))
+        if listing is None:
             return []
+        (files, subdirs) = listing
+        return sorted([datetime.strptime(d, cls._datedir).date() for d in files + subdirs])
 
     @classmethod
     def validate_setting(cls, key, value):
@@ -307,6 +326,8 @@ class Repository(object):
             return cls.validate_setting(key, r[key])
         if key in cls.default_settings:
             return cls.default_settings[key]
+        if key in Repository.default_settings:
+            return Repository.default_settings[key]
 
         # not in settings file nor default, so resort to magic
         clsname = importlib.import_module('gips.data.%s' % dataclass)
@@ -338,44 +359,47 @@ class Repository(object):
 
     @classmethod
     def managed_request(cls, url, verbosity=1, debuglevel=0):
-        """Visit the given http URL and return the response.
-
-        Uses auth settings and cls._manager_url, and also follows custom
-        weird redirects (specific to Earthdata servers seemingly).
-        Returns urllib.urlopen(...), or None if errors are encountered.
-        debuglevel is ultimately passed in to httplib; if >0, http info,
-        such as headers, will be printed on standard out.
+        """Visit the given http URL and return the response body.
+
+        Uses utils.http_session, so requests count toward its per-host
+        connection limit.  Credentials are only sent to cls._manager_url,
+        and cookies are kept for the duration of the call; custom weird
+        redirects (specific to Earthdata servers seemingly) are followed.
+        Returns a file-like object holding the body, or None if errors are
+        encountered.  If debuglevel is >0, http info, such as headers, will
+        be printed on standard out.
         """
-        username = cls.get_setting('username')
-        password = cls.get_setting('password')
-        manager_url = cls._manager_url
-        password_manager = urllib.request.HTTPPasswordMgrWithDefaultRealm()
-        password_manager.add_password(
-            None, manager_url, username, password)
-        cookie_jar = CookieJar()
-        opener = urllib.request.build_opener(
-            urllib.request.HTTPBasicAuthHandler(password_manager),
-            urllib.request.HTTPHandler(debuglevel=debuglevel),
-            urllib.request.HTTPSHandler(debuglevel=debuglevel),
-            urllib.request.HTTPCookieProcessor(cookie_jar))
-        urllib.request.install_opener(opener)
+        auth = (cls.get_setting('username'), cls.get_setting('password'))
+        manager_host = urllib.parse.urlsplit(cls._manager_url).netloc
+        session = utils.http_session()
+        cookies = requests.cookies.RequestsCookieJar()
         try: # try instead of error handler because the exceptions have funny values to unpack
-            request = urllib.request.Request(url)
-            response = urllib.request.urlopen(request)
-            redirect_url = response.geturl()
-            # some data centers do it differently
-            if "redirect" in redirect_url: # TODO is this the right way to detect redirects?
-                utils.verbose_out('Redirected to ' + redirect_url, 3)
-                redirect_url += "&app_type=401"
-                request = urllib.Request(redirect_url)
-                response = urllib.urlopen(request)
-            return response
-        except urllib.error.URLError as e:
-            utils.verbose_out('{} gave bad response: {}'.format(url, e.reason),
-                              verbosity, sys.stderr)
+            for _ in range(session.max_redirects):
+                host = urllib.parse.urlsplit(url).netloc
+                with session.get(url, cookies=cookies, allow_redirects=False,
+                                 auth=auth if host == manager_host else None) as r:
+                    if debuglevel > 0:
+                        print('{} {}\n{}'.format(r.status_code, url, r.headers))
+                    cookies.update(r.cookies)
+                    if r.is_redirect:
+                        url = urllib.parse.urljoin(url, r.headers['location'])
+                        continue
+                    # some data centers do it differently
+                    if "redirect" in url and "app_type=401" not in url: # TODO is this the right way to detect redirects?
+                        utils.verbose_out('Redirected to ' + url, 3)
+                        url += "&app_type=401"
+                        continue
+                    r.raise_for_status()
+                    return io.BytesIO(r.content)
+            raise requests.TooManyRedirects(
+                'Exceeded {} redirects'.format(session.max_redirects))
+        except requests.HTTPError as e:
+            utils.verbose_out('{} gave bad response: {} {}'.format(
+                url, e.response.status_code, e.response.reason),
+                verbosity, sys.stderr)
             return None
-        except urllib.error.HTTPError as e:
-            utils.verbose_out('{} gave bad response: {} {}'.format(url, e.code, e.reason),
+        except requests.RequestException as e:
+            utils.verbose_out('{} gave bad response: {}'.format(url, e),
                               verbosity, sys.stderr)
             return None
 
@@ -388,51 +412,496 @@ class Repository(object):
     @classmethod
     def vector2tiles(cls, vector, pcov=0.0, ptile=0.0, tilelist=None):
         """ Return matching tiles and coverage % for provided vector """
-        from osgeo import ogr, osr
+        return cls.vectors2tiles([vector], pcov, ptile, tilelist)[0]
 
-        # open tiles vector
-        v = open_vector(cls.get_setting('tiles'))
-        shp = ogr.Open(v.filename())
+    @classmethod
+    def vectors2tiles(cls, vectors, pcov=0.0, ptile=0.0, tilelist=None):
+        """Return a list of vector2tiles' results, one per vector.
+
+        Uses the driver's TileIndex so many vectors cost one read of the
+        tiles vector.  Drivers that override vector2tiles should override
+        this too.
+        """
+        index = TileIndex.get(cls)
+        results = []
+        for vector in vectors:
+            tiles = index.coverage(vector)
+            # remove any tiles not in tilelist or that do not meet thresholds for % cover
+            results.append({t: c for (t, c) in tiles.items()
+                            if c[0] >= pcov / 100.0 and c[1] >= ptile / 100.0
+                            and (tilelist is None or t in tilelist)})
+        return results
+
+
+class TileIndex(object):
+    """Spatial index of a driver's tiles vector, shared process-wide.
+
+    Tile names and geometries are read from the vector with OGR once, and
+    kept in a shapely STRtree for coverage queries.  They're also pickled
+    to a file in the driver's stage directory, which is rebuilt when the
+    vector's mtime changes, so later processes needn't read the vector.
+    """
+    filename = '.tile-index.pickle'
+    _indexes = {} # by (Repository class, 'tiles' setting)
+
+    def __init__(self, vector_fn, mtime, tiles, wkbs, srs_wkt):
+        from shapely import wkb
+        from shapely.strtree import STRtree
+        self.vector_fn = vector_fn
+        self.mtime = mtime
+        self.tiles = tiles
+        self.srs_wkt = srs_wkt
+        self.geoms = [wkb.loads(w) for w in wkbs]
+        self._tree = STRtree(self.geoms)
+        self._positions = {id(g): i for (i, g) in enumerate(self.geoms)}
+        self._transforms = {} # by site srs
+
+    @staticmethod
+    def _mtime(fn):
+        return os.path.getmtime(fn) if os.path.isfile(fn) else None
+
+    @classmethod
+    def get(cls, repo):
+        """Return the repository's TileIndex, loading it if needed."""
+        setting = repo.get_setting('tiles')
+        index = cls._indexes.get((repo, setting))
+        if index is None or index.mtime != cls._mtime(index.vector_fn):
+            index = cls._indexes[(repo, setting)] = cls._load(repo, setting)
+        return index
+
+    @classmethod
+    def _load(cls, repo, setting):
+        """Load the index from the repo's cache file, or else the tiles vector."""
+        from osgeo import ogr
+        v = open_vector(setting)
+        vector_fn = v.filename()
+        mtime = cls._mtime(vector_fn)
+        key = (setting, vector_fn, v.layer_name(), mtime)
+        cache_fn = os.path.join(repo.path('stage'), cls.filename)
+        if mtime is not None and os.path.exists(cache_fn):
+            try:
+                with open(cache_fn, 'rb') as f:
+                    cached = pickle.load(f)
+                if cached['key'] == key:
+                    return cls(vector_fn, mtime, *cached['index'])
+            except (EnvironmentError, EOFError, pickle.UnpicklingError, KeyError) as e:
+                utils.verbose_out('Ignoring tile index {}: {}'.format(cache_fn, e), 2)
+
+        utils.verbose_out('Indexing tiles in ' + vector_fn, 3)
+        shp = ogr.Open(vector_fn)
         if v.layer_name() == '':
             layer = shp.GetLayer(0)
         else:
             layer = shp.GetLayer(v.layer_name())
-
+        tiles, wkbs = [], []
+        for feat in layer:
+            tiles.append(repo.feature2tile(feat))
+            wkbs.append(bytes(feat.GetGeometryRef().ExportToWkb()))
+        index = (tiles, wkbs, layer.GetSpatialRef().ExportToWkt())
+
+        if mtime is not None:
+            tmp_fn = '{}.{}'.format(cache_fn, os.getpid())
+            try:
+                with open(tmp_fn, 'wb') as f:
+                    pickle.dump({'key': key, 'index': index}, f, pickle.HIGHEST_PROTOCOL)
+                os.rename(tmp_fn, cache_fn)
+            except EnvironmentError as e:
+                utils.verbose_out('Unable to save tile index {}: {}'.format(cache_fn, e), 2)
+        return cls(vector_fn, mtime, *index)
+
+    def _transform(self, srs):
+        """Return a transformation from the given srs to the tiles' srs."""
+        from osgeo import osr
+        if srs not in self._transforms:
+            tiles_srs = osr.SpatialReference(self.srs_wkt)
+            if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+                # x, y order, as OGR uses for layers' srs
+                tiles_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            self._transforms[srs] = osr.CoordinateTransformation(
+                osr.SpatialReference(srs), tiles_srs)
+        return self._transforms[srs]
+
+    def coverage(self, vector):
+        """Return {tile: (fraction of vector covered, fraction of tile covered)}.
+
+        Only tiles that overlap the vector are included.
+        """
+        from osgeo import ogr
         # create and warp site geometry
         ogrgeom = ogr.CreateGeometryFromWkt(vector.wkt_geometry())
-        srs = osr.SpatialReference(vector.srs())
-        trans = osr.CoordinateTransformation(srs, layer.GetSpatialRef())
-        ogrgeom.Transform(trans)
+        ogrgeom.Transform(self._transform(vector.srs()))
         # convert to shapely
         geom = loads(ogrgeom.ExportToWkt())
         geom = geom if geom.is_valid else geom.buffer(0)  # bugfix: attempt to fix topology errors
 
-        # find overlapping tiles
         tiles = {}
-        layer.SetSpatialFilter(ogrgeom)
-        layer.ResetReading()
-        feat = layer.GetNextFeature()
-        while feat is not None:
-            tgeom = loads(feat.GetGeometryRef().ExportToWkt())
+        for hit in self._tree.query(geom):
+            # shapely < 2 returns geometries, later versions their positions
+            i = self._positions[id(hit)] if hasattr(hit, 'geom_type') else int(hit)
+            tgeom = self.geoms[i]
             if tgeom.intersects(geom):
                 area = geom.intersection(tgeom).area
                 if area != 0:
-                    tile = cls.feature2tile(feat)
-                    tiles[tile] = (area / geom.area, area / tgeom.area)
-            feat = layer.GetNextFeature()
-
-        # remove any tiles not in tilelist or that do not meet thresholds for % cover
-        remove_tiles = []
-        if tilelist is None:
-            tilelist = tiles.keys()
-        for t in tiles:
-            if (tiles[t][0] < (pcov / 100.0)) or (tiles[t][1] < (ptile / 100.0)) or t not in tilelist:
-                remove_tiles.append(t)
-        for t in remove_tiles:
-            tiles.pop(t, None)
+                    tiles[self.tiles[i]] = (area / geom.area, area / tgeom.area)
         return tiles
 
 
+class DirectoryIndex(object):
+    """In-memory index of the directories in a repository's tiles directory.
+
+    Used by the filesystem inventory (GIPS_ORM = False) in place of
+    repeated os.listdir & glob calls:  Each directory is listed once with
+    os.scandir, after which Asset.discover_asset, Data.find_files, and
+    Repository.find_dates are answered from memory.  A directory's entry
+    is reused only while its mtime is unchanged, so files added or removed
+    since are noticed at the cost of a stat.  If the driver's
+    'persist-dir-index' setting is True, the index is also saved in the
+    stage directory for later runs.
+    """
+    filename = '.dir-index.pickle'
+    _indexes = {} # by (Repository class, tiles directory)
+
+    def __init__(self, path=None, dirs=None):
+        self.path = path # for saving the index; None to not save
+        self.dirs = dirs or {} # dir path: (mtime, files, subdirectories)
+        self._dirty = False
+
+    @classmethod
+    def get(cls, repo):
+        """Return the repository's DirectoryIndex, loading it if needed."""
+        key = (repo, repo.path('tiles'))
+        if key not in cls._indexes:
+            path = None
+            dirs = None
+            if repo.get_setting('persist-dir-index'):
+                path = os.path.join(repo.path('stage'), cls.filename)
+                if os.path.exists(path):
+                    try:
+                        with open(path, 'rb') as f:
+                            dirs = pickle.load(f)
+                    except (EnvironmentError, EOFError, pickle.UnpicklingError) as e:
+                        utils.verbose_out('Ignoring directory index {}: {}'.format(path, e), 2)
+            cls._indexes[key] = cls(path, dirs)
+        return cls._indexes[key]
+
+    def listing(self, path):
+        """Return (files, subdirectories) in the directory, or None if it doesn't exist.
+
+        Both are tuples of sorted basenames; symlinks are followed.
+        """
+        path = os.path.normpath(path)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except EnvironmentError:
+            return None
+        entry = self.dirs.get(path)
+        if entry is None or entry[0] != mtime:
+            files, subdirs = [], []
+            for de in os.scandir(path):
+                if de.is_dir():
+                    subdirs.append(de.name)
+                elif de.is_file():
+                    files.append(de.name)
+            entry = self.dirs[path] = (mtime, tuple(sorted(files)), tuple(sorted(subdirs)))
+            self._dirty = True
+        return entry[1:]
+
+    def find_files(self, regex, path):
+        """Like utils.find_files, but served from the index."""
+        listing = self.listing(path)
+        if listing is None:
+            return []
+        compiled_re = re.compile(regex)
+        return [os.path.join(path, f) for f in listing[0] if compiled_re.match(f)]
+
+    def glob(self, path, pattern):
+        """Like glob.glob(os.path.join(path, pattern)) for files, served from the index."""
+        listing = self.listing(path)
+        if listing is None:
+            return []
+        names = listing[0]
+        if not pattern.startswith('.'):
+            names = [n for n in names if not n.startswith('.')] # as glob does
+        return [os.path.join(path, f) for f in fnmatch.filter(names, pattern)]
+
+    def save(self):
+        """Save the index if it's to be persisted and has changed."""
+        if self.path is None or not self._dirty:
+            return
+        tmp_path = '{}.{}'.format(self.path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(self.dirs, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, self.path)
+            self._dirty = False
+        except EnvironmentError as e:
+            utils.verbose_out('Unable to save directory index {}: {}'.format(self.path, e), 2)
+
+
+class QueryCache(object):
+    """Persistent store of an Asset class's query_service results.
+
+    Results, including finding nothing, are saved in an sqlite database
+    in the driver's stage directory, so repeated fetches needn't contact
+    the data provider again.  Entries expire after the driver's
+    'query-cache-ttl' setting, in days.  Data may still be on its way
+    for dates within an asset type's 'latency', so entries for those
+    expire after an hour instead.  Entries are kept per the values of
+    the Asset class's query_settings, so changing those settings doesn't
+    serve results found before.  Each thread keeps a connection to the
+    database open; see get_cache() for each Asset class's cache.
+    """
+    enabled = True # set to False to bypass all query caches
+    filename = '.query-cache.sqlite3'
+    recent_ttl = 3600 # seconds
+    _caches = {} # by Asset class
+    _schema = ('CREATE TABLE IF NOT EXISTS queries (asset TEXT, tile TEXT,'
+               ' date TEXT, kwargs TEXT, expires REAL, result BLOB,'
+               ' PRIMARY KEY (asset, tile, date, kwargs))')
+
+    def __init__(self, asset_cls):
+        self.asset_cls = asset_cls
+        self.path = os.path.join(asset_cls.Repository.path('stage'), self.filename)
+        # only kwargs query_service declares can affect its results
+        params = inspect.signature(asset_cls.query_service).parameters.values()
+        self.kwarg_names = set(
+            p.name for p in params if p.name not in ('asset', 'tile', 'date')
+            and p.kind not in (p.VAR_POSITIONAL, p.VAR_KEYWORD))
+        self._local = threading.local() # conn & pid for this thread
+
+    @classmethod
+    def get_cache(cls, asset_cls):
+        """Return the Asset class's QueryCache."""
+        if asset_cls not in cls._caches:
+            cls._caches[asset_cls] = cls(asset_cls)
+        return cls._caches[asset_cls]
+
+    def _connection(self):
+        """Return this thread's connection to the cache, opening it if needed."""
+        conn = getattr(self._local, 'conn', None)
+        # sqlite connections mustn't be used across fork
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute(self._schema)
+            (self._local.conn, self._local.pid) = (conn, os.getpid())
+        return conn
+
+    def _execute(self, sql, params=()):
+        conn = self._connection()
+        with conn: # commits on success
+            return conn.execute(sql, params).fetchall()
+
+    def _key(self, asset, tile, date, fetch_kwargs):
+        kwargs = sorted((k, v) for (k, v) in fetch_kwargs.items()
+                        if k in self.kwarg_names)
+        settings = [(k, self.asset_cls.get_setting(k)) for k in self.asset_cls.query_settings]
+        return (asset, tile, date.strftime('%Y-%m-%d'), repr((kwargs, settings)))
+
+    def ttl(self, asset, date):
+        """Return how many seconds a result for the arguments stays valid."""
+        ttl = self.asset_cls.Repository.get_setting('query-cache-ttl') * 86400
+        latency = self.asset_cls._assets.get(asset, {}).get('latency', 0)
+        day = date.date() if isinstance(date, datetime) else date
+        # latencies are approximate, so allow a day's grace
+        if (datetime.now().date() - day).days <= latency + 1:
+            return min(ttl, self.recent_ttl)
+        return ttl
+
+    def get(self, asset, tile, date, fetch_kwargs):
+        """Return (True, result) if a result is cached, else (False, None)."""
+        if not self.enabled:
+            return False, None
+        try:
+            rows = self._execute(
+                'SELECT result FROM queries WHERE asset=? AND tile=?'
+                ' AND date=? AND kwargs=? AND expires>?',
+                self._key(asset, tile, date, fetch_kwargs) + (time.time(),))
+        except sqlite3.Error as e:
+            utils.verbose_out('Query cache unavailable: {}'.format(e), 3)
+            return False, None
+        if not rows:
+            return False, None
+        return True, pickle.loads(rows[0][0])
+
+    def put(self, asset, tile, date, fetch_kwargs, result):
+        """Save a result from query_service for the arguments."""
+        ttl = self.ttl(asset, date)
+        if not self.enabled or ttl <= 0:
+            return
+        try:
+            self._execute('INSERT OR REPLACE INTO queries VALUES (?, ?, ?, ?, ?, ?)',
+                          self._key(asset, tile, date, fetch_kwargs)
+                          + (time.time() + ttl, pickle.dumps(result)))
+        except sqlite3.Error as e:
+            utils.verbose_out('Query cache unavailable: {}'.format(e), 3)
+
+    def purge(self):
+        """Delete all the cache's entries."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local.conn = None
+        if os.path.exists(self.path):
+            utils.verbose_out('Removing query cache ' + self.path, 2)
+            os.remove(self.path)
+
+
+class SceneCatalog(object):
+    """Local index of the scenes a data provider holds, for an Asset class.
+
+    Some providers publish a bulk index of their holdings, such as the
+    index.csv.gz files in google's public landsat & sentinel-2 buckets.
+    update() loads one into an sqlite database in the driver's stage
+    directory, which the driver consults instead of searching the
+    provider's storage over the network; see Asset.catalog.  The index
+    is only trusted for dates an asset type's 'latency' before it was
+    last modified, since data for later dates may not have arrived then.
+    """
+    filename = '.scene-catalog.sqlite3'
+    _catalogs = {} # by Asset class
+    _schema = ('CREATE TABLE IF NOT EXISTS scenes (scene TEXT PRIMARY KEY, tile TEXT,'
+               ' date TEXT, sensor TEXT, cloud_cover REAL, prefix TEXT);'
+               'CREATE INDEX IF NOT EXISTS scenes_tile_date ON scenes (tile, date);'
+               'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);')
+    batch_size = 10000 # rows per executemany in update()
+
+    def __init__(self, asset_cls):
+        self.asset_cls = asset_cls
+        self.path = os.path.join(asset_cls.Repository.path('stage'), self.filename)
+        self._updated = None
+
+    @classmethod
+    def get(cls, asset_cls):
+        """Return the Asset class's SceneCatalog."""
+        if asset_cls not in cls._catalogs:
+            cls._catalogs[asset_cls] = cls(asset_cls)
+        return cls._catalogs[asset_cls]
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.executescript(self._schema)
+        return conn
+
+    def _meta(self, conn, key):
+        row = conn.execute('SELECT value FROM meta WHERE key=?', (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def updated(self):
+        """Return the date the loaded index was last modified, or None if none is loaded."""
+        if self._updated is None and os.path.exists(self.path):
+            try:
+                with contextlib.closing(self._connect()) as conn:
+                    updated = self._meta(conn, 'updated')
+            except sqlite3.Error as e:
+                utils.verbose_out('Scene catalog unavailable: {}'.format(e), 3)
+                return None
+            if updated is not None:
+                self._updated = datetime.strptime(updated, '%Y-%m-%d').date()
+        return self._updated
+
+    def covers(self, date, latency=0):
+        """Whether the catalog is trusted for the date, given the asset type's latency."""
+        updated = self.updated()
+        day = date.date() if isinstance(date, datetime) else date
+        return updated is not None and day <= updated - timedelta(latency)
+
+    def scenes(self, tile, dates, latency=0):
+        """Return the tile's scenes for each of the dates the catalog covers.
+
+        Returns {date: [(scene, sensor, cloud_cover, prefix), ...]},
+        sorted by scene; dates not covered are left out.
+        """
+        dates = [d for d in dates if self.covers(d, latency)]
+        if not dates:
+            return {}
+        days = {(d.date() if isinstance(d, datetime) else d).isoformat(): d for d in dates}
+        found = {d: [] for d in dates}
+        with contextlib.closing(self._connect()) as conn:
+            rows = conn.execute(
+                'SELECT date, scene, sensor, cloud_cover, prefix FROM scenes'
+                ' WHERE tile=? AND date BETWEEN ? AND ? ORDER BY scene',
+                (tile, min(days), max(days)))
+            for row in rows:
+                if row[0] in days:
+                    found[days[row[0]]].append(row[1:])
+        return found
+
+    def update(self, source=None):
+        """Load scenes the catalog lacks from the provider's bulk index.
+
+        source is a URL or path for a gzipped CSV index, by default the
+        Asset class's catalog_index_url.  Nothing is read if the index
+        is unchanged since the last update, going by its ETag or
+        modification time; otherwise only new scenes are written.
+        Returns the number of scenes added.
+        """
+        source = source or self.asset_cls.catalog_index_url
+        with contextlib.closing(self._connect()) as conn:
+            old_stamp = self._meta(conn, 'stamp') if self._meta(conn, 'source') == source else None
+            with contextlib.ExitStack() as stack:
+                if '://' in source:
+                    headers = {} if old_stamp is None else {'If-None-Match': old_stamp}
+                    r = stack.enter_context(
+                        utils.http_session().get(source, stream=True, headers=headers))
+                    if r.status_code == 304:
+                        utils.verbose_out('Scene catalog is up to date with ' + source, 2)
+                        return 0
+                    r.raise_for_status()
+                    stamp = r.headers.get('ETag')
+                    modified = r.headers.get('Last-Modified')
+                    modified = (datetime.now(timezone.utc) if modified is None
+                                else email.utils.parsedate_to_datetime(modified))
+                    f = r.raw
+                else:
+                    st = os.stat(source)
+                    stamp = '{}:{}'.format(st.st_mtime, st.st_size)
+                    if stamp == old_stamp:
+                        utils.verbose_out('Scene catalog is up to date with ' + source, 2)
+                        return 0
+                    modified = datetime.fromtimestamp(st.st_mtime, timezone.utc)
+                    f = stack.enter_context(open(source, 'rb'))
+                if source.endswith('.gz'):
+                    f = gzip.GzipFile(fileobj=f)
+                reader = csv.DictReader(io.TextIOWrapper(f, encoding='utf-8', newline=''))
+                rows = self.asset_cls.catalog_rows(reader)
+                utils.verbose_out('Loading scene catalog from ' + source, 2)
+                changes = conn.total_changes
+                with conn:
+                    while True:
+                        batch = list(itertools.islice(rows, self.batch_size))
+                        if not batch:
+                            break
+                        conn.executemany(
+                            'INSERT OR IGNORE INTO scenes VALUES (?, ?, ?, ?, ?, ?)', batch)
+                    added = conn.total_changes - changes
+                    conn.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)', (
+                        ('source', source), ('stamp', stamp),
+                        ('updated', modified.date().isoformat())))
+        self._updated = None
+        return added
+
+
+# results of Asset.query_service_batch; see Asset.preload_queries
+_preloaded_queries = {}
+
+# archiving is check-then-link, so serialize it when fetching concurrently
+_archive_lock = threading.Lock()
+
+# how asset sidecars record acquisition times, which are in UTC
+_acquired_format = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+
+def in_revisit_cycle(date, reference, period, slack=timedelta(0)):
+    """Whether the UTC day of the given date comes within slack of an acquisition.
+
+    Acquisitions are taken to repeat every period (a timedelta) before
+    and after reference, a naive UTC datetime.  For use by
+    Asset.acquisition_calendar.
+    """
+    offset = (datetime(date.year, date.month, date.day) - reference) % period
+    return offset <= slack or offset + timedelta(days=1) > period - slack
+
+
 class Asset(object):
     """ Class for a single file asset (usually an original raw file or archive) """
     Repository = Repository
@@ -530,9 +999,112 @@ class Asset(object):
         """
         return self.get_geofeature().wkt_geometry()
 
+    def extract_metadata(self):
+        """Return attributes of the asset file worth recording when it's archived.
+
+        Standard keys are 'size' & 'mtime' of the file, and where known,
+        'cloud-cover' (percent) and 'acquired' (a UTC datetime).  Extend
+        this to record other values that are slow to extract but handy
+        when searching the inventory; they need to be JSON-serializable.
+        See metadata().
+        """
+        st = os.stat(self.filename)
+        return {'size': st.st_size, 'mtime': st.st_mtime}
+
+    # URL of the provider's bulk index of its scenes; see SceneCatalog
+    catalog_index_url = None
+
+    # driver settings that query_service's results depend on, such as which
+    # provider to use; they're part of the QueryCache key
+    query_settings = ()
+
+    @classmethod
+    def catalog_rows(cls, reader):
+        """Generate SceneCatalog rows from the provider's bulk index.
+
+        reader is a csv.DictReader of catalog_index_url; generate
+        (scene, tile, date, sensor, cloud_cover, prefix) for each scene
+        of interest, where date is in ISO format, cloud_cover may be
+        None, and scene & prefix are however the driver identifies &
+        finds scenes.
+        """
+        raise NotImplementedError('catalog_rows not supported for ' + cls.__name__)
+
+    @classmethod
+    def acquisition_calendar(cls, asset_type, tile):
+        """Return a function telling whether the asset could exist for a date.
+
+        The function takes a date and returns a boolean; dates() uses it
+        to skip dates the provider can't have an asset for, such as
+        those between a satellite's revisits.  Returns None, meaning
+        any day is possible, unless a driver overrides it.  The driver's
+        'acquisition-calendar' setting turns the calendar off if False.
+        """
+        return None
+
     ##########################################################################
     # Child classes should not generally have to override anything below here
     ##########################################################################
+    _metadata = None # see metadata()
+
+    @staticmethod
+    def sidecar_filename(filename):
+        """Return the name of the hidden JSON file holding the asset's recorded metadata."""
+        (path, bname) = os.path.split(filename)
+        return os.path.join(path, '.' + bname + '.json')
+
+    def metadata(self):
+        """Return the metadata recorded for the asset, or {} if there isn't any.
+
+        It's recorded when the asset is archived, by record_metadata(),
+        and is loaded from the inventory DB or else the asset's sidecar
+        file.  A sidecar no longer describes the asset file if it was
+        replaced, in which case it's ignored.
+        """
+        if self._metadata is None:
+            self._metadata = {}
+            sidecar = self.sidecar_filename(self.filename)
+            try:
+                with open(sidecar) as f:
+                    md = json.load(f)
+                st = os.stat(self.filename)
+                if (md['size'], md['mtime']) == (st.st_size, st.st_mtime):
+                    if md.get('acquired') is not None:
+                        md['acquired'] = datetime.strptime(
+                            md['acquired'], _acquired_format).replace(tzinfo=timezone.utc)
+                    self._metadata = md
+            except (EnvironmentError, ValueError, KeyError) as e:
+                if not isinstance(e, EnvironmentError) or os.path.exists(sidecar):
+                    utils.verbose_out('Ignoring sidecar {}: {}'.format(sidecar, e), 3)
+        return self._metadata
+
+    def set_metadata(self, metadata):
+        """Use the given metadata, eg from the inventory DB, instead of the sidecar's."""
+        self._metadata = metadata
+
+    def record_metadata(self, filename=None):
+        """Extract the asset's metadata & save it in the sidecar for filename.
+
+        filename defaults to the asset's, but may name another link to
+        the same file, such as its place in the archive.  Returns the
+        metadata; failure to save it is reported but not raised, since
+        the metadata is only an optimization.
+        """
+        md = self.extract_metadata()
+        self._metadata = md
+        sidecar = self.sidecar_filename(filename or self.filename)
+        md_json = dict(md)
+        if md.get('acquired') is not None:
+            md_json['acquired'] = md['acquired'].astimezone(timezone.utc).strftime(
+                _acquired_format)
+        try:
+            with open(sidecar + '.tmp', 'w') as f:
+                json.dump(md_json, f)
+            os.rename(sidecar + '.tmp', sidecar)
+        except EnvironmentError as e:
+            utils.verbose_out('Unable to save metadata to {}: {}'.format(sidecar, e), 2)
+        return md
+
     @classmethod
     def _quarantine_file(cls, filepath, error):
         """if problem with a file, move to quarantine"""
@@ -687,18 +1259,13 @@ class Asset(object):
         """Finds an asset for the a-t-d trio and returns an object for it."""
         if orm.use_orm():
             # search for ORM Assets to use for making GIPS Assets
-            results = dbinv.asset_search(driver=cls.Repository.name.lower(),
-                                    asset=asset_type, tile=tile, date=date)
-            if len(results) == 0:
-                return None
-            assert len(results) == 1 # sanity check; DB should enforce
-            return cls(results[0].name)
+            name = dbinv.find_asset(cls.Repository.name.lower(), asset_type, tile, date)
+            return None if name is None else cls(name)
 
         # The rest of this fn uses the filesystem inventory
         d_path = cls.Repository.data_path(tile, date)
-        if not os.path.isdir(d_path):
-            return None
-        files = utils.find_files(cls._assets[asset_type]['pattern'], d_path)
+        files = DirectoryIndex.get(cls.Repository).find_files(
+            cls._assets[asset_type]['pattern'], d_path)
         # Confirm only one asset
         if len(files) > 1:
             raise IOError("Duplicate(?) assets found: {}".format(files))
@@ -740,9 +1307,9 @@ class Asset(object):
         """For a given asset type get all dates possible (in repo or not).
 
         Also prunes dates outside the bounds of the asset's valid date range,
-        as given by start_date and end_date.
+        as given by start_date and end_date, and dates the tile can't have
+        the asset for, as given by acquisition_calendar.
         """
-        # TODO tile arg isn't used
         from dateutil.rrule import rrule, DAILY
         req_start_dt, req_end_dt = dates
 
@@ -765,6 +1332,12 @@ class Asset(object):
         # default assumes daily regardless of asset or tile
         datearr = rrule(DAILY, dtstart=start_dt, until=end_dt)
         dates = [dt for dt in datearr if days[0] <= int(dt.strftime('%j')) <= days[1]]
+        calendar = cls.acquisition_calendar(asset_type, tile)
+        if calendar is not None and cls.get_setting('acquisition-calendar'):
+            plausible = [dt for dt in dates if calendar(dt)]
+            utils.verbose_out('{} of {} dates are in the acquisition calendar for {}, {}'.format(
+                len(plausible), len(dates), asset_type, tile), 5)
+            dates = plausible
         return dates
 
     @classmethod
@@ -801,6 +1374,93 @@ class Asset(object):
             return None
         return {'basename': bn, 'url': url}
 
+    @classmethod
+    def query_service_batch(cls, asset, tile, dates, **fetch_kwargs):
+        """Query the data provider for many dates at once.
+
+        Drivers may override this to query for a tile and many dates in a
+        few round-trips, eg one bucket listing per tile and year.  Must
+        return a dict mapping dates to what query_service would return for
+        them; dates left out are queried with query_service instead.
+        Return None if batch queries aren't supported for the arguments.
+        """
+        return None
+
+    @classmethod
+    def preload_queries(cls, asset, tile, dates, **fetch_kwargs):
+        """Run query_service_batch and save the results for use by query().
+
+        Only worthwhile for more than one date.
+        """
+        qc = cls.query_cache()
+        dates = [d for d in dates if not qc.get(asset, tile, d, fetch_kwargs)[0]]
+        if len(dates) < 2:
+            return
+        rv = cls.query_service_batch(asset, tile, dates, **fetch_kwargs)
+        if rv is None:
+            return
+        utils.verbose_out('batch query for {} {} found {} assets on {} dates'.format(
+            asset, tile, len([v for v in rv.values() if v is not None]), len(rv)), 4)
+        for d, v in rv.items():
+            qc.put(asset, tile, d, fetch_kwargs, v)
+        kwargs_key = tuple(sorted(fetch_kwargs.items()))
+        _preloaded_queries.update(
+            ((cls, asset, tile, d, kwargs_key), v) for (d, v) in rv.items())
+
+    @classmethod
+    def clear_preloaded_queries(cls):
+        """Forget results saved by preload_queries for this class."""
+        for k in [k for k in _preloaded_queries if k[0] is cls]:
+            del _preloaded_queries[k]
+
+    @classmethod
+    def query(cls, asset, tile, date, **fetch_kwargs):
+        """Return the results of query_service for the arguments.
+
+        Results saved by preload_queries or in the query cache are used
+        when available.
+        """
+        key = (cls, asset, tile, date, tuple(sorted(fetch_kwargs.items())))
+        if key in _preloaded_queries:
+            return _preloaded_queries[key]
+        qc = cls.query_cache()
+        cached, rv = qc.get(asset, tile, date, fetch_kwargs)
+        if cached:
+            utils.verbose_out('query cache hit for {} {} {}'.format(
+                asset, tile, date), 5)
+            return rv
+        rv = cls.query_service(asset, tile, date, **fetch_kwargs)
+        qc.put(asset, tile, date, fetch_kwargs, rv)
+        return rv
+
+    @classmethod
+    def query_cache(cls):
+        """Return the QueryCache for this class's query results."""
+        return QueryCache.get_cache(cls)
+
+    @classmethod
+    def catalog(cls):
+        """Return the SceneCatalog to look up scenes in instead of the provider, or None.
+
+        None unless the catalog has been loaded, with gips_inventory
+        --update-catalog, and the driver's 'catalog' setting is True.
+        """
+        if cls.catalog_index_url is None or not cls.get_setting('catalog'):
+            return None
+        catalog = SceneCatalog.get(cls)
+        return catalog if catalog.updated() is not None else None
+
+    @classmethod
+    def setup_query_cache(cls, bypass=False, purge=False):
+        """Configure query caching per command-line options.
+
+        If `purge`, the driver's cache is emptied.  If `bypass`, query
+        results are neither read from nor saved to the cache.
+        """
+        if purge:
+            cls.query_cache().purge()
+        QueryCache.enabled = not bypass
+
     @classmethod
     def download(cls, url, download_fp, **kwargs):
         """Override this method to provide custom download code.
@@ -830,9 +1490,10 @@ class Asset(object):
         are archived directly.  Once issue 365 is fixed it should be
         removed.
         """
-        qs_rv = cls.query_service(a_type, tile, date, **fetch_kwargs)
+        qs_rv = cls.query(a_type, tile, date, **fetch_kwargs)
         if qs_rv is None:
             return []
+        qs_rv = dict(qs_rv) # it's cached; don't alter the original
         if cls.Repository.in_stage(qs_rv['basename']): # skip if there already
             return []
         with utils.make_temp_dir(prefix='fetch-',
@@ -841,7 +1502,8 @@ class Asset(object):
             fetch_kwargs.update(**qs_rv)
             if cls.download(**fetch_kwargs):
                 if archive:
-                    ao, _, _ = cls._archivefile(qs_rv['download_fp'], update)
+                    with _archive_lock: # fetches may be concurrent; see Data.fetch
+                        ao, _, _ = cls._archivefile(qs_rv['download_fp'], update)
                     return [ao]
                 cls.stage_asset(qs_rv['download_fp'])
         return []
@@ -980,7 +1642,8 @@ class Asset(object):
                         VerboseOut('\t%s' % os.path.basename(ef.filename), 1)
                         errmsg = 'Unable to remove existing version: ' + ef.filename
                         with utils.error_handler(errmsg):
-                            RemoveFiles([ef.filename], ['.index', '.aux.xml'])
+                            RemoveFiles([ef.filename, cls.sidecar_filename(ef.filename)],
+                                        ['.index', '.aux.xml'])
                     with utils.error_handler('Problem adding {} to archive'.format(filename)):
                         os.link(os.path.abspath(filename), newfilename)
                         asset.archived_filename = newfilename
@@ -999,6 +1662,13 @@ class Asset(object):
             else:
                 VerboseOut('%s already in archive' % filename, 2)
 
+        if numlinks > 0:
+            # record cheap-to-query metadata now so inventory searches needn't extract it
+            try:
+                asset.record_metadata(asset.archived_filename)
+            except Exception as e:
+                utils.verbose_out('Unable to record metadata for {}: {}'.format(filename, e), 2)
+
         # newly created asset should have only automagical products, and those
         # would have paths in stage with the existing asset.  Re-instantiation
         # using archived_filename rectifies this.
@@ -1006,6 +1676,7 @@ class Asset(object):
             new_asset_obj = cls(asset.archived_filename)
             # next line is strange, but is used by DataInventory.fetch
             new_asset_obj.archived_filename = asset.archived_filename
+            new_asset_obj.set_metadata(asset.metadata())
             asset = new_asset_obj
 
         if otherversions and numlinks == 0:
@@ -1087,6 +1758,10 @@ class Data(object):
     _products = {}
     _productgroups = {}
 
+    # set in worker processes so the parent makes the inventory DB writes;
+    # see gips.inventory.DataInventory.process
+    _defer_db_writes = False
+
     @classmethod
     def get_setting(cls, key):
         """Convenience method to acces Repository's get_setting."""
@@ -1180,7 +1855,7 @@ class Data(object):
         These must match the shell glob in self._pattern, and must not
         be assets, index files, nor xml files.
         """
-        filenames = glob.glob(os.path.join(self.path, self._pattern))
+        filenames = DirectoryIndex.get(self.Repository).glob(self.path, self._pattern)
         assetnames = [a.filename for a in self.assets.values()]
         validated_filenames = [fn for fn in filenames
                 if fn not in assetnames and os.path.splitext(fn)[1] not in ('.index', '.xml')]
@@ -1222,10 +1897,8 @@ class Data(object):
                 [self.add_asset(a) for a in self.Asset.discover(tile, date)] # Find all assets
                 fn_to_add = None
                 if orm.use_orm():
-                    search = {'driver': self.Repository.name.lower(),
-                              'date': date, 'tile': tile}
-                    fn_to_add = [str(p.name)
-                                 for p in dbinv.product_search(**search)]
+                    fn_to_add = [str(n) for n in dbinv.find_products(
+                        self.Repository.name.lower(), tile, date)]
                 self.ParseAndAddFiles(fn_to_add)
 
     def add_asset(self, asset):
@@ -1333,7 +2006,8 @@ class Data(object):
         self.filenames[(sensor, product)] = filename
         # TODO - currently assumes single sensor for each product
         self.sensors[product] = sensor
-        if add_to_db and orm.use_orm(): # update inventory DB if such is requested
+        if add_to_db and orm.use_orm() and not self._defer_db_writes:
+            # update inventory DB if such is requested
             dbinv.update_or_add_product(driver=self.name.lower(), product=product, sensor=sensor,
                                         tile=self.id, date=self.date, name=filename)
 
@@ -1523,7 +2197,7 @@ class Data(object):
         # so the decision is easy
         if local_ao is not None and not update:
             return False
-        qs_rv = cls.Asset.query_service(a_type, tile, date, **fetch_kwargs)
+        qs_rv = cls.Asset.query(a_type, tile, date, **fetch_kwargs)
         if qs_rv is None: # nothing remote; done
             return False
         # if we don't have it already, or if `update` flag
@@ -1532,32 +2206,109 @@ class Data(object):
 
     need_fetch_kwargs = False # feature toggle:  set in driver's subclass
 
+    @classmethod
+    @contextlib.contextmanager
+    def prefetch_inventory(cls, tiles, date_range):
+        """Load the inventory DB's rows for the tiles & dates into memory.
+
+        Asset & product lookups for them, such as need_to_fetch's, don't
+        hit the database while in the context; see dbinv.prefetch.  Does
+        nothing when the filesystem inventory is in use.
+        """
+        if not orm.use_orm():
+            yield
+            return
+        with dbinv.prefetch(cls.Asset.Repository.name.lower(), tiles, date_range):
+            yield
+
     @classmethod
     def fetch(cls, products, tiles, textent, update=False, **kwargs):
-        """ Download data for tiles and add to archive. update forces fetch """
+        """ Download data for tiles and add to archive. update forces fetch
+
+        If the driver's 'fetch-workers' setting is more than 1, assets
+        are queried for and downloaded concurrently; see fetch_concurrently.
+        """
         fetched = []
         fetch_kwargs = kwargs if cls.need_fetch_kwargs else {}
-        atd_pile = ((a, t, d)
-            for a in cls.products2assets(products)
-            for t in tiles
-            for d in cls.Asset.dates(
-                a, t, textent.datebounds, textent.daybounds))
-        for a, t, d in atd_pile:
-            err_msg = 'Problem fetching asset for {}, {}, {}'.format(
-                a, t, d.strftime("%y-%m-%d"))
-            with utils.error_handler(err_msg, continuable=True):
-                if not cls.need_to_fetch(a, t, d, update, **fetch_kwargs):
-                    continue
-                # check feature toggle to know how to call fetch():
-                if getattr(cls, 'inline_archive', False):
-                    # if fetch promises to archive inline:
-                    fetched += cls.Asset.fetch(a, t, d, update, archive=True,
-                                               **fetch_kwargs)
-                else:
-                    # otherwise, it put assets in stage; do staging here
-                    cls.Asset.fetch(a, t, d, **fetch_kwargs)
-                    fetched += cls.archive_assets(
+        atd_pile = []
+        for a in cls.products2assets(products):
+            for t in tiles:
+                dates = cls.Asset.dates(a, t, textent.datebounds, textent.daybounds)
+                # drivers may support querying for many dates at once
+                with utils.error_handler('Problem with batch query for {}, {}'.format(a, t),
+                                         continuable=True):
+                    cls.Asset.preload_queries(a, t, dates, **fetch_kwargs)
+                atd_pile.extend((a, t, d) for d in dates)
+        try:
+            workers = cls.get_setting('fetch-workers')
+            with cls.prefetch_inventory(tiles, textent.datebounds):
+                if workers > 1:
+                    return cls.fetch_concurrently(workers, atd_pile, update, fetch_kwargs)
+                for a, t, d in atd_pile:
+                    _, archived = cls.fetch_atd(a, t, d, update, fetch_kwargs)
+                    fetched += archived
+            return fetched
+        finally:
+            cls.Asset.clear_preloaded_queries()
+
+    @classmethod
+    def fetch_atd(cls, a, t, d, update, fetch_kwargs, archive_stage=True):
+        """Fetch the asset for the given (asset type, tile, date) if needed.
+
+        Returns (attempted, archived):  Whether a fetch was attempted,
+        and a list of the asset objects archived as a result.  Drivers
+        that don't archive inline leave assets in the stage; they're
+        archived here unless archive_stage is False.
+        """
+        err_msg = 'Problem fetching asset for {}, {}, {}'.format(
+            a, t, d.strftime("%y-%m-%d"))
+        attempted, archived = False, []
+        with utils.error_handler(err_msg, continuable=True):
+            if not cls.need_to_fetch(a, t, d, update, **fetch_kwargs):
+                return attempted, archived
+            attempted = True
+            # check feature toggle to know how to call fetch():
+            if getattr(cls, 'inline_archive', False):
+                # if fetch promises to archive inline:
+                archived = cls.Asset.fetch(a, t, d, update, archive=True,
+                                           **fetch_kwargs)
+            else:
+                # otherwise, it put assets in stage; do staging here
+                cls.Asset.fetch(a, t, d, **fetch_kwargs)
+                if archive_stage:
+                    archived = cls.archive_assets(
                         cls.Asset.Repository.path('stage'), update=update)
+        return attempted, archived
+
+    @classmethod
+    def fetch_concurrently(cls, workers, atd_pile, update, fetch_kwargs):
+        """Query for and download assets using a bounded pool of threads.
+
+        Downloads that go through utils.http_session (google storage, hls,
+        and managed_request, used by modis, merra, smap & weld) share its
+        limit on connections per host; other drivers' requests are only
+        limited by the worker count.  Assets that go to the stage are
+        archived once all downloads are complete, so partial downloads are
+        never archived.
+        """
+        def fetch_atd(atd):
+            try:
+                return cls.fetch_atd(*atd, update, fetch_kwargs, archive_stage=False)
+            finally:
+                # the inventory DB has a connection per thread; don't leak them
+                orm.close_connections()
+
+        utils.verbose_out('Fetching with {} workers'.format(workers), 3)
+        fetched = []
+        attempts = 0
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            for attempted, archived in executor.map(fetch_atd, atd_pile):
+                attempts += attempted
+                fetched += archived
+        if attempts > 0 and not getattr(cls, 'inline_archive', False):
+            with utils.error_handler('Problem archiving fetched assets', continuable=True):
+                fetched += cls.archive_assets(
+                    cls.Asset.Repository.path('stage'), update=update)
         return fetched
 
     @classmethod
@@ -1641,9 +2392,18 @@ class Data(object):
         """Move the product file from the managed temp dir to the archive.
 
         The archival full path is returned; an appropriate spot in the
-        archive is chosen automatically.
+        archive is chosen automatically.  If the 'output-profile' setting
+        is set, GeoTIFFs are rewritten per that profile on the way; see
+        utils.output_profile.
         """
         archive_fp = os.path.join(self.path, os.path.basename(temp_fp))
+        profile = self.get_setting('output-profile')
+        if profile is not None and temp_fp.endswith('.tif'):
+            profiled_fp = os.path.join(os.path.dirname(temp_fp),
+                                       'profiled-' + os.path.basename(temp_fp))
+            utils.write_profile(temp_fp, profiled_fp, profile)
+            os.remove(temp_fp)
+            temp_fp = profiled_fp
         os.rename(temp_fp, archive_fp)
         return archive_fp
 
@@ -1709,10 +2469,35 @@ class CloudCoverAsset(Asset):
     together to filter by cloud cover. It needs Asset.cloud_cover() to
     be implemented.
     """
+    def extract_metadata(self):
+        md = super(CloudCoverAsset, self).extract_metadata()
+        try:
+            md['cloud-cover'] = self.cloud_cover()
+        except Exception as e:
+            utils.verbose_out('Unable to find cloud cover for {}: {}'.format(
+                self.filename, e), 3)
+        return md
+
     def filter(self, pclouds=100.0, **kwargs):
         if pclouds >= 100.0:
             return True
-        cc = self.cloud_cover()
+        cc = self.metadata().get('cloud-cover')
+        if cc is None and os.path.exists(self.filename):
+            # extract it with the rest of the metadata, & record that so it needn't be again
+            md = self.record_metadata()
+            cc = md.get('cloud-cover')
+            if cc is not None and orm.use_orm():
+                # else the DB's row, lacking cloud cover, would still be used over the sidecar
+                try:
+                    dbinv.update_or_add_asset(
+                        driver=self.Repository.name.lower(), asset=self.asset,
+                        sensor=self.sensor, tile=self.tile, date=self.date,
+                        name=self.filename, metadata=md)
+                except Exception as e:
+                    utils.verbose_out('Unable to record metadata for {} in the inventory'
+                                      ' DB: {}'.format(self.filename, e), 2)
+        if cc is None: # not extracted, so cloud_cover() should say why
+            cc = self.cloud_cover()
         asset_passes_filter = cc <= pclouds
         msg = '{}Asset {} cloud cover is {}%, {} pclouds threshold of {}%'
 
@@ -25,7 +25,7 @@ from contextlib import contextmanager
 import sys
 import os
 import re
-from datetime import datetime, date, timedelta
+from datetime import datetime, date, timedelta, timezone
 import shutil
 import glob
 import traceback
@@ -112,6 +112,7 @@ class landsatRepository(Repository):
     default_settings = {
         'source': 'usgs',
         'asset-preference': ('C1', 'C1S3', 'C1GS', 'DN'),
+        '6S-lut': None, # path to a SixsLut to use instead of running 6S
     }
 
     @classmethod
@@ -127,6 +128,8 @@ class landsatAsset(gips.data.core.CloudCoverAsset,
     Repository = landsatRepository
 
     gs_bucket_name = 'gcp-public-data-landsat'
+    catalog_index_url = 'https://storage.googleapis.com/gcp-public-data-landsat/index.csv.gz'
+    query_settings = ('source',)
 
     # tassled cap coefficients for L5 and L7
     _tcapcoef = [
@@ -264,6 +267,20 @@ class landsatAsset(gips.data.core.CloudCoverAsset,
     # Field ids are retrieved with `api.dataset_fields()` call
     _ee_datasets = None
 
+    # WRS-2 acquisition calendar: each satellite covers the 233 paths in a
+    # 16-day cycle, consecutive orbits 16 paths apart.  LT5 & LC8 share a
+    # phase, with LE7 8 days off it.  For each sensor, a scene it acquired
+    # (or would have) as (path, row, UTC datetime), & when its calendar
+    # begins; LC8 was still manoeuvring into the WRS-2 orbit till then.
+    _wrs2_references = {
+        'LT5': (27, 33, datetime(2017, 5, 6, 17, 0), date(1984, 3, 1)),
+        'LE7': (27, 33, datetime(2017, 5, 14, 17, 0), date(1999, 4, 15)),
+        'LC8': (27, 33, datetime(2017, 5, 6, 17, 0), date(2013, 4, 11)),
+    }
+    _wrs2_cycle = timedelta(days=16)
+    # allowance for variation in equatorial crossing time
+    _wrs2_slack = timedelta(hours=3)
+
     # Set the startdate to the min date of the asset's sensors
     for asset, asset_info in _assets.items():
 
@@ -356,10 +373,59 @@ class landsatAsset(gips.data.core.CloudCoverAsset,
                 cc_pattern))
         return float(cloud_cover.group(1))
 
+    @classmethod
+    def acquired_from_mtl_text(cls, text):
+        """Reads the text and returns the scene center time as a UTC datetime.
+
+        Returns None if the text lacks the needed fields."""
+        d = re.search(r'DATE_ACQUIRED = (\d{4}-\d\d-\d\d)', text)
+        t = re.search(r'SCENE_CENTER_TIME = "?(\d\d:\d\d:\d\d)(\.\d+)?', text)
+        if not (d and t):
+            return None
+        # fractional seconds are given to more places than strptime can take
+        usecs = int(round(float(t.group(2) or 0) * 1e6))
+        return (datetime.strptime(d.group(1) + ' ' + t.group(1), '%Y-%m-%d %H:%M:%S')
+                + timedelta(microseconds=usecs)).replace(tzinfo=timezone.utc)
+
+    @classmethod
+    def acquisition_calendar(cls, asset_type, tile):
+        """Landsat acquires a given path every 16 days per satellite.
+
+        Dates are plausible if any of the asset type's sensors in
+        operation then could have acquired the tile on them.
+        """
+        (path, row) = int(tile[:3]), int(tile[3:])
+        orbit = cls._wrs2_cycle / 233
+        sensors = []
+        for sensor in cls._assets[asset_type]['sensors']:
+            if sensor not in cls._wrs2_references:
+                return None
+            (ref_path, ref_row, ref_dt, since) = cls._wrs2_references[sensor]
+            # 102 is the inverse of 16 mod 233, so this many orbits after
+            # the reference the satellite passes over the tile's path
+            orbits = (102 * (path - ref_path)) % 233 + (row - ref_row) / 248.0
+            sensors.append((cls._sensors[sensor]['startdate'], since, ref_dt + orbits * orbit))
+
+        def calendar(d):
+            d = d.date() if type(d) is datetime else d
+            return any(d < since or gips.data.core.in_revisit_cycle(
+                           d, acquired, cls._wrs2_cycle, cls._wrs2_slack)
+                       for (start, since, acquired) in sensors if start <= d)
+        return calendar
+
+    def extract_metadata(self):
+        md = super(landsatAsset, self).extract_metadata()
+        # cloud_cover() sets this when it reads the MTL file
+        if getattr(self, 'meta', {}).get('acquired') is not None:
+            md['acquired'] = self.meta['acquired']
+        return md
+
     def cloud_cover(self):
         """Returns the cloud cover for the current asset.
 
-        Caches and returns the value found in self.meta['cloud-cover']."""
+        Caches and returns the value found in self.meta['cloud-cover'].
+        Also caches the acquisition time in self.meta['acquired'] if
+        the MTL text is read."""
         if 'cloud-cover' in self.meta:
             return self.meta['cloud-cover']
         # first attempt to find or download an MTL file and get the CC value
@@ -388,6 +454,7 @@ class landsatAsset(gips.data.core.CloudCoverAsset,
 
         if text is not None:
             self.meta['cloud-cover'] = self.cloud_cover_from_mtl_text(text)
+            self.meta['acquired'] = self.acquired_from_mtl_text(text)
             return self.meta['cloud-cover']
 
         # the MTL file didn't work out; attempt USGS API search instead
@@ -516,12 +583,54 @@ class landsatAsset(gips.data.core.CloudCoverAsset,
                 '_30m_tifs': _30m_tifs, '_15m_tif': _15m_tif,
                 'qa_tif': qa_tif, 'mtl_txt': mtl_txt}
 
+    @classmethod
+    def catalog_rows(cls, reader):
+        """As superclass, for C1 scenes in google's index of its landsat bucket."""
+        sensors = {cls._sensors[s]['code']: s for s in cls._assets['C1GS']['sensors']}
+        bucket_url = 'gs://{}/'.format(cls.gs_bucket_name)
+        for r in reader:
+            sensor = sensors.get(r['PRODUCT_ID'][:4])
+            if (sensor is None or r['COLLECTION_NUMBER'] != '01'
+                    or not r['BASE_URL'].startswith(bucket_url)):
+                continue
+            # unknown cloud cover is blank or negative
+            cc = float(r['CLOUD_COVER'] or -1)
+            yield (r['PRODUCT_ID'],
+                   '{:03d}{:03d}'.format(int(r['WRS_PATH']), int(r['WRS_ROW'])),
+                   r['DATE_ACQUIRED'], sensor, cc if cc >= 0 else None,
+                   r['BASE_URL'][len(bucket_url):] + '/')
+
+    @classmethod
+    def gs_catalog_choice(cls, scenes):
+        """Choose among a scene catalog's scenes for a tile & date.
+
+        Prefers scenes the same way gs_prefix_search does, and returns
+        the same, with the scene's cloud cover in place of None.
+        """
+        sensors = list(reversed(cls._assets['C1GS']['sensors']))
+        levels, tiers = ('L1TP', 'L1GT', 'L1GS'), ('T1', 'T2', 'RT')
+        ranked = []
+        for (product_id, sensor, cc, prefix) in scenes:
+            parts = product_id.split('_')
+            if sensor in sensors and parts[1] in levels and parts[-1] in tiers:
+                ranked.append(((sensors.index(sensor), levels.index(parts[1]),
+                                tiers.index(parts[-1])), (sensor, prefix, cc)))
+        return min(ranked)[1] if ranked else (None, None, None)
+
     @classmethod
     def gs_prefix_search(cls, tile, acq_date):
         """Locates the best prefix for the given arguments.
 
+        Returns (sensor, prefix, cloud cover), the last being None
+        unless the scene was found in the scene catalog; see
+        Asset.catalog.
+
         Docs:  https://cloud.google.com/storage/docs/json_api/v1/objects/list
         """
+        catalog = cls.catalog()
+        if catalog is not None and catalog.covers(acq_date, cls._assets['C1GS']['latency']):
+            return cls.gs_catalog_choice(catalog.scenes(tile, [acq_date])[acq_date])
+
         # we identify a sensor as eg 'LC8' but in the filename it's 'LC08';
         # prefer the latest sensor that has data for the scene
         sensors = reversed([s for s in cls._assets['C1GS']['sensors']])
@@ -543,18 +652,71 @@ class landsatAsset(gips.data.core.CloudCoverAsset,
                 for t in ('T1', 'T2', 'RT'):  # get best C1 tier available
                     for p in full_prefixes:
                         if p.endswith(t + '/'):
-                            return s, p
-        return None, None
+                            return s, p, None
+        return None, None, None
 
     @classmethod
-    def query_gs(cls, tile, date, pclouds=100):
+    def gs_prefix_search_batch(cls, tile, dates):
+        """As gs_prefix_search, but for many dates at once.
+
+        Dates the scene catalog covers are looked up there.  For the
+        rest, lists a year of scenes per search instead of a single
+        day, so a multi-year fetch needs a few searches instead of
+        thousands.  Returns {date: (sensor, prefix, cloud cover)} for
+        the dates searched, with Nones for dates without a scene, or
+        None if a listing was too long to fit in one response and
+        there's no catalog.
+        """
+        found = {}
+        catalog = cls.catalog()
+        if catalog is not None:
+            for d, scenes in catalog.scenes(tile, dates, cls._assets['C1GS']['latency']).items():
+                found[d] = cls.gs_catalog_choice(scenes)
+            dates = [d for d in dates if d not in found]
+
+        sensors = list(reversed([s for s in cls._assets['C1GS']['sensors']]))
+        path, row = path_row(tile)
+        p_template = '{{}}/01/{}/{}/{{}}_{{}}_{}_{{}}'.format(path, row, tile)
+        wanted = {d.strftime('%Y%m%d'): d for d in dates}
+        listings = {}
+        for (year, s, cl) in [(year, s, cl) for year in sorted(set(d.year for d in dates))
+                              for s in sensors for cl in ('L1TP', 'L1GT', 'L1GS')]:
+            c = cls._sensors[s]['code']
+            resp = cls.gs_api_search(p_template.format(c, c, cl, year))
+            if 'nextPageToken' in resp:
+                if catalog is None:
+                    return None
+                wanted = {} # leave the uncataloged dates to gs_prefix_search
+                break
+            listings[(s, cl, year)] = resp.get('prefixes', [])
+
+        for ads, d in wanted.items():
+            # same order of preference as gs_prefix_search
+            found[d] = next(((s, p, None)
+                for s in sensors
+                for cl in ('L1TP', 'L1GT', 'L1GS')
+                for t in ('T1', 'T2', 'RT')
+                for p in listings[(s, cl, d.year)]
+                if p.rstrip('/').split('/')[-1].split('_')[3] == ads
+                   and p.endswith(t + '/')), (None, None, None))
+        return found
+
+    @classmethod
+    def query_gs(cls, tile, date, pclouds=100, found=None):
         """Query for assets in google cloud storage.
 
-        Returns {'basename': '...', 'urls': [...]}, else None.
+        found is an optional (sensor, prefix, cloud cover) triple as
+        returned by gs_prefix_search, for when the search has already
+        been done.  Returns {'basename': '...', 'urls': [...]}, else None.
         """
-        sensor, prefix = cls.gs_prefix_search(tile, date)
+        sensor, prefix, cc = found or cls.gs_prefix_search(tile, date)
         if prefix is None:
             return None
+        if cc is not None and cc > pclouds:
+            cc_msg = ('C1GS asset cataloged for ({}, {}), but cloud cover'
+                      ' percentage ({}%) fails to meet threshold ({}%)')
+            verbose_out(cc_msg.format(tile, date, cc, pclouds), 3)
+            return None
         raw_keys = [i['name'] for i in cls.gs_api_search(prefix)['items']]
 
         # sort and organize the URLs, and check for missing ones
@@ -581,8 +743,8 @@ class landsatAsset(gips.data.core.CloudCoverAsset,
             verbose_out(err_msg.format(tile, date, missing_suffixes), 2)
             return None
 
-        # handle pclouds
-        if pclouds < 100:
+        # handle pclouds, unless the catalog's cloud cover was checked above
+        if pclouds < 100 and cc is None:
             r = cls.gs_backoff_get(cls.gs_object_url_base() + keys['mtl'])
             cc = cls.cloud_cover_from_mtl_text(r.text)
             if cc > pclouds:
@@ -669,6 +831,26 @@ class landsatAsset(gips.data.core.CloudCoverAsset,
             rv['a_type'] = asset
         return rv
 
+    @classmethod
+    def query_service_batch(cls, asset, tile, dates, pclouds=90.0, **ignored):
+        """As superclass; supported for C1GS assets only.
+
+        The listing is batched; each scene found still needs its own
+        query for its keys.
+        """
+        if (asset, cls.get_setting('source')) != ('C1GS', 'gs'):
+            return None
+        dates = [d for d in dates if cls.available(asset, d)]
+        found = cls.gs_prefix_search_batch(tile, dates)
+        if found is None:
+            return None
+        rv = {}
+        for d in found:
+            rv[d] = cls.query_gs(tile, d, pclouds, found[d])
+            if rv[d] is not None:
+                rv[d]['a_type'] = asset
+        return rv
+
     @classmethod
     def download(cls, a_type, download_fp, **kwargs):
         """Downloads the asset defined by the kwargs to the full path."""
@@ -1114,23 +1296,25 @@ class landsatData(gips.data.core.CloudCoverData):
 
                     missing = float(img[0].nodata())
 
-                    red = img[0].read().astype('float32')
-                    nir = img[1].read().astype('float32')
+                    def ndvi8sr_chunk(red, nir):
+                        red = red.astype('float32')
+                        nir = nir.astype('float32')
 
-                    wvalid = numpy.where((red != missing) & (nir != missing) & (red + nir != 0.0))
+                        wvalid = numpy.where((red != missing) & (nir != missing) & (red + nir != 0.0))
 
-                    red[wvalid] *= 1.E-4
-                    nir[wvalid] *= 1.E-4
+                        red[wvalid] *= 1.E-4
+                        nir[wvalid] *= 1.E-4
 
-                    # TODO: change this so that these pixels become missing
-                    red[(red != missing) & (red < 0.0)] = 0.0
-                    red[red > 1.0] = 1.0
-                    nir[(nir != missing) & (nir < 0.0)] = 0.0
-                    nir[nir > 1.0] = 1.0
+                        # TODO: change this so that these pixels become missing
+                        red[(red != missing) & (red < 0.0)] = 0.0
+                        red[red > 1.0] = 1.0
+                        nir[(nir != missing) & (nir < 0.0)] = 0.0
+                        nir[nir > 1.0] = 1.0
 
-                    ndvi = missing + numpy.zeros_like(red)
-                    ndvi[wvalid] = ((nir[wvalid] - red[wvalid]) /
-                                    (nir[wvalid] + red[wvalid]))
+                        ndvi = missing + numpy.zeros_like(red)
+                        ndvi[wvalid] = ((nir[wvalid] - red[wvalid]) /
+                                        (nir[wvalid] + red[wvalid]))
+                        return [ndvi]
 
                     verbose_out("writing " + fname, 2)
                     imgout = gippy.GeoImage.create_from(img, fname, 1, 'float32')
@@ -1138,7 +1322,7 @@ class landsatData(gips.data.core.CloudCoverData):
                     imgout.set_offset(0.0)
                     imgout.set_gain(1.0)
                     imgout.set_bandname('NDVI', 1)
-                    imgout[0].write(ndvi)
+                    utils.process_chunks([img[0], img[1]], imgout, ndvi8sr_chunk)
 
                 if val[0] == "landmask":
                     img = gippy.GeoImage([imgpaths['cfmask'], imgpaths['cfmask_conf']])
@@ -1279,7 +1463,8 @@ class landsatData(gips.data.core.CloudCoverData):
                 with utils.error_handler('Problem running 6S atmospheric model'):
                     wvlens = [(meta[b]['wvlen1'], meta[b]['wvlen2']) for b in visbands]
                     geo = self.metadata['geometry']
-                    atm6s = SIXS(visbands, wvlens, geo, self.metadata['datetime'], sensor=self.sensor_set[0])
+                    atm6s = SIXS(visbands, wvlens, geo, self.metadata['datetime'], sensor=self.sensor_set[0],
+                                 lut=self.Repository.get_setting('6S-lut'))
 
                     md["AOD Source"] = str(atm6s.aod[0])
                     md["AOD Value"] = str(atm6s.aod[1])
@@ -1452,15 +1637,22 @@ class landsatData(gips.data.core.CloudCoverData):
                         n = 1.34    # Refractive index of water
                         Q = 1.0     # Downwelled irradiance / upwelled radiance
                         A = ((1 - p) * (1 - pp)) / (n * n)
-                        srband = reflimg['SWIR1'].read()
-                        nodatainds = srband == reflimg['SWIR1'].nodata()
-                        for band in bands:
-                            bimg = reflimg[band].read()
-                            diffimg = bimg - srband
-                            diffimg = diffimg / (A + r * Q * diffimg)
-                            diffimg[bimg == reflimg[band].nodata()] = imgout[band].nodata()
-                            diffimg[nodatainds] = imgout[band].nodata()
-                            imgout[band].write(diffimg)
+                        in_nodata = [reflimg[band].nodata() for band in bands]
+                        out_nodata = [imgout[band].nodata() for band in bands]
+                        sr_nodata = reflimg['SWIR1'].nodata()
+
+                        def volref_chunk(srband, *bimgs):
+                            nodatainds = srband == sr_nodata
+                            for bimg, in_nd, out_nd in zip(bimgs, in_nodata, out_nodata):
+                                diffimg = bimg - srband
+                                diffimg = diffimg / (A + r * Q * diffimg)
+                                diffimg[bimg == in_nd] = out_nd
+                                diffimg[nodatainds] = out_nd
+                                yield diffimg
+
+                        utils.process_chunks(
+                            [reflimg['SWIR1']] + [reflimg[band] for band in bands],
+                            imgout, volref_chunk)
                     elif val[0] == 'wtemp':
                         raise NotImplementedError('See https://gitlab.com/appliedgeosolutions/gips/issues/155')
                         imgout = gippy.GeoImage.create_from(img, fname, len(lwbands), 'int16')
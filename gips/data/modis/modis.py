@@ -28,6 +28,7 @@ import datetime
 
 import urllib
 import math
+import functools
 
 import numpy as np
 import requests
@@ -49,6 +50,103 @@ def binmask(arr, bit):
 
 MCD43A4, MCD43A4S3 = 'MCD43A4', 'MCD43A4S3' # for help spell-checking
 
+def _indices_chunk(missing, redimg, nirimg, bluimg, grnimg, mirimg, swrimg,
+                   redqcimg, nirqcimg, bluqcimg, grnqcimg, mirqcimg, swrqcimg):
+    """Compute the bands of the 'indices' product for a chunk of a scene.
+
+    Takes the chunk's reflectance arrays then its QC arrays, and returns
+    arrays for ndvi, lswi, vari, brgt, satvi, evi, and QC.  Reflectance
+    arrays are clamped to [0, 1] in place.  Computation is done in one
+    pass using preallocated buffers; see gips/test/bench/modis_indices.py
+    for the reference version.
+    """
+    # integer input would break in-place division, so promote it
+    refl = [np.asarray(b, dtype=np.result_type(b, np.float32))
+            for b in (redimg, nirimg, bluimg, grnimg, mirimg, swrimg)]
+    redimg, nirimg, bluimg, grnimg, mirimg, swrimg = refl
+    # validity masks are computed once and shared between the indices
+    vr, vn, vb, vg, vm, vs = valid = [b != missing for b in refl]
+    # clamp to a minimum of 0, and a max of 1.0 for anything not missing
+    for b, v in zip(refl, valid):
+        np.maximum(b, 0, out=b)
+        np.minimum(b, 1, out=b, where=v)
+
+    # every index starts out missing and is filled in where computable
+    ndvi, lswi, vari, brgt, satvi, evi = out = [
+        np.full_like(redimg, missing) for _ in range(6)]
+    num, den, tmp = np.empty_like(redimg), np.empty_like(redimg), np.empty_like(redimg)
+    mask, nonzero = np.empty(redimg.shape, bool), np.empty(redimg.shape, bool)
+
+    def where_valid(*vs):
+        """Set `mask` to where all the given masks and `den != 0` hold."""
+        np.not_equal(den, 0.0, out=nonzero)
+        np.logical_and(vs[0], nonzero, out=mask)
+        for v in vs[1:]:
+            np.logical_and(mask, v, out=mask)
+        return mask
+
+    # red, nir
+    np.add(nirimg, redimg, out=den)
+    np.subtract(nirimg, redimg, out=num)
+    np.divide(num, den, out=ndvi, where=where_valid(vr, vn))
+
+    # nir, mir
+    np.add(nirimg, mirimg, out=den)
+    np.subtract(nirimg, mirimg, out=num)
+    np.divide(num, den, out=lswi, where=where_valid(vn, vm))
+
+    # blu, grn, red
+    np.add(grnimg, redimg, out=den)
+    np.subtract(den, bluimg, out=den)
+    np.subtract(grnimg, redimg, out=num)
+    np.divide(num, den, out=vari, where=where_valid(vg, vr, vb))
+
+    # blu, grn, red, nir; no denominator
+    np.multiply(bluimg, 0.3, out=num)
+    for b, w in ((redimg, 0.3), (nirimg, 0.1), (grnimg, 0.3)):
+        np.multiply(b, w, out=tmp)
+        np.add(num, tmp, out=num)
+    np.logical_and(vn, vr, out=mask)
+    np.logical_and(mask, vb, out=mask)
+    np.logical_and(mask, vg, out=mask)
+    np.copyto(brgt, num, where=mask)
+
+    # red, mir, swr
+    np.add(mirimg, redimg, out=den)
+    np.add(den, 0.5, out=den)
+    np.subtract(mirimg, redimg, out=num)
+    where_valid(vr, vm, vs)
+    np.divide(num, den, out=num, where=mask)
+    np.multiply(num, 1.5, out=num)
+    np.divide(swrimg, 2.0, out=tmp)
+    np.subtract(num, tmp, out=num)
+    np.copyto(satvi, num, where=mask)
+
+    # blu, red, nir
+    np.multiply(redimg, 6.0, out=tmp)
+    np.add(nirimg, tmp, out=den)
+    np.multiply(bluimg, 7.5, out=tmp)
+    np.subtract(den, tmp, out=den)
+    np.add(den, 1.0, out=den)
+    np.subtract(nirimg, redimg, out=num)
+    np.multiply(num, 2.5, out=num)
+    np.divide(num, den, out=evi, where=where_valid(vb, vr, vn))
+
+    # poor (1) unless all are good (0); missing if any are missing (255)
+    qcs = (redqcimg, nirqcimg, bluqcimg, grnqcimg, mirqcimg, swrqcimg)
+    qc = np.ones_like(redimg)
+    np.equal(qcs[0], 0, out=mask)
+    for q in qcs[1:]:
+        np.logical_and(mask, q == 0, out=mask)
+    qc[mask] = 0
+    np.equal(qcs[0], 255, out=mask)
+    for q in qcs[1:]:
+        np.logical_or(mask, q == 255, out=mask)
+    qc[mask] = missing
+
+    return ndvi, lswi, vari, brgt, satvi, evi, qc
+
+
 class modisRepository(Repository):
     name = 'Modis'
     description = 'NASA Moderate Resolution Imaging Spectroradiometer (MODIS)'
@@ -83,6 +181,7 @@ class modisRepository(Repository):
 
 class modisAsset(Asset, gips.data.core.S3Mixin):
     Repository = modisRepository
+    query_settings = ('source',)
 
     _sensors = {
         'MOD': {'description': 'Terra'},
@@ -120,6 +219,7 @@ class modisAsset(Asset, gips.data.core.S3Mixin):
         },
         'MOD09Q1': {
             'pattern': '^MOD09Q1' + _asset_re_tail,
+            'composite-days': 8,
             'url': 'https://e4ftl01.cr.usgs.gov/MOLT/MOD09Q1.006',
             'startdate': datetime.date(2000, 2, 18),
             'latency': 5,
@@ -150,30 +250,35 @@ class modisAsset(Asset, gips.data.core.S3Mixin):
         },
         'MOD11A2': {
             'pattern': '^MOD11A2' + _asset_re_tail,
+            'composite-days': 8,
             'url': 'https://e4ftl01.cr.usgs.gov/MOLT/MOD11A2.006',
             'startdate': datetime.date(2000, 3, 5),
             'latency': 7,
         },
         'MYD11A2': {
             'pattern': '^MYD11A2' + _asset_re_tail,
+            'composite-days': 8,
             'url': 'https://e4ftl01.cr.usgs.gov/MOLA/MYD11A2.006',
             'startdate': datetime.date(2002, 7, 4),
             'latency': 7,
         },
         'MOD10A2': {
             'pattern': '^MOD10A2' + _asset_re_tail,
+            'composite-days': 8,
             'url': 'https://n5eil01u.ecs.nsidc.org/MOST/MOD10A2.006',
             'startdate': datetime.date(2000, 2, 24),
             'latency': 3,
         },
         'MYD10A2': {
             'pattern': '^MYD10A2' + _asset_re_tail,
+            'composite-days': 8,
             'url': 'https://n5eil01u.ecs.nsidc.org/MOSA/MYD10A2.006',
             'startdate': datetime.date(2002, 7, 4),
             'latency': 3,
         },
         'MCD12Q1': {
             'pattern': '^MCD12Q1' + _asset_re_tail,
+            'composite-days': 366, # yearly
             'url': 'https://e4ftl01.cr.usgs.gov/MOTA/MCD12Q1.006',
             'startdate': datetime.date(2002, 7, 4),
             'latency': 3,
@@ -204,6 +309,14 @@ class modisAsset(Asset, gips.data.core.S3Mixin):
         file_version = int(parts[4]) # datetimestamp near end of the filename
         self._version = float('{}.{}'.format(collection, file_version))
 
+    @classmethod
+    def acquisition_calendar(cls, asset_type, tile):
+        """Composites are dated every 'composite-days' from the start of each year."""
+        days = cls._assets[asset_type].get('composite-days')
+        if days is None:
+            return None
+        return lambda d: (d.timetuple().tm_yday - 1) % days == 0
+
     @classmethod
     def query_earthdata(cls, asset, tile, date):
         """Find out from the modis servers what assets are available.
@@ -246,11 +359,16 @@ class modisAsset(Asset, gips.data.core.S3Mixin):
         return tile_id[1:3], tile_id[4:6]
 
     @classmethod
-    def query_s3(cls, tile, date):
-        """Look in S3 for modis asset components and assemble links to same."""
+    def query_s3(cls, tile, date, keys=None):
+        """Look in S3 for modis asset components and assemble links to same.
+
+        keys is the result of the S3 search for the tile & date, if it has
+        already been done.
+        """
         h, v = cls.parse_tile(tile)
-        prefix = 'MCD43A4.006/{}/{}/{}/'.format(h, v, date.strftime('%Y%j'))
-        keys = cls.s3_prefix_search(prefix)
+        if keys is None:
+            prefix = 'MCD43A4.006/{}/{}/{}/'.format(h, v, date.strftime('%Y%j'))
+            keys = cls.s3_prefix_search(prefix)
         tifs = []
         qa_tifs = []
         json_md = None
@@ -292,6 +410,27 @@ class modisAsset(Asset, gips.data.core.S3Mixin):
             rv['a_type'] = asset
         return rv
 
+    @classmethod
+    def query_service_batch(cls, asset, tile, dates):
+        """As superclass; S3 is searched with one listing per year.
+
+        Earthdata isn't supported.
+        """
+        if cls.get_setting('source') != 's3' or asset != MCD43A4S3:
+            return None
+        h, v = cls.parse_tile(tile)
+        dates = [d for d in dates if cls.available(asset, d)]
+        keys = {} # group keys by date directory, eg '2017330'
+        for year in sorted(set(d.year for d in dates)):
+            for k in cls.s3_prefix_search('MCD43A4.006/{}/{}/{}'.format(h, v, year)):
+                keys.setdefault(k.split('/')[3], []).append(k)
+        rv = {}
+        for d in dates:
+            rv[d] = cls.query_s3(tile, d, keys.get(d.strftime('%Y%j'), []))
+            if rv[d] is not None:
+                rv[d]['a_type'] = asset
+        return rv
+
     @classmethod
     def download(cls, a_type, download_fp, **kwargs):
         """Download the URL to the given full path, handling auth & errors."""
@@ -632,119 +771,24 @@ class modisData(Data):
                 refl = gippy.GeoImage(allsds)
                 missing = 32767
 
-                if version == 6:
-                    redimg = refl[7].read()
-                    nirimg = refl[8].read()
-                    bluimg = refl[9].read()
-                    grnimg = refl[10].read()
-                    mirimg = refl[11].read()
-                    swrimg = refl[12].read()  # swir1, formerly swir2
-                    redqcimg = refl[0].read()
-                    nirqcimg = refl[1].read()
-                    bluqcimg = refl[2].read()
-                    grnqcimg = refl[3].read()
-                    mirqcimg = refl[4].read()
-                    swrqcimg = refl[5].read()
-                else:
+                if version != 6:
                     raise Exception('product version not supported')
 
-                # wherever the value is too small, set it to a minimum of 0
-                redimg[redimg < 0.0] = 0.0
-                nirimg[nirimg < 0.0] = 0.0
-                bluimg[bluimg < 0.0] = 0.0
-                grnimg[grnimg < 0.0] = 0.0
-                mirimg[mirimg < 0.0] = 0.0
-                swrimg[swrimg < 0.0] = 0.0
-
-                # wherever the value is too saturated, set it to a max of 1.0
-                redimg[(redimg != missing) & (redimg > 1.0)] = 1.0
-                nirimg[(nirimg != missing) & (nirimg > 1.0)] = 1.0
-                bluimg[(bluimg != missing) & (bluimg > 1.0)] = 1.0
-                grnimg[(grnimg != missing) & (grnimg > 1.0)] = 1.0
-                mirimg[(mirimg != missing) & (mirimg > 1.0)] = 1.0
-                swrimg[(swrimg != missing) & (swrimg > 1.0)] = 1.0
-
-                # red, nir
-                # first setup a blank array with everything set to missing
-                ndvi = missing + np.zeros_like(redimg)
-                # compute the ndvi only where neither input is missing, AND
-                # no divide-by-zero error will occur
-                wg = np.where((redimg != missing) & (nirimg != missing) & (redimg + nirimg != 0.0))
-                ndvi[wg] = (nirimg[wg] - redimg[wg]) / (nirimg[wg] + redimg[wg])
-
-                # nir, mir
-                lswi = missing + np.zeros_like(redimg)
-                wg = np.where((nirimg != missing) & (mirimg != missing) & (nirimg + mirimg != 0.0))
-                lswi[wg] = (nirimg[wg] - mirimg[wg]) / (nirimg[wg] + mirimg[wg])
-
-                # blu, grn, red
-                vari = missing + np.zeros_like(redimg)
-                wg = np.where((grnimg != missing) & (redimg != missing) & (bluimg != missing) & (grnimg + redimg - bluimg != 0.0))
-                vari[wg] = (grnimg[wg] - redimg[wg]) / (grnimg[wg] + redimg[wg] - bluimg[wg])
-
-                # blu, grn, red, nir
-                brgt = missing + np.zeros_like(redimg)
-                wg = np.where(
-                    (nirimg != missing) & (redimg != missing) &
-                    (bluimg != missing) & (grnimg != missing)
-                )
-                brgt[wg] = (
-                    0.3 * bluimg[wg] + 0.3 * redimg[wg] + 0.1 * nirimg[wg] +
-                    0.3 * grnimg[wg]
-                )
-
-                # red, mir, swr
-                satvi = missing + np.zeros_like(redimg)
-                wg = np.where(
-                    (redimg != missing) & (mirimg != missing) &
-                    (swrimg != missing) & ((mirimg + redimg + 0.5) != 0.0)
-                )
-                satvi[wg] = (
-                    ((mirimg[wg] - redimg[wg]) /
-                     (mirimg[wg] + redimg[wg] + 0.5)) * 1.5
-                ) - (swrimg[wg] / 2.0)
-
-                # blu, red, nir
-                evi = missing + np.zeros_like(redimg)
-                wg = np.where(
-                    (bluimg != missing) & (redimg != missing) &
-                    (nirimg != missing) &
-                    (nirimg + 6.0 * redimg - 7.5 * bluimg + 1.0 != 0.0)
-                )
-                evi[wg] = (
-                    (2.5 * (nirimg[wg] - redimg[wg])) /
-                    (nirimg[wg] + 6.0 * redimg[wg] - 7.5 * bluimg[wg] + 1.0)
-                )
-
-                qc = np.ones_like(redimg)  # mark as poor if all are not missing and not all are good
-                w0 = np.where(
-                    (redqcimg == 0) & (nirqcimg == 0) & (bluqcimg == 0) &
-                    (grnqcimg == 0) & (mirqcimg == 0) & (swrqcimg == 0)
-                )
-                w255 = np.where(
-                    (redqcimg == 255) | (nirqcimg == 255) | (bluqcimg == 255) |
-                    (grnqcimg == 255) | (mirqcimg == 255) | (swrqcimg == 255)
-                )
-                qc[w0] = 0  # mark as good if they are all good
-                qc[w255] = missing  # mark as missing if any are missing
-
                 # create output gippy image
                 vprint("writing", fname)
                 imgout = gippy.GeoImage.create_from(refl, fname, 7, 'int16')
-                del refl
 
                 imgout.set_nodata(missing)
                 imgout.set_offset(0.0)
                 imgout.set_gain(0.0001)
                 imgout[6].set_gain(1.0)
 
-                imgout[0].write(ndvi)
-                imgout[1].write(lswi)
-                imgout[2].write(vari)
-                imgout[3].write(brgt)
-                imgout[4].write(satvi)
-                imgout[5].write(evi)
-                imgout[6].write(qc)
+                # red, nir, blu, grn, mir, swir1 (formerly swir2), then the
+                # same bands' QC layers
+                in_bands = [refl[i] for i in (7, 8, 9, 10, 11, 12, 0, 1, 2, 3, 4, 5)]
+                utils.process_chunks(in_bands, imgout,
+                                     functools.partial(_indices_chunk, missing))
+                del in_bands, refl
 
                 imgout.set_bandname('NDVI', 1)
                 imgout.set_bandname('LSWI', 2)
@@ -101,6 +101,11 @@ class sentinel1Repository(Repository):
         print('cls._tilefile_name', cls._tilefile_name)
         return {k: (1,1) for k in tilelist}
 
+    @classmethod
+    def vectors2tiles(cls, vectors, *args, **kwargs):
+        """ Tile grids are made per vector, so no batching is possible """
+        return [cls.vector2tiles(v, *args, **kwargs) for v in vectors]
+
 
 class sentinel1Asset(Asset):
     Repository = sentinel1Repository
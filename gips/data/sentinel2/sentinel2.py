@@ -75,6 +75,9 @@ class sentinel2Repository(Repository):
         'source': 'esa',
         'asset-preference': _asset_types,
         'extract': False,
+        '6S-lut': None, # path to a SixsLut to use instead of running 6S
+        # off by default as it's learned from the archive; see Asset.acquisition_calendar
+        'acquisition-calendar': False,
     }
 
     @classmethod
@@ -107,6 +110,8 @@ class sentinel2Asset(gips.data.core.CloudCoverAsset,
     Repository = sentinel2Repository
 
     gs_bucket_name = 'gcp-public-data-sentinel-2'
+    catalog_index_url = 'https://storage.googleapis.com/gcp-public-data-sentinel-2/index.csv.gz'
+    query_settings = ('source',)
 
     _sensors = {
         'S2A': {
@@ -401,13 +406,89 @@ class sentinel2Asset(gips.data.core.CloudCoverAsset,
         return asset_keys
 
     @classmethod
-    def query_gs(cls, tile, date, pclouds):
-        """Query google's store of sentinel-2 data for the given scene."""
+    def gs_tile_prefix(cls, tile):
+        """Return the google storage prefix for the tile's scenes."""
+        return 'tiles/{}/{}/{}/'.format(tile[0:2], tile[2], tile[3:])
+
+    @classmethod
+    def catalog_rows(cls, reader):
+        """As superclass, for L1C scenes in google's index of its sentinel-2 bucket."""
+        bucket_url = 'gs://{}/'.format(cls.gs_bucket_name)
+        for r in reader:
+            # eg S2A_MSIL1C_20170101T104432_N0204_R008_T32TQR_20170101T104427
+            (sensor, level, start) = r['PRODUCT_ID'].split('_')[:3]
+            if (sensor not in cls._sensors or level != 'MSIL1C'
+                    or not r['BASE_URL'].startswith(bucket_url)):
+                continue
+            cc = float(r['CLOUD_COVER'] or -1)
+            yield (r['GRANULE_ID'], r['MGRS_TILE'],
+                   '{}-{}-{}'.format(start[:4], start[4:6], start[6:8]),
+                   sensor, cc if cc >= 0 else None, r['BASE_URL'][len(bucket_url):] + '/')
+
+    @classmethod
+    def gs_catalog_choice(cls, scenes):
+        """Choose among a scene catalog's scenes for a tile & date as query_gs would.
+
+        Returns (prefix, cloud cover), or (None, None) if there aren't any.
+        """
+        sensors = list(cls._sensors.keys())
+        ranked = sorted((sensors.index(sensor), prefix, cc)
+                        for (_, sensor, cc, prefix) in scenes)
+        return ranked[0][1:] if ranked else (None, None)
+
+    @classmethod
+    def gs_prefix_search_batch(cls, tile, dates):
+        """Find scene prefixes for many dates with one search per year.
+
+        Dates the scene catalog covers are looked up there instead.
+        Returns {date: (prefix, cloud cover)} for the dates searched,
+        with Nones for dates without a scene; the cloud cover is None
+        unless the scene was cataloged.  Returns None if a listing was
+        too long to fit in one response and there's no catalog.
+        """
+        found = {}
+        catalog = cls.catalog()
+        if catalog is not None:
+            for d, scenes in catalog.scenes(tile, dates, cls._assets['L1CGS']['latency']).items():
+                found[d] = cls.gs_catalog_choice(scenes)
+            dates = [d for d in dates if d not in found]
+
+        tile_prefix = cls.gs_tile_prefix(tile)
+        listing = []
+        for year in sorted(set(d.year for d in dates)):
+            for sensor in cls._sensors.keys():
+                resp = cls.gs_api_search(
+                    tile_prefix + '{}_MSIL1C_{}'.format(sensor, year))
+                if 'nextPageToken' in resp:
+                    # leave the uncataloged dates to query_gs
+                    return found if catalog is not None else None
+                listing += resp.get('prefixes', [])
+        for d in dates:
+            # same choice as query_gs:  first sensor, then first prefix
+            prefixes = [tile_prefix + '{}_MSIL1C_{}'.format(s, d.strftime('%Y%m%d'))
+                        for s in cls._sensors.keys()]
+            found[d] = (next((p for sp in prefixes for p in listing
+                              if p.startswith(sp)), None), None)
+        return found
+
+    @classmethod
+    def query_gs(cls, tile, date, pclouds, prefix=None, cloud_cover=None):
+        """Query google's store of sentinel-2 data for the given scene.
+
+        prefix is the scene's prefix if already known, and cloud_cover
+        its cloud cover if that's known too.
+        """
         atd_triad = '(L1CGS, {}, {})'.format(tile, date.strftime('%Y-%j'))
-        tile_prefix = 'tiles/{}/{}/{}/'.format(tile[0:2], tile[2], tile[3:])
+        tile_prefix = cls.gs_tile_prefix(tile)
+        catalog = cls.catalog()
+        if (prefix is None and catalog is not None
+                and catalog.covers(date, cls._assets['L1CGS']['latency'])):
+            (prefix, cloud_cover) = cls.gs_catalog_choice(catalog.scenes(tile, [date])[date])
+            if prefix is None:
+                return None
         # use a template to handle S2A vs. S2B
         prefix_template = tile_prefix + '{}_MSIL1C_' + date.strftime('%Y%m%d')
-        for sensor in cls._sensors.keys():
+        for sensor in ([] if prefix else cls._sensors.keys()):
             search_prefix = prefix_template.format(sensor)
             # only going to be one prefix, if any are found
             prefix = cls.gs_api_search(search_prefix).get(
@@ -416,6 +497,10 @@ class sentinel2Asset(gips.data.core.CloudCoverAsset,
                 break
         if prefix is None:
             return None
+        if cloud_cover is not None and cloud_cover > pclouds:
+            utils.vprint('Cataloged L1CGS asset for', atd_triad, 'has cloud cover percentage',
+                         cloud_cover, 'which fails to meet threshold of', pclouds, level=3)
+            return None
 
         gs_keys = [i['name'] for i in
                    cls.gs_api_search(prefix, delimiter=None)['items']]
@@ -435,9 +520,11 @@ class sentinel2Asset(gips.data.core.CloudCoverAsset,
             utils.verbose_out('No complete asset for {}'.format(atd_triad), 5)
             return None
 
-        # handle cloud cover
-        r = cls.gs_backoff_get(cls.gs_object_url_base() + keys['tile-md'])
-        cc = cls.cloud_cover_from_et(ElementTree.parse(StringIO(r.text)))
+        # handle cloud cover, unless the catalog's was checked above
+        cc = cloud_cover
+        if cc is None:
+            r = cls.gs_backoff_get(cls.gs_object_url_base() + keys['tile-md'])
+            cc = cls.cloud_cover_from_et(ElementTree.parse(StringIO(r.text)))
         if cc > pclouds:
             utils.vprint('Found C1GS asset for', atd_triad, 'has cloud cover percentage', cc,
                          'which fails to meet threshold of', pclouds, level=3)
@@ -465,6 +552,22 @@ class sentinel2Asset(gips.data.core.CloudCoverAsset,
         rv['a_type'] = asset
         return rv
 
+    @classmethod
+    def query_service_batch(cls, asset, tile, dates, pclouds=100, **ignored):
+        """As superclass; only supported for the google source."""
+        if cls.get_setting('source') != 'gs' or cls._assets[asset]['source'] != 'gs':
+            return None
+        dates = [d for d in dates if cls.available(asset, d)]
+        found = cls.gs_prefix_search_batch(tile, dates)
+        if found is None:
+            return None
+        rv = {}
+        for d, (prefix, cc) in found.items():
+            rv[d] = None if prefix is None else cls.query_gs(tile, d, pclouds, prefix, cc)
+            if rv[d] is not None:
+                rv[d]['a_type'] = asset
+        return rv
+
     @classmethod
     def download(cls, a_type, download_fp, **kwargs):
         """Download from the configured source for the asset type."""
@@ -579,27 +682,67 @@ class sentinel2Asset(gips.data.core.CloudCoverAsset,
         return list(tiles)
 
     @classmethod
-    def cloud_cover_from_et(cls, tree):
-        """Tree needs to be an ElementTree object."""
-        root = tree.getroot()
+    def _tile_md_namespace(cls, root):
+        """Return the namespace of the tile metadata xml's root element."""
         nsre = r'^({.+})Level-1C_Tile_ID$'
-        ns = None
         for el in root.iter():
             match = re.match(nsre, el.tag)
             if match:
-                ns = match.group(1)
-                break
-        if ns is None:
-            raise Exception("Tile metadata xml namespace could not be found")
+                return match.group(1)
+        raise Exception("Tile metadata xml namespace could not be found")
+
+    @classmethod
+    def cloud_cover_from_et(cls, tree):
+        """Tree needs to be an ElementTree object."""
+        root = tree.getroot()
+        ns = cls._tile_md_namespace(root)
         cloud_cover_xpath = ("./{}Quality_Indicators_Info/Image_Content_QI"
                              "/CLOUDY_PIXEL_PERCENTAGE")
         cloud_coverage_el = root.findall(cloud_cover_xpath.format(ns))[0]
         return float(cloud_coverage_el.text)
 
+    @classmethod
+    def sensing_time_from_et(cls, tree):
+        """Return the tile's sensing time as a UTC datetime, or None if it's absent.
+
+        Tree needs to be an ElementTree object."""
+        root = tree.getroot()
+        el = root.find('./{}General_Info/SENSING_TIME'.format(cls._tile_md_namespace(root)))
+        if el is None:
+            return None
+        return datetime.datetime.strptime(el.text.strip(), '%Y-%m-%dT%H:%M:%S.%fZ').replace(
+            tzinfo=datetime.timezone.utc)
+
+    @classmethod
+    def acquisition_calendar(cls, asset_type, tile):
+        """S2A & S2B each pass over a relative orbit every 10 days, 5 days apart.
+
+        Which relative orbits cover a tile can't be told from its ID, so
+        their days in the 5-day cycle are learned from the dates the
+        tile already has in the archive; for tiles without any, every
+        day is plausible.  An orbit the archive has no dates for is
+        never fetched, which is why the 'acquisition-calendar' setting
+        is off by default for this driver.
+        """
+        known = cls.Repository.find_dates(tile)
+        if not known:
+            return None
+        phases = {d.toordinal() % 5 for d in known}
+        return lambda d: d.toordinal() % 5 in phases
+
+    def extract_metadata(self):
+        md = super(sentinel2Asset, self).extract_metadata()
+        # cloud_cover() sets this when it reads the tile metadata
+        if self.meta.get('acquired') is not None:
+            md['acquired'] = self.meta['acquired']
+        return md
+
     def cloud_cover(self):
         """Returns cloud cover for the current asset.
 
-        Caches and returns the value found in self.meta['cloud-cover']."""
+        Caches and returns the value found in self.meta['cloud-cover'].
+        Also caches the sensing time in self.meta['acquired'] if the
+        tile metadata is read."""
         if 'cloud-cover' in self.meta:
             return self.meta['cloud-cover']
         if os.path.exists(self.filename):
@@ -609,6 +752,7 @@ class sentinel2Asset(gips.data.core.CloudCoverAsset,
                 self.extract([metadata_file], path=tmpdir)
                 tree = ElementTree.parse(tmpdir + '/' + metadata_file)
             self.meta['cloud-cover'] = self.cloud_cover_from_et(tree)
+            self.meta['acquired'] = self.sensing_time_from_et(tree)
             return self.meta['cloud-cover']
 
         results = self.query_scihub(
@@ -779,7 +923,8 @@ class sentinel2Asset(gips.data.core.CloudCoverAsset,
             'lat': (s_lat + n_lat) / 2.0, # copy landsat - use center of tile
         }
         dt = datetime.datetime.combine(self.date, self.time)
-        self._atmo_corrector = atmosphere.SIXS(visbands, wvlens, geo, dt, sensor=self.sensor)
+        self._atmo_corrector = atmosphere.SIXS(visbands, wvlens, geo, dt, sensor=self.sensor,
+                                               lut=self.Repository.get_setting('6S-lut'))
         return self._atmo_corrector
 
     def footprint(self):
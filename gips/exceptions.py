@@ -5,3 +5,14 @@ class GipsException(Exception):
         # unknown error
         self.exc_code = 1 if 'exc_code' not in kwargs else kwargs['exc_code']
 
+
+
+class WorkerException(GipsException):
+    """Relays an exception raised in a worker process to the parent.
+
+    The worker's traceback text is kept in worker_tb_text so error
+    reporting can show where the failure actually happened.
+    """
+    def __init__(self, msg, worker_tb_text='', **kwargs):
+        super(WorkerException, self).__init__(msg, **kwargs)
+        self.worker_tb_text = worker_tb_text
@@ -26,8 +26,9 @@ import sys
 import os
 from datetime import datetime as dt
 import traceback
+import multiprocessing
 import numpy
-from copy import deepcopy
+from copy import copy, deepcopy
 from collections import defaultdict
 
 import gippy
@@ -35,9 +36,73 @@ from gippy.gippy import Chunk
 from gips.tiles import Tiles
 from gips.utils import VerboseOut, Colors
 from gips import utils
+from gips.exceptions import WorkerException
 from . import dbinv, orm
 
 
+def _process_init(_inventory, _args, _kwargs, _procs=1):
+    """ Initializer sets globals for worker processes """
+    global inventory, proc_args, proc_kwargs
+    inventory = _inventory
+    proc_args = _args
+    proc_kwargs = _kwargs
+    # parallelism comes from the pool; don't oversubscribe with gippy threads,
+    # and share the CPUs out between the _procs workers' warps
+    gippy.Options.set_cores(1)
+    utils.set_warp_threads(max(1, multiprocessing.cpu_count() // _procs))
+    utils.set_error_handler(utils.worker_error_handler)
+
+
+def _process_worker(unit):
+    """Process one (date, tile) unit (has access to globals set in _process_init).
+
+    Returns (unit, files, errors):  files is a list of (sensor, product,
+    filename) for each product file made; the parent adds these to its
+    own Data object and to the inventory DB.  errors is a list of
+    (message, traceback text) pairs, one per error encountered.
+    """
+    date, tile = unit
+    tiles_obj = inventory.data[date]
+    data_obj = tiles_obj.tiles[tile]
+    data_obj._defer_db_writes = True
+    old_filenames = dict(data_obj.filenames)
+    _, errors = _worker_call(data_obj.process, *proc_args,
+                             products=tiles_obj.products.products, **proc_kwargs)
+    files = [(s, p, fn) for ((s, p), fn) in data_obj.filenames.items()
+             if old_filenames.get((s, p)) != fn]
+    return unit, files, errors
+
+
+def _mosaic_worker(unit):
+    """Make one (date, datadir, sensor, product) mosaic (has access to globals set in _process_init).
+
+    Returns (unit, filename, errors):  filename is the mosaic's if it was
+    made, else None; errors are as for _process_worker.
+    """
+    date, datadir, sensor, product = unit
+    fname, errors = _worker_call(inventory.data[date].mosaic_product,
+                                 datadir, sensor, product, **proc_kwargs)
+    return unit, fname, errors
+
+
+def _worker_call(func, *args, **kwargs):
+    """Call func in a worker; returns its result & (message, traceback text) for each error.
+
+    The result is None if func raised.
+    """
+    del utils._accumulated_errors[:]
+    result = None
+    try:
+        result = func(*args, **kwargs)
+    except Exception as e:
+        if not hasattr(e, 'msg_prefix'):
+            e.msg_prefix = 'Error'
+            e.tb_text = traceback.format_exc()
+        utils._accumulated_errors.append(e)
+    return result, [('{}: {}: {}'.format(e.msg_prefix, type(e).__name__, e), e.tb_text)
+                    for e in utils._accumulated_errors]
+
+
 class Inventory(object):
     """ Base class for inventories """
     _colors = [Colors.PURPLE, Colors.RED, Colors.GREEN, Colors.BLUE, Colors.YELLOW]
@@ -287,7 +352,7 @@ class DataInventory(Inventory):
                 for a in archived_assets:
                     dbinv.update_or_add_asset(
                             asset=a.asset, sensor=a.sensor, tile=a.tile, date=a.date,
-                            name=a.archived_filename, driver=driver)
+                            name=a.archived_filename, driver=driver, metadata=a.metadata())
                     # if the new asset comes with any "free" products, save that info:
                     for (prod_type, fp) in a.products.items():
                         dbinv.update_or_add_product(
@@ -297,7 +362,6 @@ class DataInventory(Inventory):
         # Build up the inventory:  One Tiles object per date.  Each contains one Data object.  Each
         # of those contain one or more Asset objects.
         self.data = {}
-        dates = self.temporal.prune_dates(spatial.available_dates)
         if orm.use_orm():
             # populate the object tree under the DataInventory (Tiles, Data, Asset) by querying the
             # DB quick-like then assigning things we iterate:  The DB is a flat table of data; we
@@ -315,15 +379,19 @@ class DataInventory(Inventory):
                 key = (date, str(tile)) # str() to avoid possible unicode trouble
                 collection[key][kind].append(item)
 
+            # date ranges instead of a list of dates found per tile, so the DB can answer with
+            # range scans of its (driver, tile, date) indexes
             search_criteria = { # same for both Assets and Products
                 'driver': Repository.name.lower(),
                 'tile__in': spatial.tiles,
-                'date__in': dates,
             }
-            for p in dbinv.product_search(**search_criteria).order_by('date', 'tile'):
+            in_ranges = dbinv.in_date_ranges(self.temporal.date_ranges())
+            for p in dbinv.product_search(**search_criteria).filter(
+                    in_ranges).order_by('date', 'tile'):
                 add_to_collection(p.date, p.tile, 'p', str(p.name))
-            for a in dbinv.asset_search(**search_criteria).order_by('date', 'tile'):
-                add_to_collection(a.date, a.tile, 'a', str(a.name))
+            for a in dbinv.asset_search(**search_criteria).filter(
+                    in_ranges).order_by('date', 'tile'):
+                add_to_collection(a.date, a.tile, 'a', (str(a.name), dbinv.asset_metadata(a)))
 
             # the collection is now complete so use it to populate the GIPS object hierarchy
             for k, v in collection.items():
@@ -336,7 +404,11 @@ class DataInventory(Inventory):
                 assert tile not in tiles_obj.tiles # sanity check
                 data_obj = dataclass(tile, date, search=False)
                 # add assets and products
-                [data_obj.add_asset(dataclass.Asset(a)) for a in v['a']]
+                for (name, metadata) in v['a']:
+                    asset_obj = dataclass.Asset(name)
+                    if metadata: # else leave it to the asset's sidecar
+                        asset_obj.set_metadata(metadata)
+                    data_obj.add_asset(asset_obj)
                 data_obj.ParseAndAddFiles(v['p'])
                 # add the new Data object to the Tiles object if it checks out
                 if data_obj.valid and data_obj.filter(**kwargs):
@@ -346,7 +418,7 @@ class DataInventory(Inventory):
         # Perform filesystem search since user wants that.  Data object instantiation results
         # in filesystem search (thanks to search=True).
         self.data = {} # clear out data dict in case it has partial results
-        for date in dates:
+        for date in self.temporal.prune_dates(spatial.available_dates):
             tiles_obj = Tiles(dataclass, spatial, date, self.products, **kwargs)
             for t in spatial.tiles:
                 data_obj = dataclass(t, date, search=True)
@@ -354,44 +426,165 @@ class DataInventory(Inventory):
                     tiles_obj.tiles[t] = data_obj
             if len(tiles_obj) > 0:
                 self.data[date] = tiles_obj
-
+        # can't import at module scope due to circular dependencies
+        from gips.data.core import DirectoryIndex
+        DirectoryIndex.get(Repository).save()
+
+    @classmethod
+    def for_extents(cls, dataclass, extents, temporal, **kwargs):
+        """Return a DataInventory for each of the given spatial extents.
+
+        Rather than searching (and fetching) once per extent, one inventory
+        is made for the union of the extents' tiles, then sliced per
+        extent; Data objects for tiles the extents share are shared too.
+        kwargs are passed to DataInventory().
+        """
+        # can't import at module scope due to circular dependencies
+        from gips.core import SpatialExtent
+        tiles = sorted(set(t for e in extents for t in e.tiles))
+        union = cls(dataclass, SpatialExtent(dataclass, tiles), temporal, **kwargs)
+        return [union.subset(e) for e in extents]
+
+    def subset(self, spatial):
+        """Return a new DataInventory limited to the tiles of the given SpatialExtent."""
+        inv = copy(self)
+        inv.spatial = spatial
+        inv.data = {}
+        for date, tiles_obj in self.data.items():
+            subset_tiles = Tiles(self.dataclass, spatial, date, self.products)
+            subset_tiles.tiles = {t: data_obj for (t, data_obj) in tiles_obj.tiles.items()
+                                  if t in spatial.coverage}
+            if len(subset_tiles) > 0:
+                inv.data[date] = subset_tiles
+        return inv
 
     @property
     def sensor_set(self):
         """ The set of all sensors used in this inventory """
         return sorted(self.dataclass.Asset._sensors.keys())
 
-    def process(self, *args, **kwargs):
-        """ Process assets into requested products """
+    def process(self, *args, numprocs=1, **kwargs):
+        """ Process assets into requested products
+
+        If numprocs > 1, each (date, tile) is processed independently in a
+        pool of worker processes; see process_parallel.
+        """
         # TODO - some check on if any processing was done
         start = dt.now()
         VerboseOut('Processing [%s] on %s dates (%s files)' % (self.products, len(self.dates), self.numfiles), 3)
         if len(self.products.standard) > 0:
-            for date in self.dates:
-                with utils.error_handler(continuable=True):
-                    self.data[date].process(*args, **kwargs)
+            if numprocs > 1:
+                self.process_parallel(numprocs, *args, **kwargs)
+            else:
+                for date in self.dates:
+                    with utils.error_handler(continuable=True):
+                        self.data[date].process(*args, **kwargs)
         if len(self.products.composite) > 0:
             self.dataclass.process_composites(self, self.products.composite, **kwargs)
         VerboseOut('Processing completed in %s' % (dt.now() - start), 2)
 
-    def mosaic(self, datadir='./', tree=False, process=True, **kwargs):
-        """ Create project files for data in inventory """
+    def process_parallel(self, numprocs, *args, **kwargs):
+        """Process each (date, tile) in a pool of numprocs worker processes.
+
+        Workers inherit the inventory via fork.  Errors in a worker are
+        relayed back and reported through utils.error_handler, and product
+        files are recorded in the inventory DB by this (the parent)
+        process, so workers never write to the DB.
+        """
+        units = [(date, tile) for date in self.dates for tile in self.data[date].tiles]
+        if len(units) == 0:
+            return
+        VerboseOut('Processing {} tile-dates with {} processes'.format(len(units), numprocs), 3)
+        # DB connections mustn't be shared across fork; each process reconnects on demand
+        orm.close_connections()
+        # fork explicitly; workers rely on inheriting state, which spawn wouldn't give them
+        procs = min(numprocs, len(units))
+        pool = multiprocessing.get_context('fork').Pool(
+            procs, initializer=_process_init, initargs=(self, args, kwargs, procs))
+        try:
+            for (date, tile), files, errors in pool.imap_unordered(_process_worker, units):
+                data_obj = self.data[date].tiles[tile]
+                for sensor, product, filename in files:
+                    data_obj.AddFile(sensor, product, filename)
+                err_msg = 'Error processing {} {}'.format(tile, date)
+                for error in errors:
+                    with utils.error_handler(err_msg, continuable=True):
+                        raise WorkerException(*error)
+        except BaseException:
+            pool.terminate() # eg stop-on-error; abandon outstanding work
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+
+    def mosaic(self, datadir='./', tree=False, process=True, numprocs=1, done=None, **kwargs):
+        """ Create project files for data in inventory
+
+        If numprocs > 1, products are processed, and each (date, product)
+        is mosaicked, in a pool of worker processes; see mosaic_parallel.
+        If given, done is called (in this process) with each mosaic's
+        filename as soon as it's in place, eg to upload it.
+        """
         # make sure products have been processed first
         if process:
-            self.process(overwrite=False)
+            self.process(overwrite=False, numprocs=numprocs)
         start = dt.now()
         VerboseOut('Creating mosaic project %s' % datadir, 2)
         VerboseOut('  Dates: %s' % self.datestr)
         VerboseOut('  Products: %s' % self.products)
 
         dout = datadir
-        for d in self.dates:
-            if tree:
-                dout = os.path.join(datadir, d.strftime('%Y%j'))
-            self.data[d].mosaic(dout, **kwargs)
+        if numprocs > 1:
+            units = []
+            for d in self.dates:
+                if tree:
+                    dout = os.path.join(datadir, d.strftime('%Y%j'))
+                units.extend((d, dout, s, p) for (s, p) in self.data[d].mosaic_pile())
+            self.mosaic_parallel(numprocs, units, kwargs, done)
+        else:
+            for d in self.dates:
+                if tree:
+                    dout = os.path.join(datadir, d.strftime('%Y%j'))
+                self.data[d].mosaic(dout, done=done, **kwargs)
 
         VerboseOut('Completed mosaic project in %s' % (dt.now() - start), 2)
 
+    def mosaic_parallel(self, numprocs, units, kwargs, done=None):
+        """Make each (date, datadir, sensor, product) mosaic in a pool of numprocs processes.
+
+        Like process_parallel, workers inherit the inventory via fork and
+        their errors are reported here.  Each mosaic is still written to
+        a temp dir and renamed into place; see Tiles.mosaic_product.
+        done, if given, is called here with each one's filename as it's
+        finished.
+        """
+        if self.spatial.site is None:
+            raise Exception('Site required for creating mosaics')
+        if len(units) == 0:
+            return
+        VerboseOut('Mosaicking {} date-products with {} processes'.format(len(units), numprocs), 3)
+        orm.close_connections()
+        procs = min(numprocs, len(units))
+        pool = multiprocessing.get_context('fork').Pool(
+            procs, initializer=_process_init, initargs=(self, (), kwargs, procs))
+        try:
+            for (date, _, sensor, product), fname, errors in pool.imap_unordered(
+                    _mosaic_worker, units):
+                if fname is not None and done is not None:
+                    done(fname)
+                err_msg = 'Error mosaicking {} {} {}'.format(date, sensor, product)
+                for error in errors:
+                    with utils.error_handler(err_msg, continuable=True):
+                        raise WorkerException(*error)
+        except BaseException:
+            pool.terminate() # eg stop-on-error; abandon outstanding work
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+
     # def warptiles(self):
     #    """ Just copy or warp all tiles in the inventory """
 
@@ -1,9 +1,8 @@
-import os, glob, sys, traceback, datetime, time, itertools, re
-
-import django.db.transaction
+import os, glob, sys, traceback, datetime, time, itertools, re, contextlib, threading
 
 from gips.utils import verbose_out, basename
 from gips import utils
+from gips.inventory import orm
 
 
 """API for the DB inventory for GIPS.
@@ -11,10 +10,29 @@ from gips import utils
 Provides a clean interface layer for GIPS callers to do CRUD ops on the
 inventory DB, mostly by interfacing with dbinv.models.  Due to Django
 bootstrapping weirdness, some imports have to be done in each function's
-body.
+body.  With INVENTORY_BACKEND = 'sqlite3', dbinv.lite stands in for
+dbinv.models & Django, and Django is never loaded.
 """
 
 
+def _models():
+    """Return the module with the Asset & Product models for the inventory backend."""
+    if orm.backend() == 'sqlite3':
+        from . import lite
+        return lite
+    from . import models
+    return models
+
+
+def _atomic():
+    """Return a transaction context manager for the inventory backend."""
+    if orm.backend() == 'sqlite3':
+        from . import lite
+        return lite.atomic()
+    import django.db.transaction
+    return django.db.transaction.atomic()
+
+
 def _grouper(iterable, n, fillvalue=None):
     """Collect data into fixed-length chunks or blocks.
 
@@ -30,7 +48,7 @@ def _chunky_transaction(iterable, function, chunk_sz=1000, item_desc="items"):
     iter_cnt = 0
     chunk_start_time = start_time = time.time()
     for chunk in _grouper(iterable, chunk_sz):
-        with django.db.transaction.atomic():
+        with _atomic():
             for item in chunk:
                 if item is None:
                     break # need this due to izip_longest padding chunks with Nones
@@ -45,15 +63,91 @@ def _chunky_transaction(iterable, function, chunk_sz=1000, item_desc="items"):
         chunk_start_time = new_chunk_start_time
 
 
-def rectify_assets(asset_class):
+def _bulk_rectify(model, filter_kwargs, filenames, parse, key_fields,
+                  value_fields=('sensor', 'name'), chunk_sz=1000, item_desc="files"):
+    """Rectify the model's rows matching filter_kwargs against the given files.
+
+    parse(filename) returns a dict of field values for the file, or None
+    to skip it.  Rows are identified by key_fields, and the rest of their
+    content is value_fields (less any key_fields); existing rows are
+    loaded into memory once and diffed against the files a chunk at a
+    time, so only new and changed rows cost database writes.  Rows that
+    match no file are deleted in batches.  Returns counts of rows added,
+    updated, unchanged, and deleted.
+    """
+    objects = model.objects
+    value_fields = tuple(f for f in value_fields if f not in key_fields)
+    existing = {} # natural key: (pk, values)
+    n_keys = len(key_fields)
+    for row in objects.filter(**filter_kwargs).values_list(
+            'id', *(key_fields + value_fields)).iterator():
+        existing[row[1:n_keys + 1]] = (row[0], row[n_keys + 1:])
+
+    counts = {'add': 0, 'update': 0, 'unchanged': 0, 'delete': 0}
+    seen = set() # natural keys found in the filesystem
+    iter_cnt = 0
+    chunk_start_time = start_time = time.time()
+    for chunk in _grouper(filenames, chunk_sz):
+        new_rows, changed_rows = [], []
+        for f_name in chunk:
+            if f_name is None:
+                break # need this due to izip_longest padding chunks with Nones
+            iter_cnt += 1
+            values = parse(f_name)
+            if values is None:
+                continue
+            key = tuple(values[f] for f in key_fields)
+            if key in seen:
+                verbose_out("Skipping file with the same key as another:  " + f_name, 2)
+                continue
+            seen.add(key)
+            if key not in existing:
+                new_rows.append(model(**dict(filter_kwargs, **values)))
+                verbose_out("Record added to database:  " + f_name, 5)
+                continue
+            (pk, old_values) = existing[key]
+            new_values = tuple(values[f] for f in value_fields)
+            if new_values == old_values:
+                counts['unchanged'] += 1
+            else:
+                changed_rows.append((pk, dict(zip(value_fields, new_values))))
+            verbose_out("Record found in database:  " + f_name, 5)
+        with _atomic():
+            objects.bulk_create(new_rows)
+            # django 1.11 has no bulk_update, but changed rows are rare
+            for (pk, values) in changed_rows:
+                objects.filter(pk=pk).update(**values)
+        counts['add'] += len(new_rows)
+        counts['update'] += len(changed_rows)
+        # after each chunk report stats
+        new_chunk_start_time = time.time()
+        utils.vprint("{} {} scanned; chunk time {:0.2f}s, total time {:0.2f}s".format(
+                iter_cnt, item_desc,
+                new_chunk_start_time - chunk_start_time,
+                new_chunk_start_time - start_time))
+        chunk_start_time = new_chunk_start_time
+
+    # Remove things from DB that are NOT in FS; batches keep sqlite's query params in bounds
+    stale_keys = [pk for (key, (pk, _)) in existing.items() if key not in seen]
+    delete_chunk_sz = 500
+    for i in range(0, len(stale_keys), delete_chunk_sz):
+        with _atomic():
+            objects.filter(pk__in=stale_keys[i:i + delete_chunk_sz]).delete()
+    counts['delete'] = len(stale_keys)
+    return counts
+
+
+def rectify_assets(asset_class, bulk=False):
     """Rectify the asset inventory database against the filesystem archive.
 
     For the current driver, go through each asset in the filesystem
     and ensure it has an entry in the inventory database.  Also
-    remove any database entries that match no archived files.
+    remove any database entries that match no archived files.  If
+    bulk, diff the filesystem against the database in memory and
+    write only the differences, in batches; much faster for large
+    archives.
     """
-    # can't load this at module compile time because django initialization is crazytown
-    from . import models
+    models = _models()
     mao = models.Asset.objects
     driver = asset_class.Repository.name.lower()
     # this assumes this directory layout:  /path-to-repo/tiles/*/*/
@@ -63,7 +157,7 @@ def rectify_assets(asset_class):
         a = asset_class(f_name)
         (asset, created) = mao.update_or_create(
                 asset=a.asset, sensor=a.sensor, tile=a.tile, date=a.date,
-                name=f_name, driver=driver)
+                name=f_name, driver=driver, defaults=metadata_fields(a.metadata()))
         asset.save()
         touched_rows.add(asset.pk)
         if created:
@@ -73,17 +167,30 @@ def rectify_assets(asset_class):
             counts['update'] += 1
             verbose_out("Asset found in database:  " + f_name, 5)
 
+    def parse_asset(f_name): # parse function for _bulk_rectify()
+        a = asset_class(f_name)
+        return dict(metadata_fields(a.metadata()), asset=a.asset, sensor=a.sensor,
+                    tile=a.tile, date=_as_date(a.date), name=f_name)
+
     start_time = time.time()
     for (ak, av) in asset_class._assets.items():
         utils.vprint("Starting on {} assets at {:0.2f}s".format(ak, time.time() - start_time))
+        imatches = itertools.chain.from_iterable(utils.find_files(av['pattern'], path)
+                                                 for path in glob.iglob(path_glob))
+        if bulk:
+            counts = _bulk_rectify(models.Asset, {'driver': driver, 'asset': ak}, imatches,
+                                   parse_asset, ('asset', 'tile', 'date'),
+                                   ('sensor', 'name') + tuple(_metadata_fields.values()))
+            msg = "{} complete, inventory records changed:  {} added, {} updated, {} deleted"
+            utils.vprint(msg.format(ak, counts['add'], counts['update'], counts['delete']))
+            continue
         counts = {'add': 0, 'update': 0} # A flaw in python scoping makes this necessary
         touched_rows = set() # for removing entries that don't match the filesystem
         # little optimization to make deleting stale records go faster:
         starting_keys = set(mao.filter(driver=driver, asset=ak).values_list('id', flat=True))
 
-        # Use iterators to cut down on memory usage; some asset collections can be pretty big
-        imatches = itertools.chain.from_iterable(utils.find_files(av['pattern'], path)
-                                                 for path in glob.iglob(path_glob))
+        # imatches is an iterator to cut down on memory usage; some asset collections can be
+        # pretty big
         _chunky_transaction(imatches, rectify_asset)
 
         # Remove things from DB that are NOT in FS:
@@ -105,17 +212,38 @@ def _match_failure_report(f_name, reason):
     verbose_out(msg.format(f_name, reason), 2, sys.stderr)
 
 
-def rectify_products(data_class):
+def _parse_product_filename(data_class, full_fn):
+    """Return a dict of Product field values for the file, or None on failure."""
+    bfn_parts = basename(full_fn).split('_')
+    if not len(bfn_parts) == 4:
+        _match_failure_report(full_fn,
+                "Failure to parse:  Wrong number of '_'-delimited substrings.")
+        return None
+
+    # extract metadata about the file
+    (tile, date_str, sensor, product) = bfn_parts
+    date_pattern = data_class.Asset.Repository._datedir
+    try:
+        date = datetime.datetime.strptime(date_str, date_pattern).date()
+    except Exception:
+        verbose_out(traceback.format_exc(), 4, sys.stderr)
+        msg = "Failure to parse date:  '{}' didn't adhere to pattern '{}'."
+        _match_failure_report(full_fn, msg.format(date_str, date_pattern))
+        return None
+    return {'product': product, 'sensor': sensor, 'tile': tile, 'date': date,
+            'name': full_fn}
+
+
+def rectify_products(data_class, bulk=False):
     """Rectify the product inventory database against the filesystem archive.
 
     For the current driver, go through each product in the filesystem
     and ensure it has an entry in the inventory database.  Also
     remove any database entries that match no extant file.  Attempt to
     follow the process in Data() closely, in particular find_files and
-    ParseAndAddFiles.
+    ParseAndAddFiles.  bulk works as for rectify_assets.
     """
-    # can't load this at module compile time because django initialization is crazytown
-    from . import models
+    models = _models()
     # search_glob for supported drivers:  /path-to-repo/tiles/*/*/*.tif
     search_glob = os.path.join(data_class.Asset.Repository.data_path(),
                                '*', '*', data_class._pattern)
@@ -123,6 +251,14 @@ def rectify_products(data_class):
 
     mpo = models.Product.objects
     driver = data_class.name.lower()
+    if bulk:
+        counts = _bulk_rectify(models.Product, {'driver': driver}, glob.iglob(search_glob),
+                               lambda fn: _parse_product_filename(data_class, fn),
+                               ('product', 'sensor', 'tile', 'date'))
+        msg = "{} complete, inventory records changed:  {} added, {} updated, {} deleted"
+        utils.vprint(msg.format(driver, counts['add'], counts['update'], counts['delete']))
+        return
+
     touched_rows = set() # for removing entries that don't match the filesystem
     counts = {'add': 0, 'update': 0}
     # TODO may need an outer loop like assets; if this explodes for big drivers, split it up by date
@@ -130,26 +266,10 @@ def rectify_products(data_class):
     starting_keys = set(mpo.filter(driver=driver).values_list('id', flat=True))
 
     def rectify_product(full_fn):
-        bfn_parts = basename(full_fn).split('_')
-        if not len(bfn_parts) == 4:
-            _match_failure_report(full_fn,
-                    "Failure to parse:  Wrong number of '_'-delimited substrings.")
+        values = _parse_product_filename(data_class, full_fn)
+        if values is None:
             return
-
-        # extract metadata about the file
-        (tile, date_str, sensor, product) = bfn_parts
-        date_pattern = data_class.Asset.Repository._datedir
-        try:
-            date = datetime.datetime.strptime(date_str, date_pattern).date()
-        except Exception:
-            verbose_out(traceback.format_exc(), 4, sys.stderr)
-            msg = "Failure to parse date:  '{}' didn't adhere to pattern '{}'."
-            _match_failure_report(full_fn, msg.format(date_str, date_pattern))
-            return
-
-        (product, created) = mpo.update_or_create(
-                product=product, sensor=sensor, tile=tile, date=date,
-                driver=driver, name=full_fn)
+        (product, created) = mpo.update_or_create(driver=driver, **values)
         product.save()
         # TODO can subtract this item from starting_keys each time and possibly save some memory and time
         touched_rows.add(product.pk)
@@ -175,17 +295,126 @@ def rectify_products(data_class):
     utils.vprint(msg.format(driver, counts['add'], counts['update'], del_cnt))
 
 
+class _Prefetch(object):
+    """In-memory copy of a driver's asset & product rows for some tiles & dates.
+
+    Rows are loaded when first needed, so unused prefetches cost nothing.
+    """
+
+    def __init__(self, driver, tiles, date_range):
+        self.driver = driver
+        self.tiles = set(tiles)
+        self.date_range = tuple(_as_date(d) for d in date_range)
+        self.assets = None   # (asset, tile, date): name
+        self.products = None # (tile, date): {(product, sensor): name}
+        self._lock = threading.Lock() # fetch may look things up from several threads
+
+    def covers(self, driver, tile, date):
+        return (driver == self.driver and tile in self.tiles
+                and self.date_range[0] <= date <= self.date_range[1])
+
+    def load(self):
+        """Load the rows with one query per table, if that hasn't been done yet."""
+        models = _models()
+        with self._lock:
+            if self.assets is not None:
+                return
+            criteria = {'driver': self.driver, 'tile__in': list(self.tiles),
+                        'date__range': self.date_range}
+            assets = {}
+            for (asset, tile, date, name) in models.Asset.objects.filter(
+                    **criteria).values_list('asset', 'tile', 'date', 'name'):
+                assets[(asset, tile, date)] = name
+            products = {}
+            for (product, sensor, tile, date, name) in models.Product.objects.filter(
+                    **criteria).values_list('product', 'sensor', 'tile', 'date', 'name'):
+                products.setdefault((tile, date), {})[(product, sensor)] = name
+            self.products = products
+            self.assets = assets
+
+
+_prefetches = [] # active _Prefetch objects, most recent last
+
+
+def _as_date(date):
+    """Django returns dates, but callers may use datetimes; the lookups need dates."""
+    return date.date() if isinstance(date, datetime.datetime) else date
+
+
+def _covering_prefetch(driver, tile, date):
+    """Return the active _Prefetch covering the driver, tile and date, or None."""
+    for p in reversed(_prefetches):
+        if p.covers(driver, tile, date):
+            p.load()
+            return p
+    return None
+
+
+@contextlib.contextmanager
+def prefetch(driver, tiles, date_range):
+    """Serve find_asset and find_products from memory for the given extent.
+
+    All asset & product rows for the driver, tiles, and (start, end)
+    date_range are loaded with one query each, on first use.  Within the
+    context, lookups in that extent are answered without querying the
+    database; this module's functions for adding and deleting rows keep
+    the in-memory copy current.
+    """
+    p = _Prefetch(driver, tiles, date_range)
+    _prefetches.append(p)
+    try:
+        yield p
+    finally:
+        _prefetches.remove(p)
+
+
+def find_asset(driver, asset, tile, date):
+    """Return the filename of the asset for the a-t-d trio, or None if there isn't one."""
+    date = _as_date(date)
+    p = _covering_prefetch(driver, tile, date)
+    if p is not None:
+        return p.assets.get((asset, tile, date))
+    results = asset_search(driver=driver, asset=asset, tile=tile, date=date)
+    if len(results) == 0:
+        return None
+    assert len(results) == 1 # sanity check; DB should enforce
+    return results[0].name
+
+
+def find_products(driver, tile, date):
+    """Return the filenames of the products for the given tile and date."""
+    date = _as_date(date)
+    p = _covering_prefetch(driver, tile, date)
+    if p is not None:
+        return list(p.products.get((tile, date), {}).values())
+    return [p.name for p in product_search(driver=driver, tile=tile, date=date)]
+
+
+def _prefetch_asset(a):
+    """Record the saved Asset model in any prefetch that covers it."""
+    p = _covering_prefetch(a.driver, a.tile, _as_date(a.date))
+    if p is not None:
+        p.assets[(a.asset, a.tile, _as_date(a.date))] = a.name
+
+
+def _prefetch_product(p_model):
+    """Record the saved Product model in any prefetch that covers it."""
+    date = _as_date(p_model.date)
+    p = _covering_prefetch(p_model.driver, p_model.tile, date)
+    if p is not None:
+        p.products.setdefault((p_model.tile, date), {})[
+            (p_model.product, p_model.sensor)] = p_model.name
+
+
 def list_tiles(driver):
     """List tiles for which there are extant asset files for the given driver."""
-    from .models import Asset
-    return Asset.objects.filter(driver=driver).values_list(
+    return _models().Asset.objects.filter(driver=driver).values_list(
             'tile', flat=True).distinct().order_by('tile')
 
 
 def list_dates(driver, tile):
     """For the given driver & tile, list dates for which assets exist."""
-    from .models import Asset
-    return Asset.objects.filter(driver=driver, tile=tile).values_list(
+    return _models().Asset.objects.filter(driver=driver, tile=tile).values_list(
             'date', flat=True).distinct().order_by('date')
 
 
@@ -195,9 +424,9 @@ def add_asset(**values):
     Arguments:  asset, sensor, tile, date, name, driver; passed directly
     into models.Asset().
     """
-    from .models import Asset
-    a = Asset(**values)
+    a = _models().Asset(**values)
     a.save()
+    _prefetch_asset(a)
     return a # in case the user needs it
 
 
@@ -207,23 +436,46 @@ def add_product(**values):
     Arguments:  driver, product, sensor, tile, date, name; passed
     directly into models.Product().
     """
-    from .models import Product
-    p = Product(**values)
+    p = _models().Product(**values)
     p.save()
+    _prefetch_product(p)
     return p # in case the user needs it
 
 def delete_product(**values):
     """Deletes the object found by get(**values)."""
-    from .models import Product
-    Product.objects.get(**values).delete()
+    p_model = _models().Product.objects.get(**values)
+    p_model.delete()
+    date = _as_date(p_model.date)
+    p = _covering_prefetch(p_model.driver, p_model.tile, date)
+    if p is not None:
+        p.products.get((p_model.tile, date), {}).pop((p_model.product, p_model.sensor), None)
+
+# Asset.metadata() keys for Asset model fields
+_metadata_fields = {'cloud-cover': 'cloud_cover', 'size': 'size', 'acquired': 'acquired'}
 
-def update_or_add_asset(driver, asset, tile, date, sensor, name):
+
+def metadata_fields(metadata):
+    """Return Asset model field values for the given Asset.metadata().
+
+    All the fields are given, with None for values that are unknown.
+    """
+    return {f: metadata.get(k) for (k, f) in _metadata_fields.items()}
+
+
+def asset_metadata(asset_model):
+    """Return the Asset.metadata() recorded in the Asset model."""
+    md = {k: getattr(asset_model, f) for (k, f) in _metadata_fields.items()}
+    return {k: v for (k, v) in md.items() if v is not None}
+
+
+def update_or_add_asset(driver, asset, tile, date, sensor, name, metadata=None):
     """Update an existing model or create it if it's not found.
 
     Convenience method that wraps update_or_create.  The first four
     arguments are used to make a unique key to search for a matching model.
+    If given, metadata is the asset's Asset.metadata(), to be saved too.
     """
-    from . import models
+    models = _models()
     query_vals = {
         'driver': driver,
         'asset':  asset,
@@ -231,7 +483,10 @@ def update_or_add_asset(driver, asset, tile, date, sensor, name):
         'date':   date,
     }
     update_vals = {'sensor': sensor, 'name': name}
+    if metadata is not None:
+        update_vals.update(metadata_fields(metadata))
     (asset, created) = models.Asset.objects.update_or_create(defaults=update_vals, **query_vals)
+    _prefetch_asset(asset)
     return asset # in case the user needs it
 
 
@@ -241,7 +496,7 @@ def update_or_add_product(driver, product, tile, date, sensor, name):
     Convenience method that wraps update_or_create.  The first four
     arguments are used to make a unique key to search for a matching model.
     """
-    from . import models
+    models = _models()
     query_vals = {
         'driver':   driver,
         'product':  product,
@@ -251,6 +506,7 @@ def update_or_add_product(driver, product, tile, date, sensor, name):
     }
     update_vals = {'name': name}
     (asset, created) = models.Product.objects.update_or_create(defaults=update_vals, **query_vals)
+    _prefetch_product(asset)
     return asset # in case the user needs it
 
 
@@ -260,8 +516,7 @@ def product_search(**criteria):
     Under the hood just calls models.Asset.objects.filter(**criteria);
     see Django ORM docs for more details.
     """
-    from gips.inventory.dbinv import models
-    return models.Product.objects.filter(**criteria)
+    return _models().Product.objects.filter(**criteria)
 
 
 def asset_search(**criteria):
@@ -270,5 +525,20 @@ def asset_search(**criteria):
     Under the hood just calls models.Asset.objects.filter(**criteria);
     see Django ORM docs for more details.
     """
-    from gips.inventory.dbinv import models
-    return models.Asset.objects.filter(**criteria)
+    return _models().Asset.objects.filter(**criteria)
+
+
+def in_date_ranges(ranges):
+    """Return a Q object for filtering searches to dates in any of the given ranges.
+
+    `ranges` are inclusive (first, last) date pairs, eg from
+    TemporalExtent.date_ranges(); an empty list matches nothing.
+    """
+    if orm.backend() == 'sqlite3':
+        from .lite import Q
+    else:
+        from django.db.models import Q
+    q = Q(pk__in=[])
+    for r in ranges:
+        q |= Q(date__range=r)
+    return q
@@ -0,0 +1,456 @@
+"""Django-free sqlite3 backend for the inventory database.
+
+Selected with INVENTORY_BACKEND = 'sqlite3' in GIPS settings.  Implements
+just the parts of Django's model & queryset interface that dbinv.api uses,
+directly on the tables Django's migrations create, so the same database
+works with either backend and dbinv.api runs unchanged on both.  Importing
+this module and opening a connection costs far less than django.setup(),
+which matters for short CLI calls and large numbers of batch jobs.
+
+Connections are per thread and per process, in WAL mode so readers don't
+block the writer.  Queries are parameterized and built the same way each
+time for the same lookups, so sqlite3's statement cache prepares each one
+once per connection.
+"""
+
+import os
+import datetime
+import itertools
+import threading
+import contextlib
+import sqlite3
+
+from gips import utils
+
+
+# dbinv migrations that the tables made by create_tables correspond to; when adding a migration,
+# update both this and create_tables
+migrations = ('0001_initial', '0002_auto_20181217_1743', '0003_composite_indexes',
+              '0004_asset_metadata')
+
+_local = threading.local() # conn, pid, and transaction depth for this thread
+
+
+class DoesNotExist(Exception):
+    """Raised by get() when no row matches; models' DoesNotExist is this class."""
+
+
+class MultipleObjectsReturned(Exception):
+    """Raised by get() when more than one row matches."""
+
+
+def db_path():
+    """Return the path to the inventory database, which has to be a sqlite file."""
+    db = getattr(utils.settings(), 'DATABASES', {}).get('inventory', {})
+    engine = db.get('ENGINE', 'django.db.backends.sqlite3')
+    if not engine.endswith(('sqlite3', 'spatialite')):
+        raise Exception("INVENTORY_BACKEND = 'sqlite3' needs a sqlite inventory"
+                        " database, but its ENGINE is '{}'".format(engine))
+    return db.get('NAME', '/tmp/gips-inv-db.sqlite3') # same default as orm.settings
+
+
+def connection():
+    """Return this thread's connection to the inventory database, opening it if needed."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == os.getpid():
+        return conn
+    # autocommit unless in atomic(); see there
+    conn = sqlite3.connect(db_path(), timeout=30, isolation_level=None,
+                           cached_statements=256)
+    (_local.conn, _local.pid, _local.depth) = (conn, os.getpid(), 0)
+    try:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL') # safe in WAL mode and much faster
+        create_tables(conn)
+    except BaseException:
+        close()
+        raise
+    return conn
+
+
+def close():
+    """Close this thread's connection, if any; the next query opens a new one."""
+    conn = getattr(_local, 'conn', None)
+    _local.conn = None
+    # sqlite connections mustn't be used across fork, not even to close them
+    if conn is not None and _local.pid == os.getpid():
+        conn.close()
+
+
+def create_tables(conn):
+    """Create the inventory tables if they don't exist yet.
+
+    Matches what Django's migrations make, and records the migrations as
+    applied, so Django can use the database later.  Raises if the tables
+    exist but are missing migrations, which only Django can apply.
+    """
+    if conn.execute("SELECT 1 FROM sqlite_master"
+                    " WHERE type = 'table' AND name = 'dbinv_asset'").fetchone():
+        try:
+            applied = {name for (name,) in conn.execute(
+                'SELECT "name" FROM "django_migrations" WHERE "app" = ?', ('dbinv',))}
+        except sqlite3.OperationalError: # no django_migrations table
+            applied = set()
+        missing = [m for m in migrations if m not in applied]
+        if missing:
+            raise Exception("The inventory database is missing migrations {};"
+                            " run `gips_config migrate`".format(', '.join(missing)))
+        return
+    asset_metadata = ' "acquired" datetime NULL, "cloud_cover" real NULL, "size" bigint NULL,'
+    with atomic(conn):
+        for (table, kind, unique, extra) in (
+                ('dbinv_asset', 'asset', ('asset', 'tile', 'date'), asset_metadata),
+                ('dbinv_product', 'product', ('product', 'sensor', 'tile', 'date'), '')):
+            conn.execute(
+                'CREATE TABLE "{}" ("id" integer NOT NULL PRIMARY KEY AUTOINCREMENT,'
+                ' "driver" text NOT NULL, "{}" text NOT NULL, "sensor" text NOT NULL,'
+                ' "tile" text NOT NULL, "date" date NOT NULL, "name" text NOT NULL,{}'
+                ' UNIQUE ("driver", {}))'.format(
+                    table, kind, extra, ', '.join('"{}"'.format(c) for c in unique)))
+            for c in ('driver', kind, 'sensor', 'tile', 'date'):
+                conn.execute('CREATE INDEX "{0}_{1}_idx" ON "{0}" ("{1}")'.format(table, c))
+        conn.execute('CREATE INDEX "dbinv_asset_dtd_idx"'
+                     ' ON "dbinv_asset" ("driver", "tile", "date")')
+        conn.execute('CREATE INDEX "dbinv_product_dtd_idx"'
+                     ' ON "dbinv_product" ("driver", "tile", "date")')
+        conn.execute('CREATE INDEX "dbinv_product_dptd_idx"'
+                     ' ON "dbinv_product" ("driver", "product", "tile", "date")')
+        conn.execute('CREATE TABLE IF NOT EXISTS "django_migrations" ('
+                     '"id" integer NOT NULL PRIMARY KEY AUTOINCREMENT,'
+                     ' "app" varchar(255) NOT NULL, "name" varchar(255) NOT NULL,'
+                     ' "applied" datetime NOT NULL)')
+        applied = str(datetime.datetime.utcnow())
+        conn.executemany('INSERT INTO "django_migrations" ("app", "name", "applied")'
+                         ' VALUES (?, ?, ?)', [('dbinv', m, applied) for m in migrations])
+
+
+@contextlib.contextmanager
+def atomic(conn=None):
+    """Run the block in a transaction, like django.db.transaction.atomic.
+
+    Nested blocks use savepoints, so an exception caught within the
+    outer block only rolls back the inner one.
+    """
+    conn = conn or connection()
+    depth = _local.depth
+    conn.execute('BEGIN' if depth == 0 else 'SAVEPOINT lite_{}'.format(depth))
+    _local.depth += 1
+    try:
+        yield
+    except BaseException:
+        _local.depth -= 1
+        if depth == 0:
+            conn.execute('ROLLBACK')
+        else:
+            conn.execute('ROLLBACK TO lite_{0}'.format(depth))
+            conn.execute('RELEASE lite_{0}'.format(depth))
+        raise
+    _local.depth -= 1
+    conn.execute('COMMIT' if depth == 0 else 'RELEASE lite_{}'.format(depth))
+
+
+def _adapt(field, value):
+    """Convert dates & datetimes for the field to the strings Django stores."""
+    if field == 'date' and isinstance(value, datetime.date):
+        # datetimes too, whose time is dropped as DateFields do
+        return datetime.date(value.year, value.month, value.day).isoformat()
+    if isinstance(value, datetime.datetime):
+        # naive UTC, as Django does with USE_TZ
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return str(value)
+    return value
+
+
+def _to_date(value):
+    return datetime.date(int(value[0:4]), int(value[5:7]), int(value[8:10]))
+
+
+def _to_datetime(value):
+    """Convert a stored datetime to an aware one in UTC, as Django does with USE_TZ."""
+    if value is None:
+        return None
+    fmt = '%Y-%m-%d %H:%M:%S.%f' if '.' in value else '%Y-%m-%d %H:%M:%S'
+    return datetime.datetime.strptime(value, fmt).replace(tzinfo=datetime.timezone.utc)
+
+
+_converters = {'date': _to_date, 'acquired': _to_datetime} # for column values
+
+class Q(object):
+    """Lookups combined with AND, which can in turn be combined with | and &."""
+
+    def __init__(self, *children, **lookups):
+        self.connector = 'AND'
+        self.children = list(children) + sorted(lookups.items())
+
+    def _combine(self, other, connector):
+        q = Q(self, other)
+        q.connector = connector
+        return q
+
+    def __or__(self, other):
+        return self._combine(other, 'OR')
+
+    def __and__(self, other):
+        return self._combine(other, 'AND')
+
+    def sql(self, model):
+        """Return a WHERE clause for the model's table and its parameters."""
+        clauses, params = [], []
+        for child in self.children:
+            (clause, p) = child.sql(model) if isinstance(child, Q) else _lookup(model, *child)
+            if clause == '1': # an empty Q, which matches everything
+                if self.connector == 'OR':
+                    return ('1', [])
+                continue
+            clauses.append(clause)
+            params += p
+        if not clauses:
+            return ('1', [])
+        return ('(' + (' ' + self.connector + ' ').join(clauses) + ')', params)
+
+
+def _lookup(model, key, value):
+    """Return SQL & parameters for a Django-style lookup:  field, field__in, or field__range."""
+    (field, _, op) = key.partition('__')
+    field = 'id' if field == 'pk' else field
+    if field not in model.columns:
+        raise ValueError("Unknown field '{}' for {}".format(field, model.__name__))
+    if op in ('', 'exact'):
+        return ('"{}" = ?'.format(field), [_adapt(field, value)])
+    if op == 'in':
+        value = [_adapt(field, v) for v in value]
+        if not value:
+            return ('0', [])
+        return ('"{}" IN ({})'.format(field, ', '.join('?' * len(value))), value)
+    if op == 'range':
+        return ('"{}" BETWEEN ? AND ?'.format(field), [_adapt(field, v) for v in value])
+    raise ValueError("Unsupported lookup '{}'".format(key))
+
+
+class QuerySet(object):
+    """Lazy, chainable query of a model's table, like a Django QuerySet.
+
+    Results are cached on first evaluation, as Django does, except
+    when consumed with iterator().
+    """
+
+    def __init__(self, model, where=(), order=(), distinct=False, fields=None, flat=False):
+        self.model = model
+        self._where = tuple(where)  # Q objects, ANDed together
+        self._order = tuple(order)
+        self._distinct = distinct
+        self._fields = fields       # for values_list; None for model instances
+        self._flat = flat
+        self._result_cache = None
+
+    def _clone(self, **changes):
+        kwargs = dict(where=self._where, order=self._order, distinct=self._distinct,
+                      fields=self._fields, flat=self._flat)
+        kwargs.update(changes)
+        return QuerySet(self.model, **kwargs)
+
+    def filter(self, *args, **lookups):
+        return self._clone(where=self._where + args + (Q(**lookups),))
+
+    def all(self):
+        return self._clone()
+
+    def order_by(self, *fields):
+        return self._clone(order=fields)
+
+    def distinct(self):
+        return self._clone(distinct=True)
+
+    def values_list(self, *fields, **kwargs):
+        flat = kwargs.get('flat', False)
+        if flat and len(fields) != 1:
+            raise TypeError("'flat' is only valid with a single field")
+        return self._clone(fields=fields or self.model.columns, flat=flat)
+
+    def _where_sql(self):
+        (clause, params) = Q(*self._where).sql(self.model)
+        return (' WHERE ' + clause if clause != '1' else '', params)
+
+    def _select(self, columns):
+        (where, params) = self._where_sql()
+        order = ', '.join('"{}" DESC'.format(f[1:]) if f.startswith('-') else '"{}"'.format(f)
+                          for f in self._order)
+        sql = 'SELECT {}{} FROM "{}"{}{}'.format(
+            'DISTINCT ' if self._distinct else '',
+            ', '.join('"{}"'.format('id' if c == 'pk' else c) for c in columns),
+            self.model.table, where, ' ORDER BY ' + order if order else '')
+        return connection().execute(sql, params)
+
+    def iterator(self):
+        """Return the results without caching them."""
+        columns = self._fields or self.model.columns
+        converters = [(i, _converters[c]) for (i, c) in enumerate(columns) if c in _converters]
+        for row in self._select(columns):
+            if converters:
+                row = list(row)
+                for (i, convert) in converters:
+                    row[i] = convert(row[i])
+            if self._fields is None:
+                yield self.model._from_row(row)
+            elif self._flat:
+                yield row[0]
+            else:
+                yield tuple(row)
+
+    def _results(self):
+        if self._result_cache is None:
+            self._result_cache = list(self.iterator())
+        return self._result_cache
+
+    def __iter__(self):
+        return iter(self._results())
+
+    def __len__(self):
+        return len(self._results())
+
+    def __getitem__(self, index):
+        return self._results()[index]
+
+    def count(self):
+        if self._result_cache is not None:
+            return len(self._result_cache)
+        (where, params) = self._where_sql()
+        sql = 'SELECT COUNT(*) FROM "{}"{}'.format(self.model.table, where)
+        return connection().execute(sql, params).fetchone()[0]
+
+    def exists(self):
+        return self.count() > 0
+
+    def get(self, *args, **lookups):
+        results = list(itertools.islice(self.filter(*args, **lookups).iterator(), 2))
+        if not results:
+            raise self.model.DoesNotExist(
+                "{} matching query does not exist.".format(self.model.__name__))
+        if len(results) > 1:
+            raise self.model.MultipleObjectsReturned(
+                "get() returned more than one {}".format(self.model.__name__))
+        return results[0]
+
+    def update(self, **values):
+        """Update the matching rows with the given values; returns the number updated."""
+        for f in values:
+            if f not in self.model.fields:
+                raise ValueError("Unknown field '{}' for {}".format(f, self.model.__name__))
+        (where, params) = self._where_sql()
+        sql = 'UPDATE "{}" SET {}{}'.format(
+            self.model.table, ', '.join('"{}" = ?'.format(f) for f in sorted(values)), where)
+        return connection().execute(
+            sql, [_adapt(f, values[f]) for f in sorted(values)] + params).rowcount
+
+    def delete(self):
+        """Delete the matching rows; returns the number deleted."""
+        (where, params) = self._where_sql()
+        sql = 'DELETE FROM "{}"{}'.format(self.model.table, where)
+        return connection().execute(sql, params).rowcount
+
+
+class Manager(object):
+    """Model.objects:  table-level operations and a source of QuerySets."""
+
+    def __init__(self, model):
+        self.model = model
+
+    def all(self):
+        return QuerySet(self.model)
+
+    def __getattr__(self, name):
+        """Pass other QuerySet methods, such as filter() & get(), to a query of all rows."""
+        return getattr(self.all(), name)
+
+    def create(self, **values):
+        obj = self.model(**values)
+        obj.save()
+        return obj
+
+    def bulk_create(self, objs):
+        """Insert the objects with one statement; like Django's on sqlite, doesn't set their pks."""
+        fields = self.model.fields
+        sql = 'INSERT INTO "{}" ({}) VALUES ({})'.format(
+            self.model.table, ', '.join('"{}"'.format(f) for f in fields),
+            ', '.join('?' * len(fields)))
+        connection().executemany(
+            sql, [[_adapt(f, getattr(o, f)) for f in fields] for o in objs])
+        return objs
+
+    def update_or_create(self, defaults=None, **lookups):
+        """Update the row matching lookups with defaults, or create it; returns (obj, created)."""
+        defaults = defaults or {}
+        with atomic():
+            try:
+                obj = self.get(**lookups)
+            except self.model.DoesNotExist:
+                return (self.create(**dict(lookups, **defaults)), True)
+            for (f, v) in defaults.items():
+                setattr(obj, f, v)
+            obj.save()
+            return (obj, False)
+
+
+class Model(object):
+    """A row of an inventory table; subclasses set table & fields."""
+    table = None
+    fields = ()  # columns other than id
+    DoesNotExist = DoesNotExist
+    MultipleObjectsReturned = MultipleObjectsReturned
+
+    def __init__(self, id=None, **values):
+        self.id = id
+        for f in self.fields:
+            setattr(self, f, values.pop(f, None))
+        if values:
+            raise TypeError("Unknown fields for {}: {}".format(
+                type(self).__name__, ', '.join(sorted(values))))
+
+    @classmethod
+    def _from_row(cls, row):
+        obj = cls.__new__(cls)
+        for (c, v) in zip(cls.columns, row):
+            setattr(obj, c, v)
+        return obj
+
+    @property
+    def pk(self):
+        return self.id
+
+    def save(self):
+        """Update the model's row, or insert it if there isn't one."""
+        conn = connection()
+        values = [_adapt(f, getattr(self, f)) for f in self.fields]
+        if self.id is not None:
+            sql = 'UPDATE "{}" SET {} WHERE "id" = ?'.format(
+                self.table, ', '.join('"{}" = ?'.format(f) for f in self.fields))
+            if conn.execute(sql, values + [self.id]).rowcount:
+                return
+        sql = 'INSERT INTO "{}" ({}) VALUES ({})'.format(
+            self.table, ', '.join('"{}"'.format(c) for c in self.columns),
+            ', '.join('?' * len(self.columns)))
+        self.id = conn.execute(sql, [self.id] + values).lastrowid
+
+    def delete(self):
+        self.objects.filter(pk=self.id).delete()
+        self.id = None
+
+
+class Asset(Model):
+    """Inventory for assets; see models.Asset."""
+    table = 'dbinv_asset'
+    fields = ('driver', 'asset', 'sensor', 'tile', 'date', 'name',
+              'cloud_cover', 'size', 'acquired')
+
+
+class Product(Model):
+    """Inventory for products; see models.Product."""
+    table = 'dbinv_product'
+    fields = ('driver', 'product', 'sensor', 'tile', 'date', 'name')
+
+
+for model in (Asset, Product):
+    model.columns = ('id',) + model.fields
+    model.objects = Manager(model)
+del model
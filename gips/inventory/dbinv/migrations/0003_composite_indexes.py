@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 21:02
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbinv', '0002_auto_20181217_1743'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='asset',
+            index=models.Index(fields=['driver', 'tile', 'date'], name='dbinv_asset_dtd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['driver', 'tile', 'date'], name='dbinv_product_dtd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['driver', 'product', 'tile', 'date'], name='dbinv_product_dptd_idx'),
+        ),
+    ]
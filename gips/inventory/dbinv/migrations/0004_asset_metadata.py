@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 23:40
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbinv', '0003_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='asset',
+            name='acquired',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='asset',
+            name='cloud_cover',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='asset',
+            name='size',
+            field=models.BigIntegerField(null=True),
+        ),
+    ]
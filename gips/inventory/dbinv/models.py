@@ -15,10 +15,16 @@ class Asset(models.Model):
     tile   = models.TextField(db_index=True)   # 'h12v04'
     date   = models.DateField(db_index=True)   # of observation, not production
     name   = models.TextField()                # file name including full path
+    # recorded at archive time so searches needn't extract them; see Asset.metadata()
+    cloud_cover = models.FloatField(null=True)        # percent
+    size        = models.BigIntegerField(null=True)   # bytes
+    acquired    = models.DateTimeField(null=True)     # acquisition time
 
     class Meta:
         # These four columns uniquely identify an asset file
         unique_together = ('driver', 'asset', 'tile', 'date')
+        # for inventory searches; unique_together's index serves searches by asset
+        indexes = [models.Index(fields=['driver', 'tile', 'date'], name='dbinv_asset_dtd_idx')]
 
 
 class Product(models.Model):
@@ -39,3 +45,9 @@ class Product(models.Model):
     class Meta:
         # These four columns uniquely identify an asset file
         unique_together = ('driver', 'product', 'sensor', 'tile', 'date')
+        # for inventory searches, and searches by product regardless of sensor
+        indexes = [
+            models.Index(fields=['driver', 'tile', 'date'], name='dbinv_product_dtd_idx'),
+            models.Index(fields=['driver', 'product', 'tile', 'date'],
+                         name='dbinv_product_dptd_idx'),
+        ]
@@ -14,11 +14,28 @@ def use_orm():
     """
     return getattr(utils.settings(), 'GIPS_ORM', True)
 
+_backend = None
+
+def backend():
+    """Return the inventory DB backend named by the INVENTORY_BACKEND setting.
+
+    Either 'django' (the default), or 'sqlite3' for dbinv.lite, which
+    skips Django's startup cost but only works with sqlite databases.
+    """
+    global _backend
+    if _backend is None:
+        name = getattr(utils.settings(), 'INVENTORY_BACKEND', 'django')
+        if name not in ('django', 'sqlite3'):
+            raise ValueError("INVENTORY_BACKEND must be 'django' or 'sqlite3',"
+                             " not '{}'".format(name))
+        _backend = name
+    return _backend
+
 setup_complete = False
 driver_for_dbinv_feature_toggle = 'unspecified'
 
 def setup():
-    """Set settings module default and run django.setup().
+    """Set settings module default and run django.setup() if the backend needs it.
 
     Prevent this from happening more than once using a global guard."""
     global setup_complete
@@ -31,7 +48,28 @@ def setup():
             raise Exception("Inventory database does not support '{}'.  Set"
                     " GIPS_ORM = False to use the filesystem inventory"
                     " instead.".format(driver_for_dbinv_feature_toggle))
-        with utils.error_handler("Error initializing Django ORM"):
-            os.environ.setdefault("DJANGO_SETTINGS_MODULE", "gips.inventory.orm.settings")
-            django.setup()
+        if backend() == 'django':
+            setup_django()
     setup_complete = True
+
+def setup_django():
+    """Set settings module default and run django.setup(), whatever the backend.
+
+    For things only Django can do, such as migrating the database."""
+    with utils.error_handler("Error initializing Django ORM"):
+        os.environ.setdefault("DJANGO_SETTINGS_MODULE", "gips.inventory.orm.settings")
+        django.setup()
+
+def close_connections():
+    """Close this thread's inventory DB connections; they're reopened when next needed.
+
+    Connections mustn't be shared across fork, and threads should close
+    theirs when finished rather than leak them."""
+    if not use_orm():
+        return
+    if backend() == 'django':
+        from django import db
+        db.connections.close_all()
+    else:
+        from gips.inventory.dbinv import lite
+        lite.close()
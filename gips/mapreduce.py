@@ -21,9 +21,22 @@
 #   along with this program. If not, see <http://www.gnu.org/licenses/>
 ################################################################################
 
-import numpy
+import mmap
 import multiprocessing
 
+import numpy
+
+
+def shared_array(shape, dtype='float64'):
+    """Return an array in anonymous shared memory.
+
+    Processes forked after it's made, such as MapReduce's workers, see
+    the same memory, so what they write to it needn't be sent back.
+    """
+    count = int(numpy.prod(shape))
+    buf = mmap.mmap(-1, max(count * numpy.dtype(dtype).itemsize, 1))
+    return numpy.frombuffer(buf, dtype=dtype, count=count).reshape(shape)
+
 
 def _worker(chunk):
     """ Worker function (has access to global variables set in _mr_init """
@@ -34,8 +47,11 @@ def _worker(chunk):
         data = data.reshape((1, shape[0], shape[1]))
         shape = data.shape
 
-    # make output array for this chunk
-    output = numpy.empty((outshape[0], shape[1], shape[2]))
+    # make output array for this chunk, or write in place to the shared one
+    if sharedout is not None:
+        output = sharedout[:, chunk[1]:chunk[1] + chunk[3], chunk[0]:chunk[0] + chunk[2]]
+    else:
+        output = numpy.empty((outshape[0], shape[1], shape[2]))
     output[:] = numpy.nan
 
     # only run on valid pixel signatures unless keepnodata set
@@ -51,45 +67,99 @@ def _worker(chunk):
     if wfunc is not None:
         wfunc((output, chunk))
         return None
+    elif sharedout is not None:
+        return None
     else:
         return output
 
 
-class MapReduce(object):
-    """ General purpose class for performing map reduction functions """
+def _stream_worker(chunk):
+    """ Worker function for streaming mode; returns the chunk with its output """
+    return (_worker(chunk), chunk)
+
 
-    def __init__(self, inshape, outshape, rfunc, pfunc, wfunc=None, nproc=2, keepnodata=False):
+class MapReduce(object):
+    """ General purpose class for performing map reduction functions
+
+    If shared is True, workers write their chunks in place to one output
+    array in shared memory, self.output, instead of returning them to be
+    pickled, sent back, and copied again by assemble().  Workers are
+    forked, so they also read input arrays in the parent's memory
+    without copying them.
+
+    If stream is True, wfunc is called in this process rather than in the
+    workers, on each chunk's output as soon as it's finished, so writing
+    overlaps processing and only one process writes.  Unless shared, the
+    outputs aren't kept, so there's nothing to assemble().
+    """
+
+    def __init__(self, inshape, outshape, rfunc, pfunc, wfunc=None, nproc=2, keepnodata=False,
+                 shared=False, stream=False):
         """ Create multiprocessing pool """
+        if stream and wfunc is None:
+            raise ValueError('Streaming MapReduce needs a wfunc to write its output')
         self.inshape = inshape
         self.outshape = outshape
-        self.pool = multiprocessing.Pool(nproc, initializer=self._mr_init,
-                                         initargs=(inshape, outshape, rfunc, pfunc, wfunc, keepnodata))
-
-    def run(self, nchunks=100, chunks=None):
-        """ Run the multiprocessing pool """
-        if chunks is None:
+        self.nproc = nproc
+        self.wfunc = wfunc if stream else None
+        # made before forking so the workers share it
+        self.output = shared_array(outshape) if shared else None
+        # fork so workers inherit rfunc, pfunc, and the arrays they use
+        self.pool = multiprocessing.get_context('fork').Pool(
+            nproc, initializer=self._mr_init,
+            initargs=(inshape, outshape, rfunc, pfunc, None if stream else wfunc, keepnodata,
+                      self.output))
+
+    def run(self, nchunks=None, chunks=None, blocksize=None, chunksize=128.0):
+        """ Run the multiprocessing pool
+
+        Processes the given chunks, else nchunks full-width strips, else
+        chunks planned by plan_chunks from blocksize & chunksize.
+        """
+        if chunks is not None:
+            self.chunks = chunks
+        elif nchunks is not None:
             self.chunks = self.chunk(self.inshape, nchunks=nchunks)
         else:
-            self.chunks = chunks
-        self.dataparts = self.pool.map(_worker, self.chunks)
+            self.chunks = self.plan_chunks(self.inshape, self.outshape[0], blocksize=blocksize,
+                                           chunksize=chunksize, minchunks=4 * self.nproc)
+        if self.wfunc is None:
+            self.dataparts = self.pool.map(_worker, self.chunks)
+            return
+        # stream finished chunks to the writer in whatever order they finish
+        self.dataparts = None
+        for output, ch in self.pool.imap_unordered(_stream_worker, self.chunks):
+            if output is None:
+                output = self.output[:, ch[1]:ch[1] + ch[3], ch[0]:ch[0] + ch[2]]
+            self.wfunc((output, ch))
 
     def assemble(self):
         """ Reassemble output parts into single array """
+        if self.output is not None:
+            return self.output.squeeze() # already in place
+        if self.dataparts is None:
+            raise ValueError('Streamed output was passed to wfunc, not kept to be assembled')
         dataout = numpy.empty(self.outshape)
         for i, ch in enumerate(self.chunks):
             dataout[:, ch[1]:ch[1] + ch[3], ch[0]:ch[0] + ch[2]] = self.dataparts[i]
         return dataout.squeeze()
 
+    def close(self):
+        """ Shut down the multiprocessing pool """
+        self.pool.close()
+        self.pool.join()
+
     @staticmethod
-    def _mr_init(_inshape, _outshape, _rfunc, _pfunc, _wfunc, _keepnodata):
+    def _mr_init(_inshape, _outshape, _rfunc, _pfunc, _wfunc, _keepnodata, _sharedout=None):
         """ Initializer sets globals for processes """
-        global inshape, outshape, rfunc, pfunc, wfunc, keepnodata
+        global inshape, outshape, rfunc, pfunc, wfunc, keepnodata, sharedout
         inshape = _inshape
         outshape = _outshape
         rfunc = _rfunc
         pfunc = _pfunc
         wfunc = _wfunc
         keepnodata = _keepnodata
+        sharedout = _sharedout
 
     @staticmethod
     def chunk(shape, nchunks=100):
@@ -103,26 +173,65 @@ class MapReduce(object):
             chunks.append([0, sum(chszs[:ichunk]), shape[2], chszs[ichunk]])
         return chunks
 
+    @staticmethod
+    def plan_chunks(shape, outbands=1, blocksize=None, chunksize=128.0, minchunks=1, itemsize=8):
+        """ Create chunks of input data size (B x Y x X) that fit a memory budget
+
+        Each chunk's input & output (float64 unless itemsize says
+        otherwise) take at most about chunksize MB.  Chunks are whole
+        rows of blocks, given blocksize as (xsize, ysize) like GDAL's
+        Band.GetBlockSize(), so each block is read once; a row of blocks
+        too big for the budget is split into whole blocks.  Strips are
+        narrowed, down to one row of blocks, to make at least minchunks
+        chunks, so every process gets some.
+        """
+        (bands, ysize, xsize) = shape
+        (bxsize, bysize) = blocksize or (xsize, 1)
+        budget = chunksize * 2**20 / ((bands + outbands) * itemsize)  # in pixels
+
+        rows = int(budget // xsize) // bysize * bysize
+        if rows > 0:
+            cols = xsize
+            wanted = -(-ysize // minchunks)
+            rows = min(rows, max(-(-wanted // bysize) * bysize, bysize))
+        else:
+            rows = min(bysize, ysize)
+            cols = max(int(budget // rows) // bxsize, 1) * bxsize
+
+        # This is being inverted because gippy is X x Y, whereas numpy is Y x X
+        return [[x, y, min(cols, xsize - x), min(rows, ysize - y)]
+                for y in range(0, ysize, rows) for x in range(0, xsize, cols)]
+
     @staticmethod
     def get_shapes(arrin, numbands):
         """ Create in and out shapes based on input array and output numbands) """
         inshape = arrin.shape
         if len(inshape) == 2:
-            arrin = arrin.reshape((1, inshape))
-            inshape = arrin.shape
+            inshape = (1,) + inshape
         outshape = (numbands, inshape[1], inshape[2])
         return (inshape, outshape)
 
 
-def map_reduce_array(arrin, pfunc, numbands=1, nchunks=100, nproc=2, keepnodata=False):
-    """ Apply user defined pfunc to a numpy array using multiple processors """
+def map_reduce_array(arrin, pfunc, numbands=1, nchunks=None, nproc=2, keepnodata=False,
+                     shared=False, chunksize=128.0):
+    """ Apply user defined pfunc to a numpy array using multiple processors
+
+    If shared, the result is assembled in place in shared memory; see
+    MapReduce.  Unless nchunks is given, chunks are sized to chunksize
+    MB; see MapReduce.plan_chunks.
+    """
     (inshape, outshape) = MapReduce.get_shapes(arrin, numbands)
+    arrin = arrin.reshape(inshape)
 
     # read data from global input array
     rfunc = lambda chunk: arrin[:, chunk[1]:chunk[1] + chunk[3], chunk[0]:chunk[0] + chunk[2]]
 
-    mr = MapReduce(inshape, outshape, rfunc=rfunc, pfunc=pfunc, nproc=nproc, keepnodata=keepnodata)
-    mr.run(nchunks=nchunks)
+    mr = MapReduce(inshape, outshape, rfunc=rfunc, pfunc=pfunc, nproc=nproc, keepnodata=keepnodata,
+                   shared=shared)
+    try:
+        mr.run(nchunks=nchunks, chunksize=chunksize)
+    finally:
+        mr.close()
     return mr.assemble()
 
 
@@ -130,6 +239,7 @@ def _test_map_reduce_array(arrin, pfunc, numbands=1, nchunks=100, nproc=2, keepn
     """ Test map_reduce_array functions without using multiprocessing """
 
     (inshape, outshape) = MapReduce.get_shapes(arrin, numbands)
+    arrin = arrin.reshape(inshape)
 
     # read data from global input array
     rfunc = lambda chunk: arrin[:, chunk[1]:chunk[1] + chunk[3], chunk[0]:chunk[0] + chunk[2]]
@@ -98,6 +98,10 @@ class GIPSParser(argparse.ArgumentParser):
         group.add_argument('--size', help='Compute size of data specified (MiB)',
                            default=False, action='store_true')
         group.add_argument('--update', help='Force fetch and/ or update data (if supported)', default=False, action='store_true')
+        group.add_argument('--no-query-cache', default=False, action='store_true',
+                           help="Don't use or save cached results of queries for remote data")
+        group.add_argument('--purge-query-cache', default=False, action='store_true',
+                           help='Empty the cache of queries for remote data first')
         parser.add_argument(
             '--chunksize', help='Chunk size in MB', default=128.0, type=float
         )
@@ -147,6 +151,12 @@ class GIPSParser(argparse.ArgumentParser):
         group.add_argument('--dont-process', help=h, default=False, action='store_true')
         h = "Export as a vrt image"
         group.add_argument('--vrt', help=h, default=False, action='store_true')
+        h = ("How to upload to an s3:// --outdir: 'zip' the finished export, then upload it; "
+             "upload 'each' file as it's made; or 'stream-zip' files into an uploading zip "
+             "as they're made, without writing the zip to disk (default zip)")
+        group.add_argument('--upload', help=h, default='zip', choices=('zip', 'each', 'stream-zip'))
+        h = 'Number of concurrent uploads for --upload each, and threads per multipart upload'
+        group.add_argument('--upload-workers', help=h, default=4, type=int)
         self.parent_parsers.append(parser)
         return parser
 
@@ -41,7 +41,7 @@ def migrate_database():
     if not orm.use_orm():
         return
     print('Migrating database')
-    orm.setup()
+    orm.setup_django()
     call_command('migrate', interactive=False)
 
 
@@ -56,6 +56,7 @@ def main():
     p.add_argument('-r', '--repos', help='Top level directory for repositories', default='/data/repos')
     p.add_argument('-e', '--email', help='Set email address (used for anonymous FTP sources)', default='')
     p = subparser.add_parser('user', help='Configure GIPS repositories for this user (for per user customizations)')
+    subparser.add_parser('migrate', help='Migrate the inventory database to this version of GIPS')
     #p.add_argument('-e', '--email', help='Set email address (used for anonymous FTP sources)')
     #h = 'Install full configuration file without inheriting from environment settings'
     #p.add_argument('-f', '--full', help=h, default=False, action='store_true')
@@ -89,6 +90,9 @@ def main():
             import gips.settings
             created_cf, cfgfile = create_user_settings()
 
+    elif args.command == 'migrate':
+        with utils.error_handler('Could not migrate database'):
+            migrate_database()
 
     if args.command in ('user', 'env'):
         msg = ('Wrote new config file:  {}.' if created_cf else
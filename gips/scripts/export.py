@@ -30,7 +30,9 @@ from gips import utils
 from gips.utils import vprint
 from gips.inventory import DataInventory, ProjectInventory
 from gips.inventory import orm
+from gips import upload
 
+import contextlib
 import tempfile
 import boto3
 import zipfile
@@ -61,6 +63,7 @@ def run_export(args):
     cls = utils.gips_script_setup(args.command, args.stop_on_error)
 
     with utils.error_handler():
+        cls.Asset.setup_query_cache(args.no_query_cache, args.purge_query_cache)
         with tempfile.TemporaryDirectory() as tmpdir:
 
             if args.site is not None and args.site.startswith('s3://'):
@@ -107,23 +110,34 @@ def run_export(args):
                 )
                 tld = os.path.join(args.outdir, bname)
 
-            for extent in extents:
-                t_extent = TemporalExtent(args.dates, args.days)
-                inv = DataInventory(cls, extent, t_extent, **vars(args))
-                datadir = os.path.join(tld, extent.site.value())
-                if inv.numfiles > 0:
-                    inv.mosaic(
-                        datadir=datadir, tree=args.tree, overwrite=args.overwrite,
-                        res=args.res, interpolation=args.interpolation,
-                        crop=args.crop, alltouch=args.alltouch,
-                        process=(not args.dont_process), vrt=args.vrt
-                    )
-                    inv = ProjectInventory(datadir)
-                    inv.pprint()
-                else:
-                    vprint('No data found for', t_extent, level=2)
-
-            if s3outdir is not None and os.path.exists(args.outdir):
+            t_extent = TemporalExtent(args.dates, args.days)
+            inventories = DataInventory.for_extents(cls, extents, t_extent, **vars(args))
+            with contextlib.ExitStack() as uploads:
+                # upload each mosaic, or stream it into a zip upload, as it's finished
+                uploader = None
+                if s3outdir is not None and args.upload == 'each':
+                    uploader = uploads.enter_context(upload.S3Uploader(
+                        s3outdir, args.outdir, workers=args.upload_workers))
+                elif s3outdir is not None and args.upload == 'stream-zip':
+                    uploader = uploads.enter_context(upload.S3ZipStreamer(
+                        s3outdir + '.zip', args.outdir, threads=args.upload_workers))
+                for extent, inv in zip(extents, inventories):
+                    datadir = os.path.join(tld, extent.site.value())
+                    if inv.numfiles > 0:
+                        inv.mosaic(
+                            datadir=datadir, tree=args.tree, overwrite=args.overwrite,
+                            res=args.res, interpolation=args.interpolation,
+                            crop=args.crop, alltouch=args.alltouch,
+                            process=(not args.dont_process), vrt=args.vrt,
+                            numprocs=args.numprocs,
+                            done=None if uploader is None else uploader.add
+                        )
+                        inv = ProjectInventory(datadir)
+                        inv.pprint()
+                    else:
+                        vprint('No data found for', t_extent, level=2)
+
+            if s3outdir is not None and args.upload == 'zip' and os.path.exists(args.outdir):
                 outpath = args.outdir
                 zippath = outpath + ".zip"
                 shutil.make_archive(outpath, 'zip', args.outdir)
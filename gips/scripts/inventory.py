@@ -34,6 +34,18 @@ desired, eg:
 
     gips_inventory modis --rectify
     gips_inventory prism --rectify
+
+For large archives add --bulk, which compares the archive against the
+database in memory and only writes the differences.
+
+Drivers for cloud-hosted data, such as landsat & sentinel2 from google
+storage, can look up scenes in a local catalog instead of searching the
+provider's storage.  Load the provider's bulk scene index into it, or
+refresh it later, with --update-catalog; pass the path of a downloaded
+copy of the index to use that instead:
+
+    gips_inventory landsat --update-catalog
+    gips_inventory sentinel2 --update-catalog ~/index.csv.gz
 """
 
 import json
@@ -60,6 +72,15 @@ def main():
                             'database by comparing it against the present state of the data repos.',
                        action='store_true',
                        default=False)
+    group.add_argument('--bulk',
+                       help='With --rectify, compare the archive against the database in memory '
+                            'and write changes in batches; much faster for large archives.',
+                       action='store_true',
+                       default=False)
+    group.add_argument('--update-catalog', nargs='?', const='', default=None, metavar='INDEX',
+                       help="Instead of displaying or fetching inventory, load new scenes from "
+                            "the data provider's bulk index into the driver's local scene "
+                            "catalog; INDEX is the path or URL of a copy of the index to use.")
     args = parser0.parse_args()
 
     cls = utils.gips_script_setup(args.command, args.stop_on_error)
@@ -74,23 +95,34 @@ def main():
                                  " GIPS_ORM = True.")
             for k, v in vars(args).items():
                 # Let the user know not to expect other options to effect rectify
-                if v and k not in ('rectify', 'verbose', 'command'):
+                if v and k not in ('rectify', 'bulk', 'verbose', 'command'):
                     msg = "INFO: Option '--{}' is has no effect on --rectify."
                     utils.verbose_out(msg.format(k), 1)
             print("Rectifying inventory DB with filesystem archive:")
             print("Rectifying assets:")
-            dbinv.rectify_assets(cls.Asset)
+            dbinv.rectify_assets(cls.Asset, args.bulk)
             print("Rectifying products:")
-            dbinv.rectify_products(cls)
+            dbinv.rectify_products(cls, args.bulk)
+            return
+
+        if args.update_catalog is not None:
+            if cls.Asset.catalog_index_url is None:
+                raise ValueError("{} doesn't support a scene catalog".format(args.command))
+            from gips.data.core import SceneCatalog
+            print("Updating scene catalog:")
+            added = SceneCatalog.get(cls.Asset).update(args.update_catalog)
+            print("{} scenes added".format(added))
             return
 
+        cls.Asset.setup_query_cache(args.no_query_cache, args.purge_query_cache)
         spatial_extents = SpatialExtent.factory(
             cls, site=args.site, rastermask=args.rastermask,
             key=args.key, where=args.where, tiles=args.tiles,
             pcov=args.pcov, ptile=args.ptile
         )
-        for se in spatial_extents:
-            inv = DataInventory(cls, se, TemporalExtent(args.dates, args.days), **vars(args))
+        inventories = DataInventory.for_extents(
+            cls, spatial_extents, TemporalExtent(args.dates, args.days), **vars(args))
+        for inv in inventories:
             inv.pprint(md=args.md, size=args.size)
 
         if args.dump_geojson_extent:
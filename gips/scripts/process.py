@@ -44,6 +44,7 @@ def main():
     print(title)
 
     with utils.error_handler():
+        cls.Asset.setup_query_cache(args.no_query_cache, args.purge_query_cache)
         extents = SpatialExtent.factory(
             cls, site=args.site, rastermask=args.rastermask,
             key=args.key, where=args.where, tiles=args.tiles,
@@ -61,11 +62,9 @@ def main():
             if args.products:
                 batchargs += ' -p ' + ' '.join(args.products)
 
-        for extent in extents:
-            inv = DataInventory(
-                cls, extent,
-                TemporalExtent(args.dates, args.days), **vars(args)
-            )
+        inventories = DataInventory.for_extents(
+            cls, extents, TemporalExtent(args.dates, args.days), **vars(args))
+        for inv in inventories:
             if args.batchout:
                 def get_commands(tiles_obj):
                     commands = []
@@ -90,7 +89,7 @@ def main():
                 )
 
             else:
-                inv.process(overwrite=args.overwrite)
+                inv.process(overwrite=args.overwrite, numprocs=args.numprocs)
         if args.batchout:
             with open(args.batchout, 'w') as ofile:
                 ofile.writelines(tdl)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+################################################################################
+#    GIPS: Geospatial Image Processing System
+#
+#    AUTHOR: Matthew Hanson
+#    EMAIL:  matt.a.hanson@gmail.com
+#
+#    Copyright (C) 2014-2018 Applied Geosolutions
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program. If not, see <http://www.gnu.org/licenses/>
+################################################################################
+
+from gips import __version__ as gipsversion
+from gips.parsers import GIPSParser
+from gips.utils import Colors
+from gips import utils
+
+
+def main():
+    title = Colors.BOLD + 'GIPS 6S Lookup Table Utility (v%s)' % gipsversion + Colors.OFF
+
+    # argument parsing
+    parser0 = GIPSParser(description=title)
+    parser = GIPSParser(add_help=False, with_default=False)
+    group = parser.add_argument_group('lookup table options')
+    group.add_argument('sensor', help='Sensor to compute the table for, eg LC8')
+    group.add_argument('--outfile', default=None,
+                       help="File to write the table to; defaults to the driver's"
+                            " '6S-lut' setting")
+    group.add_argument('--validate', default=0, type=int, metavar='N',
+                       help='Compare N random lookups against running 6S directly')
+    group.add_argument('--tolerance', default=0.02, type=float,
+                       help='Maximum relative error permitted by --validate')
+    group.add_argument('--numprocs', default=1, type=int,
+                       help='Number of 6S processes to run at once')
+    parser0.add_parser(parser)
+    args = parser0.parse_args()
+
+    cls = utils.gips_script_setup(args.command, args.stop_on_error, setup_orm=False)
+
+    with utils.error_handler('Error making 6S lookup table'):
+        print(title)
+        # imported here because it's slow
+        from gips.atmosphere import SixsLut, sensor_wavelengths
+        outfile = args.outfile or cls.Asset.Repository.get_setting('6S-lut')
+        if not outfile:
+            raise ValueError("Specify --outfile or set the driver's '6S-lut' setting")
+        wavelengths = sensor_wavelengths(cls.Asset._sensors[args.sensor])
+        lut = SixsLut.build(wavelengths, nprocs=args.numprocs, sensor=args.sensor)
+        lut.save(outfile)
+        print('Wrote {}-band lookup table to {}'.format(len(wavelengths), outfile))
+
+        if args.validate:
+            errors = lut.validate(args.validate, args.numprocs)
+            print('Maximum relative errors:  T {:.2%}, Lu {:.2%}, Ld {:.2%}'.format(*errors))
+            if max(errors) > args.tolerance:
+                raise RuntimeError('Lookup table exceeds tolerance of {:.2%}'.format(
+                    args.tolerance))
+
+    utils.gips_exit()
+
+
+if __name__ == "__main__":
+    main()
@@ -42,8 +42,33 @@ DATABASES = {
     },
 }
 
+# How to reach the inventory database:  'django' (the default) uses the Django
+# ORM; 'sqlite3' works on a sqlite inventory database directly, skipping
+# Django's startup time.  Both can use the same database.
+# INVENTORY_BACKEND = 'django'
+
 # STATS_FORMAT = {} # defaults to empty dict
 
+# Maximum simultaneous connections to any one host when fetching; applies to
+# downloads from google storage, hls, and earthdata (modis, merra, smap, weld)
+# FETCH_HOST_CONNECTIONS = 4
+
+# Threads and working memory (MB) for the GDAL warps that make mosaics.  With
+# --numprocs N each worker process warps at once, so threads are capped at
+# the CPU count // N per worker, but memory use can reach N x WARP_MEMORY_LIMIT.
+# WARP_THREADS = 'ALL_CPUS'
+# WARP_MEMORY_LIMIT = 512
+
+# S3 endpoint for gips_export uploads, eg a local S3 stand-in (default AWS)
+# S3_ENDPOINT_URL = 'http://localhost:9000'
+
+# Cache of 6S atmospheric correction results, shared between scenes; remove to
+# disable.  Optionally give 'steps' to change how near inputs must be to share
+# results; see gips.atmosphere.SixsCache.default_steps.
+SIXS_CACHE = {
+    'path': '$TLD/sixs-cache.sqlite3',
+}
+
 # For NASA EarthData Authentication
 EARTHDATA_USER = ""
 EARTHDATA_PASS = ""
@@ -74,6 +99,7 @@ REPOS = {
         # Landsat specific settings
         '6S': True,            # atm correction for VIS/NIR/SWIR bands
         'MODTRAN': False,       # atm correction for LWIR
+        # '6S-lut': '',         # interpolate 6S results from a LUT made with gips_sixs_lut
         'extract': False,       # extract files from tar.gz before processing instead of direct access
         'username': USGS_USER,
         'password': USGS_PASS,
@@ -90,6 +116,7 @@ REPOS = {
         'username': ESA_USER,
         'password': ESA_PASS,
         'extract': False,  # extract files from tar.gz before processing instead of direct access
+        # '6S-lut': '',    # interpolate 6S results from a LUT made with gips_sixs_lut
     },
     'smap': {
         'repository': '$TLD/smap',
@@ -145,5 +172,24 @@ REPOS = {
        'tiles': '',
         #'tiles': 'mydatabase:mydatatype_tiles',        # database format
         #'tiles': '~/randomdir/dataname_tiles.shp'      # file format
+        # number of assets to query for & download at once (default 1)
+        'fetch-workers': 1,
+        # days to keep cached results of queries for remote data (default 30)
+        'query-cache-ttl': 30,
+        # when not using GIPS_ORM, save directory listings of the archive
+        # between runs (default False)
+        'persist-dir-index': False,
+        # fetch only on dates the driver's acquisition calendar allows, eg a
+        # landsat path's 16-day revisits (default True; False for sentinel2,
+        # whose calendar is learned from the archive)
+        'acquisition-calendar': True,
+        # look up scenes in the local scene catalog, if it's been loaded
+        # with gips_inventory --update-catalog (default True)
+        'catalog': True,
+        # write products & export mosaics tiled & compressed: 'deflate' or
+        # 'zstd' for GeoTIFFs with internal overviews, 'cog' for
+        # cloud-optimized GeoTIFFs, or a dict like those in
+        # gips.utils.output_profiles (default None, untiled & uncompressed)
+        'output-profile': None,
     }
 """
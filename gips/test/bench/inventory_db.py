@@ -0,0 +1,122 @@
+"""Benchmark for DataInventory's inventory database queries.
+
+Fills a throwaway test database with synthetic asset & product rows, then
+compares the old query shape (a list_dates query per tile followed by
+date__in) against the new one (a date__range per year of the day-of-year
+bounds), before and after the composite indexes of migration 0003:
+
+    python -m gips.test.bench.inventory_db [rows [repeats]]
+
+The database backend is whatever DATABASES['inventory'] configures; run it
+once with sqlite and once with PostGIS to compare them.  `rows` is per
+table, default 1,000,000.
+"""
+
+import sys
+import datetime
+import timeit
+
+from django.core.management import call_command
+from django.db import connection
+
+from gips.core import TemporalExtent
+from gips.inventory import orm
+
+driver = 'modis'
+tiles = ['h{:02}v{:02}'.format(h, v) for h in range(8, 14) for v in range(3, 8)]
+assets = ['MOD09GA', 'MOD09GQ', 'MYD09GA', 'MYD09GQ']
+products = ['ndvi', 'quality', 'temp', 'snow', 'clouds']
+start = datetime.date(2000, 1, 1)
+# a few search tiles & a season across several years, like a typical gips_inventory run
+search_tiles = tiles[:4]
+daybounds = (150, 250)
+
+
+def populate(rows, batch_size=10000):
+    """Add `rows` synthetic rows each to the asset & product tables.
+
+    Returns the middle half of the dates populated, for use as search bounds.
+    """
+    from gips.inventory.dbinv.models import Asset, Product
+    for model, kinds, field in ((Asset, assets, 'asset'), (Product, products, 'product')):
+        batch = []
+        for i in range(rows):
+            # every kind for every tile for each day in turn
+            (i, k) = divmod(i, len(kinds))
+            (days, t) = divmod(i, len(tiles))
+            kind, tile, date = kinds[k], tiles[t], start + datetime.timedelta(days=days)
+            batch.append(model(**{field: kind, 'driver': driver, 'sensor': kind[:3], 'tile': tile,
+                                  'date': date, 'name': '/bench/{}/{}/{}'.format(tile, date, kind)}))
+            if len(batch) == batch_size:
+                model.objects.bulk_create(batch)
+                batch = []
+        model.objects.bulk_create(batch)
+    days = rows // max(len(assets), len(products)) // len(tiles)
+    return (start + datetime.timedelta(days=days // 4),
+            start + datetime.timedelta(days=3 * days // 4))
+
+
+def in_days(date):
+    """Whether the date falls within the day-of-year bounds."""
+    return daybounds[0] <= date.timetuple().tm_yday <= daybounds[1]
+
+
+def old_query(datebounds):
+    """The query shape DataInventory used before date__range."""
+    from gips.inventory import dbinv
+    dates = set()
+    for t in search_tiles:
+        dates.update(dbinv.list_dates(driver, t))
+    dates = sorted(d for d in dates if datebounds[0] <= d <= datebounds[1] and in_days(d))
+    criteria = {'driver': driver, 'tile__in': search_tiles, 'date__in': dates}
+    return (len(dbinv.product_search(**criteria).order_by('date', 'tile'))
+            + len(dbinv.asset_search(**criteria).order_by('date', 'tile')))
+
+
+def new_query(datebounds):
+    """The query shape DataInventory uses now."""
+    from gips.inventory import dbinv
+    temporal = TemporalExtent('{},{}'.format(*datebounds), '{},{}'.format(*daybounds))
+    in_ranges = dbinv.in_date_ranges(temporal.date_ranges())
+    criteria = {'driver': driver, 'tile__in': search_tiles}
+    return (len(dbinv.product_search(**criteria).filter(in_ranges).order_by('date', 'tile'))
+            + len(dbinv.asset_search(**criteria).filter(in_ranges).order_by('date', 'tile')))
+
+
+def bench(func, repeats):
+    """Return the best time of `repeats` runs of func."""
+    return min(timeit.repeat(func, number=1, repeat=repeats))
+
+
+def main(argv):
+    rows, repeats = ([int(a) for a in argv] + [1000000, 5][len(argv):])[:2]
+    orm.setup()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        call_command('migrate', 'dbinv', '0002', verbosity=0)
+        t = timeit.default_timer()
+        datebounds = populate(rows)
+        print('{} backend, {:,} rows per table, populated in {:.1f}s'.format(
+            connection.vendor, rows, timeit.default_timer() - t))
+        found = old_query(datebounds)
+        assert found == new_query(datebounds)
+        print('{:,} rows found for {} - {}, best of {}:'.format(found, *datebounds, repeats))
+        print('  old query, single-column indexes: {:8.4f}s'.format(
+            bench(lambda: old_query(datebounds), repeats)))
+        print('  new query, single-column indexes: {:8.4f}s'.format(
+            bench(lambda: new_query(datebounds), repeats)))
+        t = timeit.default_timer()
+        call_command('migrate', 'dbinv', '0003', verbosity=0)
+        print('  composite indexes built in {:.1f}s'.format(timeit.default_timer() - t))
+        assert found == new_query(datebounds)
+        print('  old query, composite indexes:     {:8.4f}s'.format(
+            bench(lambda: old_query(datebounds), repeats)))
+        print('  new query, composite indexes:     {:8.4f}s'.format(
+            bench(lambda: new_query(datebounds), repeats)))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,52 @@
+"""Benchmark for inventory database startup time, by backend.
+
+Runs fresh python processes that each import the inventory, set up its
+backend, and answer one find_asset query, as a short gips_* call would;
+reports the best wall time of several runs for the Django backend and for
+the sqlite3 one (dbinv.lite):
+
+    python -m gips.test.bench.inventory_startup [repeats]
+
+Uses the configured inventory database, which has to be sqlite for the
+sqlite3 backend; the query needn't find anything.
+"""
+
+import sys
+import timeit
+import subprocess
+
+child = '''
+import sys, datetime, timeit
+start = timeit.default_timer()
+from gips.inventory import orm, dbinv
+orm._backend = sys.argv[1]
+orm.setup()
+dbinv.find_asset('modis', 'MOD09GA', 'h12v04', datetime.date(2012, 12, 1))
+print(timeit.default_timer() - start)
+'''
+
+
+def bench(backend, repeats):
+    """Return best process wall time & best in-process time to first query, in seconds."""
+    walls, insides = [], []
+    for _ in range(repeats):
+        start = timeit.default_timer()
+        out = subprocess.check_output([sys.executable, '-c', child, backend])
+        walls.append(timeit.default_timer() - start)
+        insides.append(float(out.split()[-1]))
+    return min(walls), min(insides)
+
+
+def main(argv):
+    repeats = int(argv[0]) if argv else 5
+    print('best of {}:  process wall time, time from import to first query'.format(repeats))
+    results = {}
+    for backend in ('django', 'sqlite3'):
+        results[backend] = bench(backend, repeats)
+        print('  {:8} {:8.3f}s {:8.3f}s'.format(backend, *results[backend]))
+    print('  sqlite3 saves {:.3f}s per call'.format(
+        results['django'][0] - results['sqlite3'][0]))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
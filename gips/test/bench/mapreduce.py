@@ -0,0 +1,51 @@
+"""Benchmark for gips.mapreduce, with & without shared memory.
+
+Runs map_reduce_array over a synthetic multiband float image, once with
+workers returning their chunks to be pickled & assembled, and once with
+them writing in place to shared memory; reports the best wall time of
+several runs and the peak memory of this process:
+
+    python -m gips.test.bench.mapreduce [rows [cols [nproc [repeats]]]]
+"""
+
+import sys
+import timeit
+import resource
+
+import numpy as np
+
+from gips.mapreduce import map_reduce_array
+
+
+def ndvi(data):
+    """A typical per-pixel pfunc; data is bands x pixels."""
+    return (data[1] - data[0]) / (data[1] + data[0])
+
+
+def bench(arrin, nproc, shared, repeats):
+    """Return the best time of `repeats` runs, and the result."""
+    run = lambda: map_reduce_array(arrin, ndvi, nproc=nproc, shared=shared)
+    return min(timeit.repeat(run, number=1, repeat=repeats)), run()
+
+
+def peak_rss():
+    """Peak resident memory of this process, in MB (not counting its children)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def main(argv):
+    rows, cols, nproc, repeats = ([int(a) for a in argv] + [4000, 4000, 4, 3][len(argv):])[:4]
+    arrin = np.random.RandomState(0).uniform(0.01, 1, (2, rows, cols))
+    print('{} x {} x {} input, {} processes, best of {}:'.format(
+        *(arrin.shape + (nproc, repeats))))
+    results = {}
+    # run shared first so pickled results can't have inflated the peak it reports
+    for shared in (True, False):
+        t, results[shared] = bench(arrin, nproc, shared, repeats)
+        print('  shared={!s:5}  {:8.3f}s  {:8.1f} Mpx/s  peak RSS {:8.1f} MB'.format(
+            shared, t, rows * cols / t / 1e6, peak_rss()))
+    assert np.allclose(results[True], results[False], equal_nan=True)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,142 @@
+"""Micro-benchmark for the modis 'indices' product's computation.
+
+Compares modis._indices_chunk against the implementation it replaced,
+reporting throughput in pixels per second:
+
+    python -m gips.test.bench.modis_indices [rows [cols [repeats]]]
+"""
+
+import sys
+import timeit
+
+import numpy as np
+
+from gips.data.modis import modis
+
+
+def indices_chunk_reference(missing, redimg, nirimg, bluimg, grnimg, mirimg, swrimg,
+                             redqcimg, nirqcimg, bluqcimg, grnqcimg, mirqcimg, swrqcimg):
+    """The original, unfused modis 'indices' computation, for comparison.
+
+    Same arguments and return value as modis._indices_chunk.
+    """
+    # wherever the value is too small, set it to a minimum of 0
+    redimg[redimg < 0.0] = 0.0
+    nirimg[nirimg < 0.0] = 0.0
+    bluimg[bluimg < 0.0] = 0.0
+    grnimg[grnimg < 0.0] = 0.0
+    mirimg[mirimg < 0.0] = 0.0
+    swrimg[swrimg < 0.0] = 0.0
+
+    # wherever the value is too saturated, set it to a max of 1.0
+    redimg[(redimg != missing) & (redimg > 1.0)] = 1.0
+    nirimg[(nirimg != missing) & (nirimg > 1.0)] = 1.0
+    bluimg[(bluimg != missing) & (bluimg > 1.0)] = 1.0
+    grnimg[(grnimg != missing) & (grnimg > 1.0)] = 1.0
+    mirimg[(mirimg != missing) & (mirimg > 1.0)] = 1.0
+    swrimg[(swrimg != missing) & (swrimg > 1.0)] = 1.0
+
+    # red, nir
+    # first setup a blank array with everything set to missing
+    ndvi = missing + np.zeros_like(redimg)
+    # compute the ndvi only where neither input is missing, AND
+    # no divide-by-zero error will occur
+    wg = np.where((redimg != missing) & (nirimg != missing) & (redimg + nirimg != 0.0))
+    ndvi[wg] = (nirimg[wg] - redimg[wg]) / (nirimg[wg] + redimg[wg])
+
+    # nir, mir
+    lswi = missing + np.zeros_like(redimg)
+    wg = np.where((nirimg != missing) & (mirimg != missing) & (nirimg + mirimg != 0.0))
+    lswi[wg] = (nirimg[wg] - mirimg[wg]) / (nirimg[wg] + mirimg[wg])
+
+    # blu, grn, red
+    vari = missing + np.zeros_like(redimg)
+    wg = np.where((grnimg != missing) & (redimg != missing) & (bluimg != missing) & (grnimg + redimg - bluimg != 0.0))
+    vari[wg] = (grnimg[wg] - redimg[wg]) / (grnimg[wg] + redimg[wg] - bluimg[wg])
+
+    # blu, grn, red, nir
+    brgt = missing + np.zeros_like(redimg)
+    wg = np.where(
+        (nirimg != missing) & (redimg != missing) &
+        (bluimg != missing) & (grnimg != missing)
+    )
+    brgt[wg] = (
+        0.3 * bluimg[wg] + 0.3 * redimg[wg] + 0.1 * nirimg[wg] +
+        0.3 * grnimg[wg]
+    )
+
+    # red, mir, swr
+    satvi = missing + np.zeros_like(redimg)
+    wg = np.where(
+        (redimg != missing) & (mirimg != missing) &
+        (swrimg != missing) & ((mirimg + redimg + 0.5) != 0.0)
+    )
+    satvi[wg] = (
+        ((mirimg[wg] - redimg[wg]) /
+         (mirimg[wg] + redimg[wg] + 0.5)) * 1.5
+    ) - (swrimg[wg] / 2.0)
+
+    # blu, red, nir
+    evi = missing + np.zeros_like(redimg)
+    wg = np.where(
+        (bluimg != missing) & (redimg != missing) &
+        (nirimg != missing) &
+        (nirimg + 6.0 * redimg - 7.5 * bluimg + 1.0 != 0.0)
+    )
+    evi[wg] = (
+        (2.5 * (nirimg[wg] - redimg[wg])) /
+        (nirimg[wg] + 6.0 * redimg[wg] - 7.5 * bluimg[wg] + 1.0)
+    )
+
+    qc = np.ones_like(redimg)  # mark as poor if all are not missing and not all are good
+    w0 = np.where(
+        (redqcimg == 0) & (nirqcimg == 0) & (bluqcimg == 0) &
+        (grnqcimg == 0) & (mirqcimg == 0) & (swrqcimg == 0)
+    )
+    w255 = np.where(
+        (redqcimg == 255) | (nirqcimg == 255) | (bluqcimg == 255) |
+        (grnqcimg == 255) | (mirqcimg == 255) | (swrqcimg == 255)
+    )
+    qc[w0] = 0  # mark as good if they are all good
+    qc[w255] = missing  # mark as missing if any are missing
+
+    return ndvi, lswi, vari, brgt, satvi, evi, qc
+
+
+def random_chunk(rows, cols, missing=32767, seed=0):
+    """Return args for indices_chunk_reference with plausible values.
+
+    Reflectances run a bit past [0, 1] and are sometimes missing; QC
+    values are mostly good (0) with some poor & missing (255) pixels.
+    """
+    rng = np.random.RandomState(seed)
+    refl = []
+    for _ in range(6):
+        b = rng.uniform(-0.1, 1.1, (rows, cols)).astype('float32')
+        b[rng.uniform(size=b.shape) < 0.05] = missing
+        refl.append(b)
+    qc = [rng.choice(np.array([0, 1, 255], dtype='uint8'), (rows, cols),
+                     p=[0.8, 0.15, 0.05]) for _ in range(6)]
+    return [missing] + refl + qc
+
+
+def bench(func, rows, cols, repeats):
+    """Return pixels per second for func, taking the best of `repeats` runs."""
+    args = random_chunk(rows, cols)
+    # copy because reflectance is clamped in place
+    t = min(timeit.repeat(lambda: func(args[0], *[a.copy() for a in args[1:]]),
+                          number=1, repeat=repeats))
+    return rows * cols / t
+
+
+def main(argv):
+    rows, cols, repeats = ([int(a) for a in argv] + [2400, 2400, 5][len(argv):])[:3]
+    print('{} x {} pixels, best of {}:'.format(rows, cols, repeats))
+    before = bench(indices_chunk_reference, rows, cols, repeats)
+    after = bench(modis._indices_chunk, rows, cols, repeats)
+    print('  reference: {:12,.0f} pixels/s'.format(before))
+    print('  fused:     {:12,.0f} pixels/s ({:.2f}x)'.format(after, after / before))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,71 @@
+"""Benchmark for raster output profiles; see gips.utils.output_profile.
+
+Writes a synthetic product-like image (smooth, noisy reflectance scaled
+to int16, with a nodata border) as a plain GeoTIFF, as gippy does by
+default, then copies it per each output profile; reports the best write
+time, the time to read it all back, and the file size, for each:
+
+    python -m gips.test.bench.output_profile [size [bands [repeats]]]
+"""
+
+import os
+import sys
+import timeit
+
+import numpy as np
+from osgeo import gdal
+
+from gips import utils
+
+
+def make_image(fname, size, bands):
+    """Write a plain size x size int16 GeoTIFF with a nodata border, like a product."""
+    ds = gdal.GetDriverByName('GTiff').Create(fname, size, size, bands, gdal.GDT_Int16)
+    ds.SetGeoTransform((500000.0, 30.0, 0.0, 4500000.0, 0.0, -30.0))
+    y, x = np.mgrid[0:size, 0:size] / float(size)
+    rand = np.random.RandomState(0)
+    for b in range(bands):
+        data = 3000 + 2000 * np.sin(6 * x + b) * np.cos(4 * y) + rand.normal(0, 50, x.shape)
+        data[:size // 10] = -32768
+        band = ds.GetRasterBand(b + 1)
+        band.SetNoDataValue(-32768)
+        band.WriteArray(data.astype('int16'))
+    ds = None
+
+
+def read_all(fname):
+    """Read every band of the file."""
+    ds = gdal.Open(fname)
+    for b in range(ds.RasterCount):
+        ds.GetRasterBand(b + 1).ReadAsArray()
+
+
+def bench(func, repeats):
+    """Return the best time of `repeats` runs of func."""
+    return min(timeit.repeat(func, number=1, repeat=repeats))
+
+
+def main(argv):
+    size, bands, repeats = ([int(a) for a in argv] + [4096, 4, 3][len(argv):])[:3]
+    with utils.make_temp_dir(prefix='bench') as td:
+        plain = os.path.join(td, 'plain.tif')
+        write_time = bench(lambda: make_image(plain, size, bands), repeats)
+        print('{} x {} x {} int16, best of {}:'.format(bands, size, size, repeats))
+        print('  {:8}  write {:7.3f}s  read {:7.3f}s  {:8.1f} MB'.format(
+            'plain', write_time, bench(lambda: read_all(plain), repeats),
+            os.path.getsize(plain) / 2.0**20))
+        for name in sorted(utils.output_profiles):
+            fname = os.path.join(td, name + '.tif')
+            # time includes the plain copy's read, as archive_temp_path's rewrite does
+            try:
+                write_time = bench(lambda: utils.write_profile(plain, fname, name), repeats)
+            except RuntimeError as e: # eg GDAL built without ZSTD
+                print('  {:8}  unsupported: {}'.format(name, e))
+                continue
+            print('  {:8}  write {:7.3f}s  read {:7.3f}s  {:8.1f} MB'.format(
+                name, write_time, bench(lambda: read_all(fname), repeats),
+                os.path.getsize(fname) / 2.0**20))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
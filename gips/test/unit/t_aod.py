@@ -1,5 +1,7 @@
 import datetime
 
+import numpy
+
 from gips.data.aod import aod
 
 # taken from https://ladsweb.modaps.eosdis.nasa.gov/archive/allData/6/MOD08_D3/2017/145.json
@@ -32,3 +34,23 @@ def t_aodAsset_fetch_success_case(mocker, mpo, mock_context_manager):
 
     assert (mocker.call(test_url, stream=True) == m_get.call_args
             and ['fake-stage/stage/' + test_basename] == actual)
+
+def t_aodData_get_aod_caches_arrays(mocker, mpo):
+    """Confirm get_aod reads each date's AOD once & averages around nodata."""
+    aod.aodData.clear_caches()
+    vals = numpy.full((360, 360), 0.2)
+    vals[180, 89] = -9999 # center pixel for lat=0.4, lon=0.6
+    m_inventory = mpo(aod.aodData, 'inventory')
+    m_img = m_inventory.return_value.__getitem__.return_value.tiles.__getitem__(
+        ).open.return_value
+    m_img.__getitem__.return_value.read.return_value = vals
+    m_img.__getitem__.return_value.nodata.return_value = -9999
+    date = datetime.date(2017, 5, 25)
+
+    actual = [aod.aodData.get_aod(0.4, 0.6, date) for _ in range(3)]
+    aod.aodData.clear_caches()
+
+    sources, values = zip(*actual)
+    assert (sources == ('MODIS (MOD08_D3) spatial average',) * 3
+            and numpy.allclose(values, 0.2)
+            and m_inventory.call_count == 1)
@@ -0,0 +1,69 @@
+"""Unit tests for gips.atmosphere."""
+
+import numpy
+
+from gips import atmosphere
+
+
+def t_sixs_cache(tmpdir):
+    """Confirm SixsCache shares results between nearby inputs only."""
+    cache = atmosphere.SixsCache(str(tmpdir.join('sixs.sqlite3')),
+                                 steps={'aod': 0.1})
+    inputs = dict(lat=43.1, lon=-70.9, solar_z=30.2, solar_a=150.0,
+                  view_z=0.0, view_a=0.0, doy=180, aod=0.12)
+    args = ('LC8', [(0.45, 0.51), (0.53, 0.59)], 2)
+    results = [[0.9, 10.0, 100.0], [0.95, 8.0, 110.0]]
+    cache.put(cache.key(*args, **inputs), results)
+
+    near = dict(inputs, lat=43.2, aod=0.14)
+    far = dict(inputs, solar_z=40.0)
+    assert (cache.get(cache.key(*args, **near)) == results
+            and cache.get(cache.key(*args, **far)) is None
+            and cache.get(cache.key('LE7', *args[1:], **inputs)) is None)
+
+
+def t_sixs_lut_lookup(tmpdir):
+    """Confirm SixsLut interpolates, rejects uncovered inputs, and round-trips."""
+    grid = dict(atmosphere.SixsLut.default_grid,
+                solar_z=[0, 80], view_z=[0, 15], raz=[0, 180], aod=[0.0, 0.8],
+                model=[1, 2])
+    wavelengths = [(0.45, 0.51), (0.53, 0.59)]
+    axes = numpy.meshgrid(*[grid[a] for a in atmosphere.SixsLut.axes],
+                          indexing='ij')
+    # T and Ld vary linearly with solar zenith, Lu with aod
+    coefs = numpy.stack([0.9 - axes[0] / 800.0, 10 * axes[3], 100 + axes[0]], -1)
+    coefs = numpy.array([[coefs, coefs * 2]] * 2) # band, model, ...
+    path = str(tmpdir.join('lut.npz'))
+    atmosphere.SixsLut(wavelengths, grid, coefs).save(path)
+    lut = atmosphere.SixsLut.load(path)
+
+    ref = atmosphere.SixsLut.ref_doy
+    (t, Lu, Ld), _ = lut.lookup(wavelengths, 1, 40.0, 5.0, 90.0, 0.4, ref)
+    (_, Lu_later, _), _ = lut.lookup(wavelengths, 1, 40.0, 5.0, 90.0, 0.4, 180)
+    assert (numpy.allclose([t, Lu, Ld], [0.85, 4.0, 140.0])
+            and numpy.isclose(Lu_later, Lu * atmosphere.earth_sun_factor(180)
+                              / atmosphere.earth_sun_factor(ref))
+            and lut.lookup(wavelengths, 3, 40.0, 5.0, 90.0, 0.4, ref) is None
+            and lut.lookup(wavelengths, 1, 40.0, 5.0, 90.0, 1.2, ref) is None
+            and lut.lookup([(0.6, 0.7)], 1, 40.0, 5.0, 90.0, 0.4, ref) is None)
+
+
+def t_sixs_lut_sensor(tmpdir):
+    """Confirm SixsLut lookups only use LUTs run for the sensor, if it has 6S SRFs."""
+    grid = dict(atmosphere.SixsLut.default_grid,
+                solar_z=[0, 80], view_z=[0, 15], raz=[0, 180], aod=[0.0, 0.8], model=[1])
+    wavelengths = [(0.45, 0.52)]
+    coefs = numpy.ones((1, 1, 2, 2, 2, 2, 3))
+    args = (wavelengths, 1, 40.0, 5.0, 90.0, 0.4, atmosphere.SixsLut.ref_doy)
+    for sensor in ('LT5', None):
+        path = str(tmpdir.join('lut-{}.npz'.format(sensor)))
+        atmosphere.SixsLut(wavelengths, grid, coefs, sensor).save(path)
+    srf_lut = atmosphere.SixsLut.load(str(tmpdir.join('lut-LT5.npz')))
+    plain_lut = atmosphere.SixsLut.load(str(tmpdir.join('lut-None.npz')))
+
+    assert (srf_lut.sensor == 'LT5' and plain_lut.sensor is None
+            and srf_lut.lookup(*args, sensor='LT5') is not None
+            and srf_lut.lookup(*args, sensor='LE7') is None
+            and srf_lut.lookup(*args, sensor='LC8') is None
+            and plain_lut.lookup(*args, sensor='LT5') is None
+            and plain_lut.lookup(*args, sensor='LC8') is not None)
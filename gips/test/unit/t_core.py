@@ -6,6 +6,8 @@ import pkgutil
 import imp
 import datetime
 from datetime import datetime as dt
+import gzip
+import calendar
 
 import pytest
 
@@ -105,6 +107,28 @@ def t_data_add_file_repeat(orm, mocker):
             t_new_filename == dbinv.models.Product.objects.get(tile=t_tile, date=t_date).name)
 
 
+
+@pytest.mark.parametrize('profile', (None, 'cog'))
+def t_data_archive_temp_path(mocker, tmpdir, profile):
+    """Confirm archive_temp_path moves products into place, rewritten per the output profile."""
+    def write_profile(src, dst, p):
+        with open(dst, 'w') as f:
+            f.write('profiled')
+    mocker.patch.object(landsatData, 'get_setting', return_value=profile)
+    m_write_profile = mocker.patch.object(data_core.utils, 'write_profile',
+                                          side_effect=write_profile)
+    lsd = landsatData(search=False)
+    lsd.path = str(tmpdir.mkdir('archive'))
+    temp_fp = tmpdir.mkdir('proc').join('012030_2017213_LC8_ndvi-toa.tif')
+    temp_fp.write('original')
+
+    archive_fp = lsd.archive_temp_path(str(temp_fp))
+
+    assert archive_fp == os.path.join(lsd.path, '012030_2017213_LC8_ndvi-toa.tif')
+    assert open(archive_fp).read() == ('original' if profile is None else 'profiled')
+    assert os.listdir(str(tmpdir.join('proc'))) == []
+    assert m_write_profile.call_count == (profile is not None)
+
 @pytest.mark.parametrize('search', (False, True))
 def t_data_init_search(mocker, orm, search):
     """Confirm Data.__init__ searches the FS only when told to.
@@ -151,6 +175,203 @@ def t_data_fetch_error_case(mocker, m_discover_asset, m_query_service, m_fetch):
     assert landsatData.fetch(*df_args) == []
 
 
+def t_data_fetch_concurrently(mocker, m_discover_asset, m_query_service, m_fetch):
+    """Test Data.fetch when the driver's fetch-workers setting is > 1."""
+    real_get_setting = landsatRepository.get_setting
+    mocker.patch.object(landsatRepository, 'get_setting', side_effect=lambda k:
+                        2 if k == 'fetch-workers' else real_get_setting(k))
+    mocker.patch.object(data_core.orm, 'use_orm').return_value = False
+    m_fetch.return_value = ['fake-asset-object']
+
+    actual = landsatData.fetch(*df_args)
+
+    assert (m_fetch.call_count > 0
+            and all(c[1]['archive'] for c in m_fetch.call_args_list)
+            and actual == ['fake-asset-object'] * m_fetch.call_count)
+
+
+def t_Asset_query_preloaded(mocker):
+    """Confirm Asset.query prefers results saved by preload_queries."""
+    LA = landsat.landsatAsset
+    d1, d2, d3 = [dt(2017, 8, d) for d in (1, 2, 3)]
+    m_qsb = mocker.patch.object(LA, 'query_service_batch')
+    m_qsb.return_value = {d1: {'basename': 'found'}, d2: None}
+    m_qs = mocker.patch.object(LA, 'query_service')
+    try:
+        LA.preload_queries('C1GS', '012030', [d1, d2, d3], pclouds=50)
+        actual = [LA.query('C1GS', '012030', d, pclouds=50) for d in (d1, d2, d3)]
+    finally:
+        LA.clear_preloaded_queries()
+    # d3 wasn't in the batch results, so it has to be queried normally
+    m_qs.assert_called_once_with('C1GS', '012030', d3, pclouds=50)
+    assert actual == [{'basename': 'found'}, None, m_qs.return_value]
+
+
+def t_QueryCache(mocker, tmpdir):
+    """Confirm QueryCache saves results, including None, until they expire."""
+    mocker.patch.object(data_core.QueryCache, 'enabled', True)
+    mocker.patch.object(landsatRepository, 'path').return_value = str(tmpdir)
+    mocker.patch.object(data_core.QueryCache, '_caches', {})
+    m_connect = mocker.spy(data_core.sqlite3, 'connect')
+    qc = landsat.landsatAsset.query_cache()
+    old, recent = dt(2017, 8, 1), dt.now()
+    qc.put('C1', '012030', old, {'pclouds': 50, 'verbose': 1}, {'basename': 'a'})
+    qc.put('C1', '012030', recent, {}, None)
+    # 'verbose' isn't a query_service argument so it's not part of the key
+    assert (qc.get('C1', '012030', old, {'pclouds': 50}) == (True, {'basename': 'a'})
+            and qc.get('C1', '012030', old, {'pclouds': 40}) == (False, None)
+            and qc.get('C1', '012030', recent, {}) == (True, None)
+            and qc.ttl('C1', recent) == qc.recent_ttl
+            and qc.ttl('C1', old) == 30 * 86400)
+    # one cache per Asset class, reusing its connection
+    assert landsat.landsatAsset.query_cache() is qc and m_connect.call_count == 1
+
+
+def t_Asset_query_source_setting(mocker, tmpdir):
+    """Confirm cached query results aren't used once the driver's source setting changes."""
+    LA = landsat.landsatAsset
+    mocker.patch.object(data_core.QueryCache, 'enabled', True)
+    mocker.patch.object(data_core.QueryCache, '_caches', {})
+    mocker.patch.object(landsatRepository, 'path').return_value = str(tmpdir)
+    settings = {'source': 'usgs', 'query-cache-ttl': 30}
+    mocker.patch.object(landsatRepository, 'get_setting', side_effect=settings.get)
+    m_qs = mocker.patch.object(LA, 'query_service')
+    m_qs.side_effect = lambda asset, tile, date, **kw: (
+        {'basename': 'found'} if settings['source'] == 'gs' else None)
+    date = dt(2017, 8, 1)
+
+    actual = [LA.query('C1GS', '012030', date, pclouds=50)]
+    settings['source'] = 'gs'
+    actual += [LA.query('C1GS', '012030', date, pclouds=50) for _ in range(2)]
+
+    assert actual == [None, {'basename': 'found'}, {'basename': 'found'}]
+    assert m_qs.call_count == 2 # once per source; the 3rd query is cached
+
+
+@pytest.fixture
+def landsat_index(tmpdir):
+    """Write a gzipped CSV like google's landsat index.csv.gz, and return its path."""
+    columns = ('PRODUCT_ID,DATE_ACQUIRED,COLLECTION_NUMBER,WRS_PATH,WRS_ROW,'
+               'CLOUD_COVER,BASE_URL')
+    rows = [('LC08_L1TP_012030_20170801_20170811_01_T1', '2017-08-01', '01', '12.5'),
+            ('LC08_L1GT_012030_20170801_20170811_01_T2', '2017-08-01', '01', '12.5'),
+            ('LE07_L1TP_012030_20170809_20170904_01_T1', '2017-08-09', '01', '-1'),
+            ('LE07_L1TP_012030_20170724_20170904_01_T1', '2017-07-24', 'PRE', '1')]
+    path = str(tmpdir.join('index.csv.gz'))
+    with gzip.open(path, 'wt') as f:
+        f.write(columns + '\n')
+        for (pid, day, coll, cc) in rows:
+            f.write(','.join([pid, day, coll, '12', '30', cc,
+                              'gs://gcp-public-data-landsat/{}/01/012/030/{}'.format(pid[:4], pid)])
+                    + '\n')
+    os.utime(path, (0, calendar.timegm((2017, 8, 30, 12, 0, 0))))
+    return path
+
+def t_SceneCatalog(mocker, tmpdir, landsat_index):
+    """Confirm SceneCatalog loads a provider's index, once, and looks up scenes in it."""
+    mocker.patch.object(landsatRepository, 'path').return_value = str(tmpdir)
+    catalog = data_core.SceneCatalog(landsat.landsatAsset)
+    dates = [dt(2017, 7, 24), dt(2017, 8, 1), dt(2017, 8, 9), dt(2017, 8, 30)]
+
+    added = catalog.update(landsat_index)
+    again = catalog.update(landsat_index) # unchanged, so it isn't read
+    scenes = catalog.scenes('012030', dates, latency=1)
+
+    assert (added == 3 and again == 0 and catalog.updated() == datetime.date(2017, 8, 30)
+            and scenes == {
+                dt(2017, 7, 24): [],
+                dt(2017, 8, 1): [
+                    ('LC08_L1GT_012030_20170801_20170811_01_T2', 'LC8', 12.5,
+                     'LC08/01/012/030/LC08_L1GT_012030_20170801_20170811_01_T2/'),
+                    ('LC08_L1TP_012030_20170801_20170811_01_T1', 'LC8', 12.5,
+                     'LC08/01/012/030/LC08_L1TP_012030_20170801_20170811_01_T1/')],
+                dt(2017, 8, 9): [
+                    ('LE07_L1TP_012030_20170809_20170904_01_T1', 'LE7', None,
+                     'LE07/01/012/030/LE07_L1TP_012030_20170809_20170904_01_T1/')]})
+
+def t_Repository_vectors2tiles(mocker):
+    """Confirm vectors2tiles finds each vector's tile coverage from a TileIndex."""
+    from osgeo import osr
+    from shapely.geometry import box
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(32618) # UTM, so axis order can't confuse matters
+    index = data_core.TileIndex('fake.shp', None, ['west', 'east'],
+                                [box(0, 0, 10, 10).wkb, box(10, 0, 20, 10).wkb],
+                                srs.ExportToWkt())
+    mocker.patch.object(data_core.TileIndex, 'get').return_value = index
+    vectors = [mocker.Mock(), mocker.Mock()]
+    vectors[0].wkt_geometry.return_value = box(5, 0, 15, 5).wkt
+    vectors[1].wkt_geometry.return_value = box(1, 1, 2, 2).wkt
+    for v in vectors:
+        v.srs.return_value = srs.ExportToWkt()
+
+    actual = landsatRepository.vectors2tiles(vectors)
+    # ptile drops tiles the vectors cover too little of
+    filtered = landsatRepository.vectors2tiles(vectors, ptile=30)
+
+    assert (actual == [{'west': (0.5, 0.25), 'east': (0.5, 0.25)}, {'west': (1.0, 0.01)}]
+            and filtered == [{}, {}])
+
+
+def t_Repository_managed_request(mocker):
+    """Confirm managed_request uses the shared session & only sends credentials to earthdata."""
+    settings = {'username': 'user', 'password': 'pass'}
+    mocker.patch.object(modis.modisRepository, 'get_setting', side_effect=settings.get)
+    m_install_opener = mocker.patch('urllib.request.install_opener')
+    session = mocker.patch.object(data_core.utils, 'http_session').return_value
+    session.max_redirects = 30
+    url = 'https://e4ftl01.cr.usgs.gov/MOTA/MCD43A4.006/2017.08.01/h12v04.hdf'
+    login_url = 'https://urs.earthdata.nasa.gov/oauth/authorize?client_id=x'
+    redirect, content = mocker.Mock(is_redirect=True), mocker.Mock(is_redirect=False)
+    redirect.headers = {'location': login_url}
+    content.content = b'hdf bytes'
+    session.get.return_value.__enter__.side_effect = [redirect, content]
+
+    response = modis.modisRepository.managed_request(url)
+
+    assert response.read() == b'hdf bytes'
+    assert ([(c[0], c[1]['auth']) for c in session.get.call_args_list]
+            == [((url,), None), ((login_url,), ('user', 'pass'))])
+    m_install_opener.assert_not_called()
+
+
+def t_DirectoryIndex(mocker, tmpdir):
+    """Confirm DirectoryIndex lists directories once, noticing changes & persisting."""
+    date_dir = tmpdir.mkdir('tiles').mkdir('012030').mkdir('2017213')
+    for fn in ('LC08_L1TP_012030_20170801_20170811_01_T1.tar.gz',
+               '012030_2017213_LC8_ndvi-toa.tif', '.hidden.tif'):
+        date_dir.join(fn).write('')
+    date_dir.mkdir('subdir.tif')
+    settings = {'persist-dir-index': True}
+    mocker.patch.object(landsatRepository, 'get_setting', side_effect=settings.get)
+    mocker.patch.object(landsatRepository, 'path', side_effect=lambda s: str(tmpdir.join(s)))
+    mocker.patch.object(data_core.DirectoryIndex, '_indexes', {})
+    tmpdir.mkdir('stage')
+    index = data_core.DirectoryIndex.get(landsatRepository)
+    m_scandir = mocker.patch.object(data_core.os, 'scandir', side_effect=os.scandir)
+    path = str(date_dir)
+
+    first = (index.listing(path), index.find_files(r'^LC08.*\.tar\.gz$', path),
+             index.glob(path, '*.tif'))
+    second = index.listing(path)
+    scans = m_scandir.call_count
+    index.save()
+    date_dir.join('012030_2017213_LC8_ndvi-sr.tif').write('')
+    os.utime(path, ns=(0, 0)) # in case the mtime's resolution hides the change
+    mocker.patch.object(data_core.DirectoryIndex, '_indexes', {})
+    third = data_core.DirectoryIndex.get(landsatRepository).glob(path, '*.tif')
+
+    assert (first == (
+        (('.hidden.tif', '012030_2017213_LC8_ndvi-toa.tif',
+          'LC08_L1TP_012030_20170801_20170811_01_T1.tar.gz'), ('subdir.tif',)),
+        [os.path.join(path, 'LC08_L1TP_012030_20170801_20170811_01_T1.tar.gz')],
+        [os.path.join(path, '012030_2017213_LC8_ndvi-toa.tif')])
+            and second == first[0] and scans == 1
+            and tmpdir.join('stage', data_core.DirectoryIndex.filename).check()
+            and third == [os.path.join(path, fn) for fn in
+                          ('012030_2017213_LC8_ndvi-sr.tif', '012030_2017213_LC8_ndvi-toa.tif')])
+
+
 def t_Asset_dates():
     """Test Asset's start and end dates, using SAR."""
     dates_in = datetime.date(2006, 1, 20), datetime.date(2006, 1, 27)
@@ -160,6 +381,64 @@ def t_Asset_dates():
                 ((2006, 1, 24), (2006, 1, 25), (2006, 1, 26), (2006, 1, 27))]
     assert expected == actual
 
+@pytest.mark.parametrize('asset_type, enabled, expected_days', (
+    ('C1',   True,  [8, 16, 24]), # LE7, LC8, LE7
+    ('C1S3', True,  [16]),        # LC8 only
+    ('C1',   False, list(range(1, 32))),
+))
+def t_Asset_dates_acquisition_calendar(mocker, asset_type, enabled, expected_days):
+    """Confirm Asset.dates prunes dates using landsat's WRS-2 acquisition calendar."""
+    real_get_setting = landsatRepository.get_setting
+    mocker.patch.object(landsatRepository, 'get_setting', side_effect=lambda k:
+                        enabled if k == 'acquisition-calendar' else real_get_setting(k))
+    dates_in = datetime.date(2017, 7, 1), datetime.date(2017, 7, 31)
+
+    actual = landsat.landsatAsset.dates(asset_type, '012030', dates_in, (1, 366))
+
+    assert [dt(2017, 7, d) for d in expected_days] == actual
+
+def t_Asset_metadata(mocker, tmpdir):
+    """Confirm Asset metadata is recorded in a sidecar, which is ignored once stale."""
+    fn = tmpdir.join('LC08_L1TP_012030_20170801_20170811_01_T1.tar.gz')
+    fn.write('asset')
+    acquired = dt(2017, 8, 1, 15, 30, 12, 345678, tzinfo=datetime.timezone.utc)
+    def cloud_cover(self):
+        self.meta['acquired'] = acquired
+        return 12.5
+    m_cloud_cover = mocker.patch.object(landsat.landsatAsset, 'cloud_cover',
+                                        autospec=True, side_effect=cloud_cover)
+
+    recorded = landsat.landsatAsset(str(fn)).record_metadata()
+    reloaded = landsat.landsatAsset(str(fn)).metadata()
+    passed = landsat.landsatAsset(str(fn)).filter(pclouds=20)
+    fn.write('replaced asset') # size & mtime no longer match
+    stale = landsat.landsatAsset(str(fn)).metadata()
+
+    assert (recorded == reloaded
+            and {k: recorded[k] for k in ('cloud-cover', 'acquired', 'size')} == {
+                'cloud-cover': 12.5, 'acquired': acquired, 'size': 5}
+            and tmpdir.join('.' + fn.basename + '.json').check()
+            and passed and m_cloud_cover.call_count == 1 and stale == {})
+
+def t_CloudCoverAsset_filter_unrecorded(mocker, tmpdir):
+    """Confirm filter extracts unrecorded cloud cover once, & records it in the sidecar & DB."""
+    fn = tmpdir.join('LC08_L1TP_012030_20170801_20170811_01_T1.tar.gz')
+    fn.write('asset')
+    m_cloud_cover = mocker.patch.object(landsat.landsatAsset, 'cloud_cover', return_value=12.5)
+    mocker.patch.object(data_core.orm, 'use_orm', return_value=True)
+    m_uoaa = mocker.patch.object(data_core.dbinv, 'update_or_add_asset')
+    asset = landsat.landsatAsset(str(fn))
+    asset.set_metadata({'size': 5}) # as from a DB row recorded without cloud cover
+
+    passed = asset.filter(pclouds=20)
+
+    assert passed and m_cloud_cover.call_count == 1
+    assert landsat.landsatAsset(str(fn)).metadata()['cloud-cover'] == 12.5
+    m_uoaa.assert_called_once_with(
+        driver='landsat', asset='C1', sensor='LC8', tile='012030',
+        date=dt(2017, 8, 1), name=str(fn), metadata=asset.metadata())
+    assert asset.metadata()['cloud-cover'] == 12.5
+
 @pytest.fixture
 def asset_and_replacement():
     """For tests of the update=True case of the archive call chain."""
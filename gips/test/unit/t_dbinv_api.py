@@ -12,6 +12,9 @@ from gips.inventory.dbinv import (rectify_assets, rectify_products, list_tiles,
 from gips.inventory import dbinv
 from gips.data.modis import modisAsset, modisData
 
+# Asset model fields holding Asset.metadata(), unset unless it's given
+no_metadata = {'cloud_cover': None, 'size': None, 'acquired': None}
+
 @pytest.mark.skip("needs to be rewritten post issue 297")
 @pytest.mark.django_db
 def t_rectify_assets(mocker):
@@ -60,7 +63,8 @@ def t_rectify_assets(mocker):
 
 
 @pytest.mark.django_db
-def t_rectify_products(mocker):
+@pytest.mark.parametrize('bulk', (False, True))
+def t_rectify_products(mocker, bulk):
     # construct plausible file listing & mock it into glob outcome
     path = modisAsset.Repository.data_path()
     rubbish_filenames = [os.path.join(path, fn) for fn in (
@@ -95,7 +99,7 @@ def t_rectify_products(mocker):
         product.save()
 
     # run the function under test
-    rectify_products(modisData)
+    rectify_products(modisData, bulk)
 
     # load data for inspection
     rows = [model_to_dict(po) for po in models.Product.objects.all()]
@@ -169,7 +173,7 @@ def t_asset_search(basic_asset_db):
     """Confirm that dbinv.asset_search works for querying assets."""
     actual = [model_to_dict(a) for a in asset_search(driver='modis', tile='h12v04')]
     [a.pop('id') for a in actual] # don't care what the keys are
-    expected = [d for d in basic_asset_db if d['tile'] == 'h12v04']
+    expected = [dict(d, **no_metadata) for d in basic_asset_db if d['tile'] == 'h12v04']
     assert expected == actual
 
 
@@ -215,7 +219,7 @@ def t_insert_new_model(mtype, call):
         'name':   u'/some/file/name.xtn',
         'driver': u'some-driver',
     }
-    expected = dict(values)
+    expected = dict(values, **(no_metadata if mtype == 'asset' else {}))
     a = call(**values)
     returned_actual = model_to_dict(a)
     model = {'asset': models.Asset, 'product': models.Product}[mtype]
@@ -249,6 +253,32 @@ def t_update_existing_model(mtype, call):
     queried_actual = model_to_dict(model.objects.get())
 
     # perform assertions
-    expected = dict(values) # now carries replaced filename
+    expected = dict(values, **(no_metadata if mtype == 'asset' else {})) # now carries replaced filename
     expected['id'] = queried_actual['id'] # intentional small deviation from ideal test practice
     assert expected == returned_actual == queried_actual and model.objects.count() == 1
+
+
+@pytest.mark.django_db
+def t_prefetch(basic_asset_db, django_assert_num_queries):
+    """Confirm dbinv.prefetch answers lookups from memory and tracks changes."""
+    d1, d2 = datetime.date(2012, 12, 1), datetime.date(2012, 12, 2)
+    dbinv.add_product(driver='modis', product='ndvi', sensor='MCD', tile='h12v04',
+                      date=d1, name='ndvi.tif')
+    with dbinv.prefetch('modis', ['h12v04'], (d1, d2)):
+        with django_assert_num_queries(2): # one each for assets & products
+            found = dbinv.find_asset('modis', 'MCD43A2', 'h12v04', datetime.datetime(2012, 12, 2))
+            missing = dbinv.find_asset('modis', 'MOD10A1', 'h12v04', d1)
+            products = dbinv.find_products('modis', 'h12v04', d1)
+        dbinv.update_or_add_asset(driver='modis', asset='MOD10A1', tile='h12v04', date=d1,
+                                  sensor='MOD', name='new.hdf')
+        dbinv.delete_product(driver='modis', product='ndvi', tile='h12v04', date=d1)
+        with django_assert_num_queries(0):
+            added = dbinv.find_asset('modis', 'MOD10A1', 'h12v04', d1)
+            deleted = dbinv.find_products('modis', 'h12v04', d1)
+    # outside of the prefetched extent the DB is queried as usual
+    with django_assert_num_queries(1):
+        other_tile = dbinv.find_asset('modis', 'MCD43A2', 'h13v05', d2)
+
+    assert (found == basic_asset_db[1]['name'] and missing is None
+            and products == ['ndvi.tif'] and added == 'new.hdf' and deleted == []
+            and other_tile == basic_asset_db[2]['name'])
@@ -0,0 +1,133 @@
+"""Unit tests for gips.inventory.dbinv.lite, the Django-free inventory backend."""
+
+import os, glob, fnmatch, datetime
+import sqlite3
+
+import pytest
+
+from .data import asset_filenames, product_filenames, expected_products
+
+from gips.inventory import dbinv, orm
+from gips.inventory.dbinv import lite
+from gips.data.modis import modisAsset, modisData
+
+
+@pytest.fixture
+def lite_db(mocker, tmpdir):
+    """Run dbinv on the sqlite3 backend, with a fresh database."""
+    mocker.patch.object(orm, 'backend', return_value='sqlite3')
+    mocker.patch.object(lite, 'db_path', return_value=str(tmpdir.join('inv.sqlite3')))
+    lite.close() # in case an earlier test left one open
+    yield
+    lite.close()
+
+
+def row_dict(model):
+    """Like django's model_to_dict, less the id."""
+    return {f: getattr(model, f) for f in model.fields}
+
+
+def t_migrations():
+    """Confirm lite.create_tables keeps up with Django's migrations."""
+    path = os.path.join(os.path.dirname(lite.__file__), 'migrations', '0*.py')
+    assert lite.migrations == tuple(sorted(
+        os.path.splitext(os.path.basename(fn))[0] for fn in glob.glob(path)))
+
+
+def t_create_tables_unmigrated(lite_db):
+    """Confirm lite refuses a database made before the latest migrations."""
+    conn = sqlite3.connect(lite.db_path())
+    # the dbinv tables as of 0002_auto_20181217_1743
+    conn.executescript("""
+        CREATE TABLE "dbinv_asset" ("id" integer NOT NULL PRIMARY KEY AUTOINCREMENT,
+            "driver" text NOT NULL, "asset" text NOT NULL, "sensor" text NOT NULL,
+            "tile" text NOT NULL, "date" date NOT NULL, "name" text NOT NULL,
+            UNIQUE ("driver", "asset", "tile", "date"));
+        CREATE TABLE "dbinv_product" ("id" integer NOT NULL PRIMARY KEY AUTOINCREMENT,
+            "driver" text NOT NULL, "product" text NOT NULL, "sensor" text NOT NULL,
+            "tile" text NOT NULL, "date" date NOT NULL, "name" text NOT NULL,
+            UNIQUE ("driver", "product", "sensor", "tile", "date"));
+        CREATE TABLE "django_migrations" ("id" integer NOT NULL PRIMARY KEY AUTOINCREMENT,
+            "app" varchar(255) NOT NULL, "name" varchar(255) NOT NULL,
+            "applied" datetime NOT NULL);
+        INSERT INTO "django_migrations" ("app", "name", "applied") VALUES
+            ('contenttypes', '0001_initial', '2018-12-17 17:43:00'),
+            ('dbinv', '0001_initial', '2018-12-17 17:43:00'),
+            ('dbinv', '0002_auto_20181217_1743', '2018-12-17 17:43:00');
+    """)
+    conn.close()
+    with pytest.raises(Exception, match='0003_composite_indexes, 0004_asset_metadata;'
+                                        ' run `gips_config migrate`'):
+        lite.Asset.objects.count()
+
+
+@pytest.mark.parametrize('bulk', (False, True))
+def t_rectify_products(lite_db, mocker, bulk):
+    """Confirm dbinv.rectify_products works the same on the sqlite3 backend."""
+    all_filenames = asset_filenames + product_filenames
+    mock_iglob = mocker.patch('gips.inventory.dbinv.glob.iglob')
+    mock_iglob.side_effect = lambda pat: [fn for fn in all_filenames if fnmatch.fnmatchcase(fn, pat)]
+    # a stale entry, which should be deleted
+    stale_fn = os.path.join(modisAsset.Repository.data_path(),
+                            'h09v09/2012336/h09v09_2012336_MCD_quality.tif')
+    lite.Product(driver='modis', product='quality', sensor='MCD', tile='h09v09',
+                 date=datetime.date(2012, 12, 1), name=stale_fn).save()
+
+    dbinv.rectify_products(modisData, bulk)
+
+    actual = {p.product: row_dict(p) for p in lite.Product.objects.all()}
+    assert expected_products == actual
+
+
+def t_api(lite_db):
+    """Confirm dbinv's add, update, search & lookup functions work on the sqlite3 backend."""
+    values = {'driver': 'modis', 'asset': 'MCD43A2', 'sensor': 'MCD', 'tile': 'h12v04',
+              'date': datetime.date(2012, 12, 1), 'name': '/original.hdf'}
+    dbinv.add_asset(**values)
+    dbinv.add_asset(**dict(values, tile='h13v05', date=datetime.date(2012, 12, 2)))
+    acquired = datetime.datetime(2012, 12, 1, 10, 30, 12, 123456, tzinfo=datetime.timezone.utc)
+    dbinv.update_or_add_asset(**dict(values, name='/new.hdf', metadata={
+        'cloud-cover': 12.5, 'size': 2**40, 'acquired': acquired}))
+    dbinv.update_or_add_product(driver='modis', product='ndvi', sensor='MCD', tile='h12v04',
+                                date=datetime.datetime(2012, 12, 1, 10, 30), name='/ndvi.tif')
+
+    assert list(dbinv.list_tiles('modis')) == ['h12v04', 'h13v05']
+    assert list(dbinv.list_dates('modis', 'h12v04')) == [datetime.date(2012, 12, 1)]
+    assert dbinv.find_asset('modis', 'MCD43A2', 'h12v04', datetime.date(2012, 12, 1)) == '/new.hdf'
+    assert dbinv.asset_metadata(lite.Asset.objects.get(name='/new.hdf')) == {
+        'cloud-cover': 12.5, 'size': 2**40, 'acquired': acquired}
+    assert dbinv.find_products('modis', 'h12v04', datetime.date(2012, 12, 1)) == ['/ndvi.tif']
+    in_ranges = dbinv.in_date_ranges([(datetime.date(2012, 12, 2), datetime.date(2012, 12, 9))])
+    assert [row_dict(a) for a in dbinv.asset_search(driver='modis').filter(in_ranges)] == [
+        dict(values, tile='h13v05', date=datetime.date(2012, 12, 2),
+             cloud_cover=None, size=None, acquired=None)]
+    assert len(dbinv.asset_search(driver='modis').filter(dbinv.in_date_ranges([]))) == 0
+
+    dbinv.delete_product(driver='modis', product='ndvi', sensor='MCD', tile='h12v04',
+                         date=datetime.date(2012, 12, 1))
+    assert lite.Product.objects.count() == 0
+
+
+def t_atomic(lite_db):
+    """Confirm atomic() rolls back, and nested blocks only roll back their own work."""
+    def add(driver):
+        lite.Asset(driver=driver, asset='MCD43A2', sensor='MCD', tile='h12v04',
+                   date=datetime.date(2012, 12, 1), name='/a.hdf').save()
+    drivers = lambda: sorted(lite.Asset.objects.values_list('driver', flat=True))
+
+    with pytest.raises(ZeroDivisionError):
+        with lite.atomic():
+            add('outer')
+            with pytest.raises(KeyError):
+                with lite.atomic():
+                    add('inner')
+                    raise KeyError()
+            assert drivers() == ['outer']
+            1 / 0
+    assert drivers() == []
+
+    with lite.atomic():
+        add('outer')
+        with lite.atomic():
+            add('inner')
+    assert drivers() == ['inner', 'outer']
@@ -8,6 +8,7 @@ from django.forms.models import model_to_dict
 
 from .data import asset_filenames, expected_assets, expected_products
 
+from gips import inventory
 from gips.inventory import DataInventory, dbinv
 from gips.data.modis.modis import modisData, modisAsset
 from gips.core import SpatialExtent, TemporalExtent
@@ -36,8 +37,11 @@ def t_data_inventory_db_save(mpo, orm):
     rows = [model_to_dict(ao) for ao in models.Asset.objects.all()]
     [a.pop('id') for a in rows] # don't care what the keys are
     actual = {r['asset']: r for r in rows} # enforce an order so whims of hashing doesn't ruin test
+    # the asset files don't exist, so there's no metadata to record
+    expected = {k: dict(v, cloud_cover=None, size=None, acquired=None)
+                for (k, v) in expected_assets.items()}
 
-    assert expected_assets == actual
+    assert expected == actual
 
 
 def t_data_inventory_load(orm):
@@ -93,3 +97,151 @@ def t_data_inventory_load(orm):
         assert (ep['sensor'] == sensor and
                 ep['product'] == product and
                 ep['name'] == fname)
+
+
+@pytest.mark.parametrize('dates, days, expected', (
+    ('2012-12-01,2012-12-03', None, [('2012-12-01', '2012-12-03')]),
+    ('2011-03,2013-07', '100,366', [('2011-04-10', '2011-12-31'),
+                                    ('2012-04-09', '2012-12-31'), # leap year
+                                    ('2013-04-10', '2013-07-31')]),
+    ('2012-01-15,2012-02-01', '60,90', []),
+))
+def t_temporal_extent_date_ranges(dates, days, expected):
+    """Confirm TemporalExtent.date_ranges covers exactly the dates it includes."""
+    te = TemporalExtent(dates, days)
+    parse = lambda d: datetime.datetime.strptime(d, '%Y-%m-%d').date()
+    assert te.date_ranges() == [(parse(f), parse(l)) for (f, l) in expected]
+    d, included = te.datebounds[0], []
+    while d <= te.datebounds[1]:
+        if te.includes(d):
+            included.append(d)
+        d += datetime.timedelta(days=1)
+    covered = [r[0] + datetime.timedelta(days=i)
+               for r in te.date_ranges() for i in range((r[1] - r[0]).days + 1)]
+    assert covered == included
+
+
+def t_process_worker(mocker):
+    """Confirm _process_worker relays new product files and errors to the parent."""
+    mocker.patch('gips.inventory.gippy') # don't alter gippy's global options
+    # _process_init sets the error handler & warp threads; these restore them after the test
+    mocker.patch.object(inventory.utils, 'error_handler', inventory.utils.error_handler)
+    mocker.patch.object(inventory.utils, '_warp_threads', None)
+    mocker.patch('gips.data.core.orm.use_orm', return_value=True)
+    m_uoap = mocker.patch('gips.data.core.dbinv.update_or_add_product')
+    date = datetime.date(2012, 12, 1)
+    fn = 'h12v04_2012336_MOD_temp8td.tif'
+    data_obj = modisData('h12v04', date, search=False)
+
+    def m_process(*args, **kwargs):
+        data_obj.AddFile('MOD', 'temp8td', fn)
+        with inventory.utils.error_handler('Bad thing', continuable=True):
+            raise RuntimeError('aaah!')
+
+    m_data_process = mocker.patch.object(data_obj, 'process', side_effect=m_process)
+    tiles_obj = mocker.Mock()
+    tiles_obj.tiles = {'h12v04': data_obj}
+    inv = mocker.Mock()
+    inv.data = {date: tiles_obj}
+
+    inventory._process_init(inv, (), {'overwrite': True})
+    unit, files, errors = inventory._process_worker((date, 'h12v04'))
+
+    m_data_process.assert_called_once_with(
+        products=tiles_obj.products.products, overwrite=True)
+    m_uoap.assert_not_called() # the parent process writes to the DB, not workers
+    assert (unit == (date, 'h12v04')
+            and files == [('MOD', 'temp8td', fn)]
+            and [msg for (msg, _) in errors] == ['Bad thing: RuntimeError: aaah!'])
+
+
+def t_data_inventory_process_parallel(mocker, mpo):
+    """Confirm worker results are added in the parent and errors are reported."""
+    mpo(inventory.orm, 'use_orm').return_value = False
+    m_error_handler = mpo(inventory.utils, 'error_handler')
+    m_error_handler.return_value.__exit__.return_value = True # continuable; swallow the error
+    m_get_context = mpo(inventory.multiprocessing, 'get_context')
+    m_pool = m_get_context.return_value.Pool.return_value
+    date = datetime.date(2012, 12, 1)
+    data_obj = mocker.Mock()
+    tiles_obj = mocker.Mock()
+    tiles_obj.tiles = {'h12v04': data_obj}
+    m_pool.imap_unordered.return_value = [(
+        (date, 'h12v04'),
+        [('MOD', 'temp8td', 'h12v04_2012336_MOD_temp8td.tif')],
+        [('Bad thing: RuntimeError: aaah!', 'traceback text')],
+    )]
+    di = DataInventory.__new__(DataInventory) # skip inventory search
+    di.data = {date: tiles_obj}
+
+    di.process_parallel(4)
+
+    m_get_context.assert_called_once_with('fork')
+    data_obj.AddFile.assert_called_once_with(
+        'MOD', 'temp8td', 'h12v04_2012336_MOD_temp8td.tif')
+    m_error_handler.assert_called_once_with(
+        'Error processing h12v04 2012-12-01', continuable=True)
+    m_pool.close.assert_called_once_with()
+
+
+def t_data_inventory_mosaic_parallel(mocker, mpo):
+    """Confirm mosaic farms out each (date, product) and reports worker errors."""
+    mpo(inventory.orm, 'use_orm').return_value = False
+    m_error_handler = mpo(inventory.utils, 'error_handler')
+    m_error_handler.return_value.__exit__.return_value = True # continuable; swallow the error
+    m_get_context = mpo(inventory.multiprocessing, 'get_context')
+    m_pool = m_get_context.return_value.Pool.return_value
+    dates = [datetime.date(2012, 12, 1), datetime.date(2012, 12, 2)]
+    di = DataInventory.__new__(DataInventory) # skip inventory search
+    di.data = {d: mocker.Mock() for d in dates}
+    for d in dates:
+        di.data[d].mosaic_pile.return_value = [('MOD', 'ndvi'), ('MOD', 'temp8td')]
+    di.spatial, di.products = mocker.Mock(), mocker.Mock()
+    m_pool.imap_unordered.return_value = [
+        ((dates[1], '/out/2012337', 'MOD', 'ndvi'), None,
+         [('Bad thing: RuntimeError: aaah!', 'traceback text')]),
+        ((dates[0], '/out/2012336', 'MOD', 'ndvi'), '/out/2012336/2012336_MOD_ndvi.tif', []),
+    ]
+    done = mocker.Mock()
+
+    di.mosaic('/out', tree=True, process=False, numprocs=3, done=done, res=[30.0, 30.0])
+
+    m_get_context.assert_called_once_with('fork')
+    init_args = m_get_context.return_value.Pool.call_args[1]['initargs']
+    assert init_args == (di, (), {'res': [30.0, 30.0]}, 3)
+    m_pool.imap_unordered.assert_called_once_with(inventory._mosaic_worker, [
+        (d, '/out/' + d.strftime('%Y%j'), 'MOD', p) for d in dates for p in ('ndvi', 'temp8td')])
+    m_error_handler.assert_called_once_with(
+        'Error mosaicking 2012-12-02 MOD ndvi', continuable=True)
+    done.assert_called_once_with('/out/2012336/2012336_MOD_ndvi.tif')
+    for d in dates:
+        di.data[d].mosaic.assert_not_called()
+
+
+def t_data_inventory_for_extents(mocker):
+    """Confirm for_extents searches once for all extents' tiles, then slices."""
+    date = datetime.date(2012, 12, 1)
+    data_objs = {t: mocker.Mock() for t in ('h12v04', 'h12v05', 'h13v04')}
+
+    def m_init(self, dataclass, spatial, temporal, **kwargs):
+        self.dataclass, self.spatial, self.products = dataclass, spatial, mocker.Mock()
+        tiles_obj = inventory.Tiles(dataclass, spatial, date, self.products)
+        tiles_obj.tiles = {t: data_objs[t] for t in spatial.tiles}
+        self.data = {date: tiles_obj}
+
+    m_init = mocker.patch.object(DataInventory, '__init__', autospec=True, side_effect=m_init)
+    extents = [SpatialExtent(modisData, tiles) for tiles in
+               (['h12v04', 'h12v05'], ['h13v04'], ['h12v05'], ['h09v09'])]
+
+    actual = DataInventory.for_extents(modisData, extents, 'fake-temporal', fetch=True)
+
+    (_, _, union, temporal), kwargs = m_init.call_args
+    assert (m_init.call_count == 1
+            and sorted(union.tiles) == ['h12v04', 'h12v05', 'h13v04']
+            and (temporal, kwargs) == ('fake-temporal', {'fetch': True})
+            and [inv.spatial for inv in actual] == extents
+            and [dict(inv[date].tiles) if date in inv.data else {} for inv in actual]
+                == [{'h12v04': data_objs['h12v04'], 'h12v05': data_objs['h12v05']},
+                    {'h13v04': data_objs['h13v04']},
+                    {'h12v05': data_objs['h12v05']},
+                    {}])
@@ -183,3 +183,30 @@ def t_landsatAsset_query_service_s3(
 def t_landsatData_products2assets(m_query_s3):
     """Unfetchable and undesired sources should be filtered out."""
     assert {'C1S3'} == landsat.landsatData.products2assets(['rad', 'landmask'])
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('DATE_ACQUIRED = 2017-05-06\n    SCENE_CENTER_TIME = "17:18:32.5137590Z"',
+     datetime.datetime(2017, 5, 6, 17, 18, 32, 513759, tzinfo=datetime.timezone.utc)),
+    ('DATE_ACQUIRED = 2017-05-06\n    SCENE_CENTER_TIME = 17:18:32Z',
+     datetime.datetime(2017, 5, 6, 17, 18, 32, tzinfo=datetime.timezone.utc)),
+    (cloud_cover_snippet(50.0), None),
+])
+def t_landsatAsset_acquired_from_mtl_text(text, expected):
+    """Confirm the scene center time is read from MTL text, to the microsecond."""
+    assert expected == landsat.landsatAsset.acquired_from_mtl_text(text)
+
+
+def t_landsatAsset_query_service_batch_catalog(mocker):
+    """Confirm scenes in the scene catalog are found & filtered without searching storage."""
+    d1, d2 = datetime.date(2017, 8, 1), datetime.date(2017, 8, 9)
+    pid = 'LC08_L1TP_012030_20170801_20170811_01_T1'
+    m_catalog = mocker.patch.object(landsat.landsatAsset, 'catalog')
+    m_catalog.return_value.scenes.return_value = {
+        d1: [(pid, 'LC8', 60.0, 'LC08/01/012/030/{}/'.format(pid))], d2: []}
+    mocker.patch.object(landsat.landsatAsset, 'get_setting').return_value = 'gs'
+    m_gs_api_search = mocker.patch.object(landsat.landsatAsset, 'gs_api_search')
+
+    actual = landsat.landsatAsset.query_service_batch('C1GS', '012030', [d1, d2], pclouds=50)
+
+    assert actual == {d1: None, d2: None} and not m_gs_api_search.called
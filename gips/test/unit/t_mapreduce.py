@@ -0,0 +1,69 @@
+"""Unit tests for gips.mapreduce."""
+
+import numpy as np
+import pytest
+
+from gips import mapreduce
+
+
+def ndvi(data):
+    return (data[1] - data[0]) / (data[1] + data[0])
+
+
+@pytest.mark.parametrize('shared', (False, True))
+def t_map_reduce_array(shared):
+    """Confirm map_reduce_array matches a serial run, shared memory or not."""
+    arrin = np.random.RandomState(0).uniform(0.01, 1, (2, 37, 23))
+    arrin[:, 5, 7] = np.nan
+    expected = mapreduce._test_map_reduce_array(arrin, ndvi, nchunks=7)
+    actual = mapreduce.map_reduce_array(arrin, ndvi, nchunks=7, nproc=3, shared=shared)
+    assert actual.shape == (37, 23)
+    assert np.isnan(actual[5, 7])
+    np.testing.assert_array_equal(expected[0], actual)
+
+
+def t_map_reduce_array_2d():
+    """Confirm map_reduce_array takes a single-band, 2-D array."""
+    arrin = np.arange(12.0).reshape(3, 4)
+    actual = mapreduce.map_reduce_array(arrin, lambda d: d[0] * 2, nchunks=2, shared=True)
+    np.testing.assert_array_equal(arrin * 2, actual)
+
+
+@pytest.mark.parametrize('blocksize, chunksize, expected', (
+    # 1 MB is 2**16 pixels of 8-byte input & output; whole rows of 64-row blocks
+    ((1000, 64), 1.0, [[0, y, 1000, min(64, 600 - y)] for y in range(0, 600, 64)]),
+    # 2 MB is 2**17 pixels, less than a row of 256-row blocks, so it's split into blocks
+    ((256, 256), 2.0, [[x, y, min(512, 1000 - x), min(256, 600 - y)]
+                       for y in (0, 256, 512) for x in (0, 512)]),
+    # untiled, so strips of as many rows as fit
+    (None, 0.5, [[0, y, 1000, min(32, 600 - y)] for y in range(0, 600, 32)]),
+))
+def t_plan_chunks(blocksize, chunksize, expected):
+    """Confirm plan_chunks aligns chunks to blocks & sizes them to the budget."""
+    actual = mapreduce.MapReduce.plan_chunks((1, 600, 1000), 1, blocksize, chunksize)
+    assert expected == actual
+
+
+def t_plan_chunks_minchunks():
+    """Confirm plan_chunks splits small images among processes, along blocks."""
+    actual = mapreduce.MapReduce.plan_chunks((3, 100, 50), 1, (50, 16), minchunks=4)
+    assert actual == [[0, y, 50, min(32, 100 - y)] for y in (0, 32, 64, 96)]
+
+
+@pytest.mark.parametrize('shared', (False, True))
+def t_MapReduce_stream(shared):
+    """Confirm streaming MapReduce hands every finished chunk to wfunc, in this process."""
+    arrin = np.random.RandomState(0).uniform(0.01, 1, (2, 40, 30))
+    written = np.full((40, 30), -1.0)
+    def wfunc(args):
+        (output, ch) = args
+        written[ch[1]:ch[1] + ch[3], ch[0]:ch[0] + ch[2]] = output[0]
+    rfunc = lambda ch: arrin[:, ch[1]:ch[1] + ch[3], ch[0]:ch[0] + ch[2]]
+    mr = mapreduce.MapReduce(arrin.shape, (1, 40, 30), rfunc, ndvi, wfunc, nproc=3,
+                             shared=shared, stream=True)
+    try:
+        mr.run(blocksize=(30, 4))
+    finally:
+        mr.close()
+    assert len(mr.chunks) == 10
+    np.testing.assert_array_equal(mapreduce._test_map_reduce_array(arrin, ndvi)[0], written)
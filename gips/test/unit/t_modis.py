@@ -0,0 +1,17 @@
+"""Unit tests for modis product generation."""
+
+import numpy as np
+
+from gips.data.modis import modis
+from gips.test.bench import modis_indices
+
+
+def t_indices_chunk():
+    """Confirm the fused indices kernel matches the original computation."""
+    args = modis_indices.random_chunk(50, 60)
+    # exercise the divide-by-zero checks
+    args[1][0, :5] = args[2][0, :5] = 0.0
+    expected = modis_indices.indices_chunk_reference(
+        args[0], *[a.copy() for a in args[1:]])
+    actual = modis._indices_chunk(args[0], *[a.copy() for a in args[1:]])
+    assert all(np.array_equal(e, a) for e, a in zip(expected, actual))
@@ -133,3 +133,14 @@ def t_discover(orm, basic_asset_db):
     actual_d   = {a: getattr(actual, a)   for a in attribs}
 
     assert len(disc_out) == 1 and expected_d == actual_d
+
+
+def t_acquisition_calendar():
+    """Confirm 8-day & yearly composites are only expected on their start dates."""
+    cal = modisAsset.acquisition_calendar
+    assert (cal('MCD43A4', 'h12v04') is None
+            and [d for d in range(1, 20) if cal('MOD09Q1', 'h08v04')(
+                datetime.date(2000, 1, 1) + datetime.timedelta(d - 1))] == [1, 9, 17]
+            and cal('MOD11A2', 'h08v04')(datetime.date(2000, 8, 20)) # A2000233
+            and cal('MCD12Q1', 'h02v06')(datetime.datetime(2004, 1, 1))
+            and not cal('MCD12Q1', 'h02v06')(datetime.datetime(2004, 12, 31)))
@@ -17,8 +17,20 @@ def t_setup(mocker, setup_complete, use_orm, expected):
     mocker.patch('gips.inventory.orm.setup_complete', setup_complete)
     m_use_orm = mocker.patch('gips.inventory.orm.use_orm')
     m_use_orm.return_value = use_orm
+    mocker.patch('gips.inventory.orm.backend', return_value='django')
     m_django_setup = mocker.patch('gips.inventory.orm.django.setup')
     orm.setup()
     # confirm it ran/didn't run django.setup as expected, and confirm 
     # that the global var got set in any case
     assert expected == m_django_setup.called and orm.setup_complete
+
+
+@pytest.mark.parametrize('backend, expected', (('django', True), ('sqlite3', False)))
+def t_setup_backend(mocker, backend, expected):
+    """Confirm orm.setup() only runs django.setup when the inventory backend needs it."""
+    mocker.patch('gips.inventory.orm.setup_complete', False)
+    mocker.patch('gips.inventory.orm.use_orm', return_value=True)
+    mocker.patch('gips.inventory.orm.backend', return_value=backend)
+    m_django_setup = mocker.patch('gips.inventory.orm.django.setup')
+    orm.setup()
+    assert expected == m_django_setup.called and orm.setup_complete
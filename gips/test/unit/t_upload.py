@@ -0,0 +1,124 @@
+"""Unit tests for gips.upload, against a local stand-in for S3."""
+
+import io
+import os
+import zipfile
+
+import pytest
+
+from gips import upload
+
+
+class FakeS3(object):
+    """Stands in for a boto3 S3 client, keeping uploads in objects."""
+
+    def __init__(self, fail=()):
+        self.objects = {}
+        self.fail = fail
+
+    def upload_file(self, filename, bucket, key):
+        if key in self.fail:
+            raise IOError('upload failed: ' + key)
+        with open(filename, 'rb') as f:
+            self.objects[(bucket, key)] = f.read()
+
+    def upload_fileobj(self, fileobj, bucket, key):
+        data = io.BytesIO()
+        for chunk in iter(lambda: fileobj.read(1000), b''): # small parts, to interleave
+            data.write(chunk)
+            if key in self.fail:
+                raise IOError('upload failed: ' + key)
+        self.objects[(bucket, key)] = data.getvalue()
+
+
+@pytest.fixture
+def export_files(tmpdir):
+    """Some files in an export directory, as mosaics would be."""
+    files = {}
+    for rel in ('site/2012336_MOD_ndvi.tif', 'site/2012336_MOD_temp8td.tif',
+                'site/2012337_MOD_ndvi.tif'):
+        path = tmpdir.join('export', *rel.split('/'))
+        path.write_binary(os.urandom(200000), ensure=True)
+        files[rel] = str(path)
+    return str(tmpdir.join('export')), files
+
+
+@pytest.mark.parametrize('url, expected', (
+    ('s3://bucket/some/prefix/', ('bucket', 'some/prefix')),
+    ('s3://bucket', ('bucket', '')),
+))
+def t_split_s3_url(url, expected):
+    assert upload.split_s3_url(url) == expected
+
+
+def t_S3Uploader(export_files):
+    """Confirm S3Uploader uploads each file under its path relative to root."""
+    root, files = export_files
+    s3 = FakeS3()
+    with upload.S3Uploader('s3://bucket/exports/run1', root, workers=2, queue_size=1,
+                           client=s3) as uploader:
+        for path in files.values():
+            uploader.add(path)
+    assert s3.objects == {('bucket', 'exports/run1/' + rel): open(path, 'rb').read()
+                          for rel, path in files.items()}
+
+
+def t_S3Uploader_error(export_files):
+    """Confirm S3Uploader raises upload errors when closed."""
+    root, files = export_files
+    s3 = FakeS3(fail=('run1/site/2012336_MOD_ndvi.tif',))
+    uploader = upload.S3Uploader('s3://bucket/run1', root, workers=1, client=s3)
+    for path in sorted(files.values()):
+        uploader.add(path)
+    with pytest.raises(IOError):
+        uploader.close()
+
+
+def t_S3ZipStreamer(export_files):
+    """Confirm S3ZipStreamer uploads a zip of the files, named relative to root."""
+    root, files = export_files
+    s3 = FakeS3()
+    with upload.S3ZipStreamer('s3://bucket/exports/run1.zip', root, queue_size=1,
+                              client=s3) as streamer:
+        for path in files.values():
+            streamer.add(path)
+    zf = zipfile.ZipFile(io.BytesIO(s3.objects[('bucket', 'exports/run1.zip')]))
+    assert {n: zf.read(n) for n in zf.namelist()} == {
+        rel: open(path, 'rb').read() for rel, path in files.items()}
+
+
+def t_S3ZipStreamer_error(export_files):
+    """Confirm S3ZipStreamer raises when the upload fails, without blocking the zipper."""
+    root, files = export_files
+    s3 = FakeS3(fail=('run1.zip',))
+    streamer = upload.S3ZipStreamer('s3://bucket/run1.zip', root, queue_size=1, client=s3)
+    for path in files.values():
+        streamer.add(path)
+    with pytest.raises(IOError):
+        streamer.close()
+
+
+def t_S3ZipStreamer_zip_error(export_files):
+    """Confirm S3ZipStreamer stores nothing when zipping a file fails."""
+    root, files = export_files
+    s3 = FakeS3()
+    streamer = upload.S3ZipStreamer('s3://bucket/run1.zip', root, queue_size=1, client=s3)
+    streamer.add(files['site/2012336_MOD_ndvi.tif'])
+    streamer.add(os.path.join(root, 'site', 'missing.tif'))
+    streamer.add(files['site/2012337_MOD_ndvi.tif'])
+    with pytest.raises(OSError):
+        streamer.close()
+    assert s3.objects == {}
+
+
+def t_S3ZipStreamer_abort(export_files):
+    """Confirm S3ZipStreamer stores nothing, & lets the error through, if its with-block raises."""
+    root, files = export_files
+    s3 = FakeS3()
+    with pytest.raises(RuntimeError, match='mosaic failed'):
+        with upload.S3ZipStreamer('s3://bucket/run1.zip', root, queue_size=1,
+                                  client=s3) as streamer:
+            for path in files.values():
+                streamer.add(path)
+            raise RuntimeError('mosaic failed')
+    assert s3.objects == {}
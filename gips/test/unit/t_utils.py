@@ -1,6 +1,7 @@
 """Unit tests for code found in gips.utils."""
 
 import sys
+import types
 import datetime
 
 import pytest
@@ -96,6 +97,104 @@ def t_julian_date(dt, variant, expected):
     assert expected == round(utils.julian_date(dt, variant), 6)
 
 
+def t_process_chunks(mocker):
+    """Confirm process_chunks reads, computes, & writes chunk by chunk."""
+    chunks = ['chunk-1', 'chunk-2']
+    in_bands = [mocker.Mock(), mocker.Mock()]
+    for i, b in enumerate(in_bands):
+        b.read.side_effect = lambda chunk, i=i: (i, chunk)
+    imgout = mocker.MagicMock()
+    imgout.chunks.return_value = chunks
+    out_bands = [mocker.Mock(), mocker.Mock()]
+    imgout.__getitem__.side_effect = out_bands.__getitem__
+    func = lambda a, b: (('sum', a, b), ('diff', a, b))
+
+    utils.process_chunks(in_bands, imgout, func)
+
+    assert all(out_bands[i].write.call_args_list == [
+            mocker.call((op, (0, c), (1, c)), c) for c in chunks]
+        for i, op in enumerate(('sum', 'diff')))
+
+
+
+def t_warp(mocker):
+    """Confirm warp passes its grid, cutline, & settings to gdal.Warp."""
+    mocker.patch.object(utils, 'settings').return_value = types.SimpleNamespace(WARP_THREADS=4)
+    m_gdal = mocker.patch.object(utils, 'gdal')
+    m_write_cutline = mocker.patch.object(utils, 'write_cutline', return_value='cutline.shp')
+    site = mocker.Mock()
+
+    ds = utils.warp(['a.tif', 'b.tif'], 'out.tif', -32768, cutline=site, alltouch=True,
+                    interpolation=1, dstSRS='srs', outputBounds=(0, 0, 1, 1))
+
+    assert ds == m_gdal.Warp.return_value
+    assert m_write_cutline.call_args[0][0] is site
+    m_gdal.WarpOptions.assert_called_once_with(
+        format='GTiff', resampleAlg='bilinear', srcNodata=-32768, dstNodata=-32768,
+        multithread=True, warpMemoryLimit=512,
+        warpOptions=['NUM_THREADS=4', 'CUTLINE_ALL_TOUCHED=TRUE'],
+        cutlineDSName='cutline.shp', dstSRS='srs', outputBounds=(0, 0, 1, 1))
+    m_gdal.Warp.assert_called_once_with(
+        'out.tif', ['a.tif', 'b.tif'], options=m_gdal.WarpOptions.return_value)
+
+
+@pytest.mark.parametrize('bounds, expected', (
+    ((100.0, 200.0, 190.0, 290.0), (100.0, 200.0, 190.0, 290.0)), # already on the grid
+    ((115.0, 201.0, 160.1, 289.0), (100.0, 200.0, 190.0, 290.0)),
+    ((70.0, 170.0, 100.0 + 30 * 0.1 * 10, 200.0), (70.0, 170.0, 130.0, 200.0)), # float error
+))
+def t_snap_bounds(bounds, expected):
+    """Confirm _snap_bounds grows bounds out to whole pixels of the grid."""
+    actual = utils._snap_bounds(bounds, (10.0, 290.0), 30.0, 30.0)
+    assert actual == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('setting, cap, expected', (
+    (None, None, 'ALL_CPUS'), (None, 2, 2), (8, 2, 2), (1, 2, 1)))
+def t_warp_threads(mocker, setting, cap, expected):
+    """Confirm set_warp_threads caps the WARP_THREADS setting."""
+    m_settings = types.SimpleNamespace() if setting is None else types.SimpleNamespace(
+        WARP_THREADS=setting)
+    mocker.patch.object(utils, 'settings').return_value = m_settings
+    m_gdal = mocker.patch.object(utils, 'gdal')
+    mocker.patch.object(utils, '_warp_threads', None) # restored after the test
+    utils.set_warp_threads(cap)
+    utils.warp(['a.tif'], 'out.tif', 0)
+    assert m_gdal.WarpOptions.call_args[1]['warpOptions'] == ['NUM_THREADS={}'.format(expected)]
+
+
+def t_warp_error(mocker):
+    """Confirm warp raises when gdal.Warp fails."""
+    mocker.patch.object(utils, 'settings').return_value = types.SimpleNamespace()
+    m_gdal = mocker.patch.object(utils, 'gdal')
+    m_gdal.Warp.return_value = None
+    with pytest.raises(RuntimeError):
+        utils.warp(['a.tif'], 'out.tif', 0)
+
+
+@pytest.mark.parametrize('data_type, predictor', (('Float32', 'PREDICTOR=3'),
+                                                  ('Int16', 'PREDICTOR=2')))
+def t_profile_options(mocker, data_type, predictor):
+    """Confirm profile_options picks a predictor to suit the data type."""
+    mocker.patch.object(utils.gdal, 'GetDataTypeName', return_value=data_type)
+    fmt, options = utils.profile_options('zstd', 'gdal-type')
+    assert fmt == 'GTiff'
+    assert options == utils.output_profiles['zstd']['options'] + [predictor]
+    assert utils.profile_options('cog', 'gdal-type') == (
+        'COG', utils.output_profiles['cog']['options'])
+    with pytest.raises(ValueError):
+        utils.profile_options('lzw-please', 'gdal-type')
+
+
+def t_build_overviews(mocker):
+    """Confirm build_overviews halves the image down to about a block's size."""
+    ds = mocker.Mock(RasterXSize=3000, RasterYSize=1200)
+    utils.build_overviews(ds, 'deflate')
+    ds.BuildOverviews.assert_called_once_with('NEAREST', [2, 4, 8])
+    ds = mocker.Mock(RasterXSize=3000, RasterYSize=1200)
+    utils.build_overviews(ds, 'cog') # the COG driver makes its own
+    ds.BuildOverviews.assert_not_called()
+
 @pytest.yield_fixture
 def restore_error_handler():
     handler = utils.error_handler
@@ -28,7 +28,6 @@ import traceback
 import collections
 
 import gippy
-from gippy.algorithms import cookie_cutter
 from gips.utils import VerboseOut, Colors, mkdir
 from gips import utils
 
@@ -73,65 +72,84 @@ class Tiles(object):
         """ Calls process for each tile """
         [t.process(*args, products=self.products.products, **kwargs) for t in list(self.tiles.values())]
 
-    def mosaic(self, datadir, res=None, interpolation=0, crop=False,
-               overwrite=False, alltouch=False, vrt=False):
+    def mosaic_pile(self):
+        """The (sensor, product) pairs mosaic() makes, one mosaic each."""
+        # look in each Data() and dig out its (sensor, product_type) pairs
+        return sorted({(s, p) for d in self.tiles.values() for (s, p) in d.filenames
+                       if p in self.products.products})
+
+    def mosaic(self, datadir, done=None, **kwargs):
         """For each product, combine its tiles into a single mosaic.
 
-        Warp if res provided."""
+        If given, done is called with each mosaic's filename as soon as
+        it's in place.  See mosaic_product for other arguments."""
         if self.spatial.site is None:
             raise Exception('Site required for creating mosaics')
         start = datetime.now()
-        bname = self.date.strftime('%Y%j')
-
-        # look in each Data() and dig out its (sensor, product_type) pairs
-        sp_pile = [(s, p) for d in self.tiles.values() for (s, p) in d.filenames
-                        if p in self.products.products]
-        # work on each product in turn, gathering up filenames as needed
-        for (sensor, product) in sp_pile:
-            # create data directory when it is needed
-            mkdir(datadir)
-            # TODO - this is assuming a tif file.  Use gippy FileExtension function when it is exposed
-            extension = 'vrt' if vrt else 'tif'
-            fn = '{}_{}_{}.{}'.format(bname, sensor, product, extension)
-            final_fp = os.path.join(datadir, fn)
-            if not os.path.exists(final_fp) or overwrite:
-                err_msg = ("Error mosaicking " + final_fp + ". Did you forget"
-                           " to specify a resolution (`--res x x`)?")
-
-                with utils.error_handler(err_msg, continuable=True):
-
-                    with utils.make_temp_dir(dir=datadir, prefix='mosaic') as tmp_dir:
-
-                        tmp_fp = os.path.join(tmp_dir, fn) # for safety
-
-                        filenames = [self.tiles[t].filenames[(sensor, product)]
-                                     for t in self.tiles
-                                     if (sensor, product) in self.tiles[t].filenames
-                        ]
-
-                        images = [gippy.GeoImage(f) for f in filenames]
-
-                        if vrt:
-                            spatial_kwarg = {}
-                            if self.spatial.rastermask:
-                                spatial_kwarg['rastermask'] = self.spatial.rastermask
-                            else:
-                                spatial_kwarg['site'] = self.spatial.site
-                            utils.vrt_mosaic(filenames, tmp_fp, interpolation, res, **spatial_kwarg)
-                        elif self.spatial.rastermask is not None:
-                            utils.gridded_mosaic(images, tmp_fp, self.spatial.rastermask,
-                                                 interpolation)
-                        elif res is not None:
-                            cookie_cutter(
-                                images, tmp_fp, self.spatial.site, crop,
-                                "", res[0], res[1], interpolation,
-                            )
-                        else:
-                            utils.mosaic(images, tmp_fp, self.spatial.site)
-                        os.rename(tmp_fp, final_fp)
+        # work on each product in turn
+        for (sensor, product) in self.mosaic_pile():
+            final_fp = self.mosaic_product(datadir, sensor, product, **kwargs)
+            if final_fp is not None and done is not None:
+                done(final_fp)
         t = datetime.now() - start
         VerboseOut('%s: created project files for %s tiles in %s' % (self.date, len(self.tiles), t), 2)
 
+    def mosaic_product(self, datadir, sensor, product, res=None, interpolation=0, crop=False,
+                       overwrite=False, alltouch=False, vrt=False):
+        """Combine one product's tiles into a single mosaic in datadir.
+
+        Warp if res provided.  Mosaics are written once, in-process, by
+        GDAL; see utils.mosaic & utils.gridded_mosaic.  Each is made in a
+        temp dir and renamed into place when done, so it's safe to make
+        several at once.  Returns the mosaic's filename if it was made,
+        else None."""
+        if self.spatial.site is None:
+            raise Exception('Site required for creating mosaics')
+        bname = self.date.strftime('%Y%j')
+        # create data directory when it is needed
+        mkdir(datadir)
+        # TODO - this is assuming a tif file.  Use gippy FileExtension function when it is exposed
+        extension = 'vrt' if vrt else 'tif'
+        fn = '{}_{}_{}.{}'.format(bname, sensor, product, extension)
+        final_fp = os.path.join(datadir, fn)
+        if os.path.exists(final_fp) and not overwrite:
+            return None
+        err_msg = ("Error mosaicking " + final_fp + ". Did you forget"
+                   " to specify a resolution (`--res x x`)?")
+
+        with utils.error_handler(err_msg, continuable=True):
+
+            with utils.make_temp_dir(dir=datadir, prefix='mosaic') as tmp_dir:
+
+                tmp_fp = os.path.join(tmp_dir, fn) # for safety
+
+                filenames = [self.tiles[t].filenames[(sensor, product)]
+                             for t in self.tiles
+                             if (sensor, product) in self.tiles[t].filenames
+                ]
+
+                images = [gippy.GeoImage(f) for f in filenames]
+                profile = self.dataclass.get_setting('output-profile')
+
+                if vrt:
+                    spatial_kwarg = {}
+                    if self.spatial.rastermask:
+                        spatial_kwarg['rastermask'] = self.spatial.rastermask
+                    else:
+                        spatial_kwarg['site'] = self.spatial.site
+                    utils.vrt_mosaic(filenames, tmp_fp, interpolation, res, **spatial_kwarg)
+                elif self.spatial.rastermask is not None:
+                    utils.gridded_mosaic(images, tmp_fp, self.spatial.rastermask,
+                                         interpolation, profile)
+                elif res is not None:
+                    utils.mosaic(images, tmp_fp, self.spatial.site, res, crop, alltouch,
+                                 interpolation, profile)
+                else:
+                    utils.mosaic(images, tmp_fp, self.spatial.site, profile=profile)
+                os.rename(tmp_fp, final_fp)
+                return final_fp
+        return None # it failed; see error_handler
+
     def asset_coverage(self):
         """ Calculates % coverage of site for each asset """
         asset_coverage = {}
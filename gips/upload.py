@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+################################################################################
+#    GIPS: Geospatial Image Processing System
+#
+#    AUTHOR: Matthew Hanson
+#    EMAIL:  matt.a.hanson@gmail.com
+#
+#    Copyright (C) 2014-2018 Applied Geosolutions
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program. If not, see <http://www.gnu.org/licenses/>
+################################################################################
+
+"""Uploading finished files to S3 while more are being made.
+
+Both uploaders take files with add() as they're finished, upload them in
+background threads, and are closed with close(), which waits for the
+uploads and raises the first error if any failed, or with abort(),
+which gives up on the files not uploaded yet.  Used as context managers
+they abort if the with-block raises.  add() blocks while queue_size
+files are waiting, which bounds how far uploading may lag.
+The S3 client is boto3's, for the S3_ENDPOINT_URL setting if it's set
+(eg a local S3 stand-in), unless one is given.
+"""
+
+import os
+import queue
+import threading
+import zipfile
+
+from gips import utils
+
+# files bigger than this are uploaded in parts of this size
+multipart_size = 64 * 2**20
+
+
+def split_s3_url(url):
+    """Split 's3://bucket/some/key' into ('bucket', 'some/key')."""
+    if not url.startswith('s3://'):
+        raise ValueError("Expected an s3:// URL, got '{}'".format(url))
+    bucket, _, key = url[len('s3://'):].partition('/')
+    return bucket, key.strip('/')
+
+
+def s3_client():
+    """Return a boto3 S3 client, for the S3_ENDPOINT_URL setting if it's set."""
+    import boto3 # import here so it only breaks if it's actually needed
+    return boto3.client('s3', endpoint_url=getattr(utils.settings(), 'S3_ENDPOINT_URL', None))
+
+
+def transfer_config(threads):
+    """Return a boto3 TransferConfig for multipart uploads using up to `threads` threads each."""
+    from boto3.s3.transfer import TransferConfig
+    return TransferConfig(multipart_threshold=multipart_size,
+                          multipart_chunksize=multipart_size, max_concurrency=threads)
+
+
+class _Uploader(object):
+    """Common parts of the uploaders; subclasses implement _start & _finish."""
+
+    def __init__(self, url, root, queue_size, client):
+        self.bucket, self.key = split_s3_url(url)
+        self.root = root
+        self.client = client
+        self.queue = queue.Queue(queue_size)
+        self.errors = []
+        self.threads = []
+        self.aborted = threading.Event()
+        self._start()
+
+    def add(self, path):
+        """Queue the file at path, somewhere under root, for uploading."""
+        self.queue.put(path)
+
+    def relpath(self, path):
+        """The path's name relative to root, '/'-separated."""
+        return os.path.relpath(path, self.root).replace(os.sep, '/')
+
+    def close(self):
+        """Wait for queued files to be uploaded, then raise the first error, if any."""
+        self._finish()
+        for t in self.threads:
+            t.join()
+        if self.errors:
+            raise self.errors[0]
+
+    def abort(self):
+        """Give up on files not uploaded yet, and wait for the threads to stop; errors are dropped."""
+        self.aborted.set()
+        self._finish()
+        for t in self.threads:
+            t.join()
+
+    def _thread(self, target, *args):
+        t = threading.Thread(target=target, args=args)
+        t.daemon = True
+        t.start()
+        self.threads.append(t)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort() # don't upload partial results, nor hide the original error
+
+
+class S3Uploader(_Uploader):
+    """Upload each file to the S3 prefix at url as it's added.
+
+    Each file's key is its path relative to root, under the prefix.
+    `workers` threads upload files at once, in multipart chunks when
+    they're big.
+    """
+
+    def __init__(self, url, root, workers=4, queue_size=None, client=None):
+        self.workers = workers
+        self.extra_args = {}
+        if client is None:
+            client = s3_client()
+            self.extra_args['Config'] = transfer_config(workers)
+        super(S3Uploader, self).__init__(url, root, queue_size or 2 * workers, client)
+
+    def _start(self):
+        for _ in range(self.workers):
+            self._thread(self._upload)
+
+    def _finish(self):
+        for _ in self.threads:
+            self.queue.put(None)
+
+    def _upload(self):
+        while True:
+            path = self.queue.get()
+            if path is None:
+                return
+            if self.errors or self.aborted.is_set():
+                continue # give up on the rest, but keep draining the queue
+            try:
+                key = '/'.join(k for k in (self.key, self.relpath(path)) if k)
+                utils.vprint('uploading', path, 'to s3://{}/{}'.format(self.bucket, key), level=2)
+                self.client.upload_file(path, self.bucket, key, **self.extra_args)
+            except Exception as e:
+                self.errors.append(e)
+
+
+class _PipeReader(object):
+    """Reads the zip pipe for upload, raising once its streamer has failed or been aborted.
+
+    The upload only completes when a read returns b'' at the end of the
+    pipe, so raising instead makes it abort, rather than store a
+    truncated zip.
+    """
+
+    def __init__(self, pipe, streamer):
+        self.pipe = pipe
+        self.streamer = streamer
+
+    def read(self, size=-1):
+        data = self.pipe.read(size)
+        if self.streamer.errors or self.streamer.aborted.is_set():
+            raise IOError('Zip stream to s3://{}/{} was abandoned'.format(
+                self.streamer.bucket, self.streamer.key))
+        return data
+
+
+class S3ZipStreamer(_Uploader):
+    """Upload a zip of the files added to the S3 key at url, without writing it to disk.
+
+    One thread zips files into a pipe as they're added, named for their
+    paths relative to root; another uploads from the pipe as it fills,
+    in multipart chunks.  If zipping fails or the streamer is aborted,
+    the upload is abandoned, so no partial zip is stored.
+    """
+
+    def __init__(self, url, root, threads=4, queue_size=8, client=None):
+        self.extra_args = {}
+        if client is None:
+            client = s3_client()
+            self.extra_args['Config'] = transfer_config(threads)
+        super(S3ZipStreamer, self).__init__(url, root, queue_size, client)
+
+    def _start(self):
+        rfd, wfd = os.pipe()
+        self.reader, self.writer = os.fdopen(rfd, 'rb'), os.fdopen(wfd, 'wb')
+        self._thread(self._zip)
+        self._thread(self._upload)
+
+    def _finish(self):
+        self.queue.put(None)
+
+    def _zip(self):
+        try:
+            # zipfile handles unseekable output, such as a pipe
+            with zipfile.ZipFile(self.writer, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+                for path in iter(self.queue.get, None):
+                    if self.aborted.is_set():
+                        continue # keep draining the queue so add() doesn't block
+                    zf.write(path, self.relpath(path))
+        except Exception as e:
+            self.errors.append(e)
+            for _ in iter(self.queue.get, None): # so add() doesn't block
+                pass
+        finally:
+            # errors & aborts are set before this, so _PipeReader fails instead of ending
+            self.writer.close()
+
+    def _upload(self):
+        try:
+            utils.vprint('uploading zip to s3://{}/{}'.format(self.bucket, self.key), level=2)
+            self.client.upload_fileobj(_PipeReader(self.reader, self), self.bucket, self.key,
+                                       **self.extra_args)
+        except Exception as e:
+            self.errors.append(e)
+            while self.reader.read(multipart_size): # so the zip thread doesn't block
+                pass
+        finally:
+            self.reader.close()
+
@@ -25,6 +25,7 @@ import imp
 import sys
 import os
 import re
+import math
 import errno
 from contextlib import contextmanager
 import tempfile
@@ -35,14 +36,16 @@ import datetime
 import time
 import json
 import logging
+import threading
 from functools import partial
 
 import numpy as np
 import requests
 
-from osgeo import osr
+from osgeo import gdal, ogr, osr
 import pyproj
 import shapely
+import shapely.geometry
 import shapely.ops
 
 import gippy
@@ -454,26 +457,158 @@ def extents2geojson(spatial_extents):
     return shapely.ops.unary_union(tile_geoms).__geo_interface__
 
 
-def crop2vector(img, vector):
-    """ Crop a GeoImage down to a vector - only used by mosaic """
-    # transform vector to srs of image
-    vecname = transform(vector.filename(), img.srs())
-    warped_vec = open_vector(vecname)
-    # rasterize the vector
-    td = tempfile.mkdtemp()
-    mask = gippy.GeoImage.create_from(img, os.path.join(td, vector.layer_name()), 1, 'uint8')
-    maskname = mask.filename()
-    mask = None
-    cmd = 'gdal_rasterize -at -burn 1 -l %s %s %s' % (warped_vec.layer_name(), vecname, maskname)
-    result = subprocess.getstatusoutput(cmd)
-    VerboseOut('%s: %s' % (cmd, result), 4)
-    mask = gippy.GeoImage(maskname)
-    img.add_mask(mask[0]).save(img.filename()).clear_masks()
-    mask = None
-    shutil.rmtree(os.path.dirname(maskname))
-    shutil.rmtree(os.path.dirname(vecname))
-    # VerboseOut('Cropped to vector in %s' % (datetime.now() - start), 3)
-    return img
+_resamplers = ['near', 'bilinear', 'cubic']
+
+
+def write_cutline(feature, dirname):
+    """Write a GeoFeature to a shapefile in dirname, for use as a GDAL cutline.
+
+    Returns the shapefile's name.
+    """
+    fname = os.path.join(dirname, 'cutline.shp')
+    ds = ogr.GetDriverByName('ESRI Shapefile').CreateDataSource(fname)
+    layer = ds.CreateLayer('cutline', osr.SpatialReference(feature.srs()), ogr.wkbUnknown)
+    feat = ogr.Feature(layer.GetLayerDefn())
+    feat.SetGeometry(ogr.CreateGeometryFromWkt(feature.wkt_geometry()))
+    layer.CreateFeature(feat)
+    feat = layer = ds = None # flush to disk
+    return fname
+
+
+# Named output profiles for rasters; see output_profile
+output_profiles = {
+    # tiled, compressed GeoTIFFs with internal overviews
+    'deflate': {
+        'format': 'GTiff',
+        'options': ['TILED=YES', 'BLOCKXSIZE=512', 'BLOCKYSIZE=512', 'COMPRESS=DEFLATE',
+                    'ZLEVEL=6', 'NUM_THREADS=ALL_CPUS', 'BIGTIFF=IF_SAFER'],
+        'predictor': True,
+        'overviews': 'NEAREST',
+    },
+    'zstd': {
+        'format': 'GTiff',
+        'options': ['TILED=YES', 'BLOCKXSIZE=512', 'BLOCKYSIZE=512', 'COMPRESS=ZSTD',
+                    'ZSTD_LEVEL=9', 'NUM_THREADS=ALL_CPUS', 'BIGTIFF=IF_SAFER'],
+        'predictor': True,
+        'overviews': 'NEAREST',
+    },
+    # cloud-optimized GeoTIFF; GDAL's COG driver lays out its own overviews
+    'cog': {
+        'format': 'COG',
+        'options': ['COMPRESS=DEFLATE', 'PREDICTOR=YES', 'OVERVIEW_RESAMPLING=NEAREST',
+                    'NUM_THREADS=ALL_CPUS', 'BIGTIFF=IF_SAFER'],
+        'predictor': False,
+        'overviews': None,
+    },
+}
+
+
+def output_profile(profile):
+    """Return the output profile named by profile, or profile itself if it's a dict.
+
+    A profile is a dict of the GDAL 'format' and creation 'options' to
+    write rasters with; if 'predictor', a PREDICTOR creation option
+    suited to the data type is added, and if 'overviews' names a
+    resampling method, overviews are built with it.  None means no
+    profile:  write with gippy's defaults as usual.
+    """
+    if profile is None or isinstance(profile, dict):
+        return profile
+    try:
+        return output_profiles[profile]
+    except KeyError:
+        raise ValueError("Unknown output profile '{}'; expected one of {}".format(
+            profile, sorted(output_profiles)))
+
+
+def profile_options(profile, data_type):
+    """Return the GDAL (format, creation options) for writing data_type, a GDAL type, per profile."""
+    profile = output_profile(profile)
+    options = list(profile['options'])
+    if profile.get('predictor'):
+        # floating point prediction for floats, horizontal differencing for integers
+        floating = gdal.GetDataTypeName(data_type).startswith(('Float', 'CFloat'))
+        options.append('PREDICTOR={}'.format(3 if floating else 2))
+    return profile['format'], options
+
+
+def build_overviews(ds, profile):
+    """Build overviews for a gdal Dataset per profile, halving down to a block's size."""
+    resampling = output_profile(profile).get('overviews')
+    if not resampling:
+        return
+    factors, size = [], max(ds.RasterXSize, ds.RasterYSize)
+    while size // (2 ** (len(factors) + 1)) >= 256:
+        factors.append(2 ** (len(factors) + 1))
+    if factors:
+        ds.BuildOverviews(resampling, factors)
+
+
+def write_profile(src, dst, profile):
+    """Copy the raster file src to dst, written per the output profile."""
+    src_ds = gdal.Open(src)
+    fmt, options = profile_options(profile, src_ds.GetRasterBand(1).DataType)
+    verbose_out('gdal.Translate {} to {}: {} {}'.format(src, dst, fmt, options), 4)
+    ds = gdal.Translate(dst, src_ds, options=gdal.TranslateOptions(
+        format=fmt, creationOptions=options))
+    if ds is None:
+        raise RuntimeError('Error writing {} to {}: {}'.format(src, dst, gdal.GetLastErrorMsg()))
+    build_overviews(ds, profile)
+    ds = src_ds = None
+    return dst
+
+
+_warp_threads = None # caps the WARP_THREADS setting; see set_warp_threads
+
+
+def set_warp_threads(threads):
+    """Cap the threads each warp uses in this process, eg in a pool's workers."""
+    global _warp_threads
+    _warp_threads = threads
+
+
+def warp(filenames, outfile, nodata, cutline=None, alltouch=False, interpolation=0,
+         profile=None, **kwargs):
+    """Warp & mosaic image files into outfile in-process, with gdal.Warp.
+
+    kwargs are passed on to gdal.WarpOptions to set the output grid
+    (dstSRS, outputBounds, and xRes & yRes or width & height) or format
+    (default GTiff, or per profile; see output_profile).  Pixels outside
+    cutline, a GeoFeature, are nodata, except those touching its edge if
+    alltouch.  Warping uses WARP_THREADS threads, at most as many as
+    set_warp_threads allows, and WARP_MEMORY_LIMIT MB of working memory;
+    see settings_template.py.  Returns the output gdal Dataset, which is
+    finished writing when it's closed.
+    """
+    threads = getattr(settings(), 'WARP_THREADS', 'ALL_CPUS')
+    if _warp_threads is not None and (threads == 'ALL_CPUS' or int(threads) > _warp_threads):
+        threads = _warp_threads
+    options = {
+        'format': 'GTiff',
+        'resampleAlg': _resamplers[interpolation],
+        'srcNodata': nodata,
+        'dstNodata': nodata,
+        'multithread': True,
+        'warpMemoryLimit': getattr(settings(), 'WARP_MEMORY_LIMIT', 512),
+        'warpOptions': ['NUM_THREADS={}'.format(threads)],
+    }
+    if alltouch:
+        options['warpOptions'].append('CUTLINE_ALL_TOUCHED=TRUE')
+    if profile is not None:
+        data_type = gdal.Open(filenames[0]).GetRasterBand(1).DataType
+        options['format'], options['creationOptions'] = profile_options(profile, data_type)
+    options.update(kwargs)
+    with make_temp_dir(prefix='warp') as td:
+        if cutline is not None:
+            options['cutlineDSName'] = write_cutline(cutline, td)
+        verbose_out('gdal.Warp {} to {}: {}'.format(filenames, outfile, options), 4)
+        ds = gdal.Warp(outfile, filenames, options=gdal.WarpOptions(**options))
+    if ds is None:
+        raise RuntimeError('Error warping {} to {}: {}'.format(
+            filenames, outfile, gdal.GetLastErrorMsg()))
+    if profile is not None:
+        build_overviews(ds, profile)
+    return ds
 
 
 def vectorize(img, vector, oformat=None):
@@ -534,81 +669,128 @@ def vectorize(img, vector, oformat=None):
     return vector
 
 
-def mosaic(images, outfile, vector):
-    """Mosaic multiple files together without warping."""
-    # TODO confirm they all have the same nodata?
-    nd = images[0][0].nodata()
-    filenames = [i.filename() for i in images]
-
-    # check they all have same projection
-    srs_set = {i.srs() for i in images}
-    if len(srs_set) > 1:
-        raise ValueError("Input files have non-matching projections and must be warped")
-
-    # transform vector to image projection
-    extent = wktloads(transform_shape(vector.wkt_geometry(), vector.srs(), srs_set.pop())).bounds
-    ullr = "%f %f %f %f" % (extent[0], extent[3], extent[2], extent[1])
-
-    # run merge command
-    nodatastr = '-n %s -a_nodata %s -init %s' % (nd, nd, nd)
-    cmd = 'gdal_merge.py -o %s -ul_lr %s %s %s' % (outfile, ullr, nodatastr, " ".join(filenames))
-    result = subprocess.getstatusoutput(cmd)
-    VerboseOut('%s: %s' % (cmd, result), 4)
-    imgout = gippy.GeoImage(outfile, True)
-    imgout.add_meta(
-        'GIPS_MOSAIC_SOURCES',
-        ';'.join([os.path.basename(f) for f in filenames])
-    )
+def _copy_band_info(images, imgout):
+    """Copy the first image's band metadata, gain, and offset to imgout."""
     for b in range(0, images[0].nbands()):
         imgout[b].add_meta(images[0][b].meta())
+    imgout.set_gain(images[0][0].gain())
+    imgout.set_offset(images[0][0].offset())
+
+
+def _snap_bounds(bounds, origin, xres, yres):
+    """Grow bounds (minx, miny, maxx, maxy) out to the pixel grid with a corner at origin (x, y)."""
+    x, y = origin
+    # round first so float error doesn't grow bounds already on the grid by a pixel
+    return (x + math.floor(round((bounds[0] - x) / xres, 6)) * xres,
+            y + math.floor(round((bounds[1] - y) / yres, 6)) * yres,
+            x + math.ceil(round((bounds[2] - x) / xres, 6)) * xres,
+            y + math.ceil(round((bounds[3] - y) / yres, 6)) * yres)
+
+
+def mosaic(images, outfile, vector, res=None, crop=False, alltouch=True, interpolation=0,
+           profile=None):
+    """Mosaic GeoImages, cropped to vector, a GeoFeature, in one gdal.Warp.
+
+    Unless res (x, y) is given, the images must share a projection,
+    which the output keeps along with the first image's pixel grid, so
+    it isn't resampled; otherwise the output is warped to vector's
+    projection at res.  The output covers vector's bounds, or if crop,
+    their intersection with the images', grown out to whole pixels.
+    Pixels outside vector are nodata, except those touching its edge if
+    alltouch.  interpolation is 0, 1, or 2 for nearest neighbor,
+    bilinear, or cubic.  The output is written per profile; see
+    output_profile.
+    """
+    filenames = [i.filename() for i in images]
+    grid = {}
+    if res is None:
+        # check they all have same projection
+        srs_set = {i.srs() for i in images}
+        if len(srs_set) > 1:
+            raise ValueError("Input files have non-matching projections and must be warped")
+        srs = srs_set.pop()
+        pixel = images[0].resolution()
+        grid = {'xRes': abs(pixel.x()), 'yRes': abs(pixel.y())}
+    else:
+        srs = vector.srs()
+        grid = {'xRes': abs(res[0]), 'yRes': abs(res[1])}
+
+    # transform vector to output projection
+    extent = wktloads(transform_shape(vector.wkt_geometry(), vector.srs(), srs))
+    if crop:
+        footprints = []
+        for i in images:
+            ext = i.extent()
+            footprint = shapely.geometry.box(ext.x0(), ext.y0(), ext.x1(), ext.y1()).wkt
+            footprints.append(wktloads(transform_shape(footprint, i.srs(), srs)))
+        extent = extent.intersection(shapely.ops.unary_union(footprints))
+        if extent.is_empty:
+            raise ValueError("Site doesn't intersect the input files")
+    bounds = extent.bounds
+    if res is None:
+        ext = images[0].extent()
+        bounds = _snap_bounds(bounds, (ext.x0(), ext.y1()), grid['xRes'], grid['yRes'])
+
+    # GeoTIFFs are warped straight to outfile; other formats, such as COG,
+    # can't have metadata added afterward, so they're copied once it's done
+    direct = profile is None or output_profile(profile)['format'] == 'GTiff'
+    with make_temp_dir(dir=os.path.dirname(outfile) or None, prefix='mosaic') as td:
+        warped_fname = outfile if direct else os.path.join(td, os.path.basename(outfile))
+        ds = warp(filenames, warped_fname, images[0][0].nodata(), cutline=vector,
+                  alltouch=alltouch, interpolation=interpolation,
+                  profile=profile if direct else None, dstSRS=srs,
+                  outputBounds=bounds, **grid)
+        ds = None
+        imgout = gippy.GeoImage(warped_fname, True)
+        imgout.add_meta(
+            'GIPS_MOSAIC_SOURCES',
+            ';'.join([os.path.basename(f) for f in filenames])
+        )
+        _copy_band_info(images, imgout)
+        if not direct:
+            imgout = None
+            write_profile(warped_fname, outfile, profile)
+            imgout = gippy.GeoImage(outfile)
 
     #NOTE: CopyColorTable is not supported
     #imgout.CopyColorTable(images[0])
-    return crop2vector(imgout, vector)
+    return imgout
+
 
+def gridded_mosaic(images, outfile, rastermask, interpolation=0, profile=None):
+    """ Mosaic multiple files to grid and mask specified in rastermask
 
-def gridded_mosaic(images, outfile, rastermask, interpolation=0):
-    """ Mosaic multiple files to grid and mask specified in rastermask """
+    The files are warped in-process to a virtual raster on the mask's
+    grid, which is then masked as it's written to outfile, and
+    rewritten per profile if one's given; see output_profile.
+    """
     nd = images[0][0].nodata()
     mask_img = gippy.GeoImage(rastermask)
-    srs = mask_img.srs()
-    filenames = [images[0].filename()]
-    for f in range(1, len(images)):
-        filenames.append(images[f].filename())
-
-    imgout = gippy.GeoImage.create_from(mask_img, outfile,
-                                        len(images[0]), images[0].type().string())
-
-    imgout.set_nodata(nd)
-    nddata = np.empty((len(images[0]),
-                       mask_img.ysize(), mask_img.xsize()))
-    nddata[:] = nd
-    imgout.write(nddata)
-    imgout = None
-
-    # run warp command
-    resampler = ['near', 'bilinear', 'cubic']
-    cmd = "gdalwarp -t_srs '{}' -r {} {} {}".format(
-        srs,
-        resampler[interpolation],
-        " ".join(filenames),
-        outfile
-    )
-    status, output = subprocess.getstatusoutput(cmd)
-    verbose_out(' COMMAND: {}\n exit_status: {}\n output: {}'
-                .format(cmd, status, output ), 4)
-
-    imgout = gippy.GeoImage(outfile, True)
-    imgout.add_meta(
-        'GIPS_GRIDDED_MOSAIC_SOURCES',
-        ';'.join([os.path.basename(f) for f in filenames])
-    )
-    for b in range(0, images[0].nbands()):
-        imgout[b].add_meta(images[0][b].meta())
-    imgout.add_mask(mask_img[0])
-    imgout.set_gain(images[0][0].gain())
-    imgout.set_offset(images[0][0].offset())
-    imgout.save(outfile)
+    ext = mask_img.extent()
+    filenames = [i.filename() for i in images]
+
+    with make_temp_dir(dir=os.path.dirname(outfile) or None, prefix='gridded') as td:
+        vrt_fname = os.path.join(td, 'warped.vrt')
+        ds = warp(filenames, vrt_fname, nd, interpolation=interpolation, format='VRT',
+                  dstSRS=mask_img.srs(), width=mask_img.xsize(), height=mask_img.ysize(),
+                  outputBounds=(ext.x0(), ext.y0(), ext.x1(), ext.y1()))
+        ds = None
+        imgout = gippy.GeoImage(vrt_fname)
+        imgout.add_meta(
+            'GIPS_GRIDDED_MOSAIC_SOURCES',
+            ';'.join([os.path.basename(f) for f in filenames])
+        )
+        imgout.add_mask(mask_img[0])
+        _copy_band_info(images, imgout)
+        if profile is None:
+            imgout.save(outfile)
+        else:
+            # gippy can't take creation options, so GDAL rewrites it
+            masked_fname = os.path.join(td, os.path.basename(outfile))
+            imgout.save(masked_fname)
+            imgout = None
+            write_profile(masked_fname, outfile, profile)
+        imgout = None
 
 
 def vrt_mosaic(filenames, outpath, interpolation=0, res=None, rastermask=None, site=None):
@@ -633,7 +815,7 @@ def vrt_mosaic(filenames, outpath, interpolation=0, res=None, rastermask=None, s
         if not sr.IsSame(site_sr):
             raise ValueError("Vector is not is the same projection as input files.")
 
-    extent = []
+    bounds = None
     if rastermask:
         mask_img = GeoImage(rastermask)
         mask_sr = osr.SpatialReference()
@@ -641,32 +823,36 @@ def vrt_mosaic(filenames, outpath, interpolation=0, res=None, rastermask=None, s
         if not sr.IsSame(mask_sr):
             raise ValueError("Raster mask is not in the same projection as input files.")
         ext = mask_img.extent()
-        extent = [
-            '-te',
-            ext.x0(), ext.y0(),
-            ext.x1(), ext.y1()
-        ]
+        bounds = (ext.x0(), ext.y0(), ext.x1(), ext.y1())
         mask_img = None
     elif res is not None:
         ext = site.extent()
         xshift = -0.5 * abs(res[0])
         yshift = -0.5 * abs(res[1])
-        extent = [
-            '-te',
-            ext.x0() + xshift, ext.y0() + yshift,
-            ext.x1() + xshift, ext.y1() + yshift
-        ]
-    extent = [str(v) for v in extent]
-
-    resampler = ['near', 'bilinear', 'cubic']
-    buildvrt_args = [
-        'gdalbuildvrt', '-r', resampler[interpolation]
-    ]
-    buildvrt_args.extend(extent)
-    buildvrt_args.append(outpath)
-    buildvrt_args.extend(filenames)
-    print('gdalbuildvrt args:', buildvrt_args)
-    subprocess.check_call(buildvrt_args)
+        bounds = (ext.x0() + xshift, ext.y0() + yshift,
+                  ext.x1() + xshift, ext.y1() + yshift)
+
+    options = {'resampleAlg': _resamplers[interpolation], 'outputBounds': bounds}
+    verbose_out('gdal.BuildVRT {} to {}: {}'.format(filenames, outpath, options), 4)
+    ds = gdal.BuildVRT(outpath, filenames, options=gdal.BuildVRTOptions(**options))
+    if ds is None:
+        raise RuntimeError('Error building {}: {}'.format(outpath, gdal.GetLastErrorMsg()))
+    ds = None
+
+
+def process_chunks(in_bands, imgout, func):
+    """Generate an image's bands one chunk at a time to bound memory use.
+
+    For each chunk of imgout (sized per gippy.Options.set_chunksize),
+    func is passed the chunk's arrays read from each GeoRaster in
+    in_bands, and returns one array per band of imgout, in band order.
+    The GeoRasters must be the same size as imgout.  Returns imgout.
+    """
+    for chunk in imgout.chunks():
+        outputs = func(*[band.read(chunk) for band in in_bands])
+        for i, arr in enumerate(outputs):
+            imgout[i].write(arr, chunk)
+    return imgout
 
 
 def julian_date(date_and_time, variant=None):
@@ -768,7 +954,8 @@ def cli_error_handler(msg_prefix='Error', continuable=False):
         yield
     except Exception as e:
         e.msg_prefix = msg_prefix # for use by gips_exit
-        e.tb_text = traceback.format_exc()
+        # errors relayed from worker processes carry their original traceback
+        e.tb_text = getattr(e, 'worker_tb_text', '') + traceback.format_exc()
         _accumulated_errors.append(e)
         if continuable and not _stop_on_error:
             report_error(e, msg_prefix)
@@ -776,6 +963,27 @@ def cli_error_handler(msg_prefix='Error', continuable=False):
             gips_exit()
 
 
+@contextmanager
+def worker_error_handler(msg_prefix='Error', continuable=False):
+    """Handle errors for GIPS code running in a worker process.
+
+    Like cli_error_handler, errors are accumulated, but they aren't
+    reported here; the parent process relays them to the user instead.
+    Non-continuable errors are re-raised so the worker can give up on
+    its current unit of work without exiting.
+    """
+    try:
+        yield
+    except Exception as e:
+        if not hasattr(e, 'msg_prefix'): # only the innermost handler records the error
+            e.msg_prefix = msg_prefix
+            e.tb_text = traceback.format_exc()
+        if continuable and not _stop_on_error:
+            _accumulated_errors.append(e)
+        else:
+            raise
+
+
 def gips_script_setup(driver_string=None, stop_on_error=False, setup_orm=True):
     """Run this at the beginning of a GIPS CLI program.
 
@@ -837,10 +1045,41 @@ def stringify_meta_dict(md):
 
     return {str(k): stringify(v) for (k, v) in md.items()}
 
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def http_session():
+    """Return a requests.Session shared by the whole process.
+
+    Sharing lets concurrent fetches reuse connections.  At most
+    settings().FETCH_HOST_CONNECTIONS (default 4) connections are open
+    to any one host; further requests wait for a free connection, which
+    limits per-host concurrency.
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            host_conns = getattr(settings(), 'FETCH_HOST_CONNECTIONS', 4)
+            adapter = requests.adapters.HTTPAdapter(
+                pool_maxsize=host_conns, pool_block=True)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _http_session = session
+        return _http_session
+
+def _reset_http_session():
+    """Forked children mustn't share the parent's connections."""
+    global _http_session, _http_session_lock
+    _http_session = None
+    _http_session_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_http_session)
+
 def http_download(url, full_path, chunk_size=512 * 1024):
     """Download a file via http GET, saving to the given file path."""
-    r = requests.get(url, stream=True)
-    r.raise_for_status()
-    with open(full_path, 'wb') as fo:
-        # 'if c' filters out keep-alive new chunks
-        [fo.write(c) for c in r.iter_content(chunk_size=chunk_size) if c]
+    with http_session().get(url, stream=True) as r:
+        r.raise_for_status()
+        with open(full_path, 'wb') as fo:
+            # 'if c' filters out keep-alive new chunks
+            [fo.write(c) for c in r.iter_content(chunk_size=chunk_size) if c]